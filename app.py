@@ -1,36 +1,49 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, Response
 import uuid
-from github_analyzer import analyze_repository
-from chat_handler import handle_chat, handle_modify_request, apply_changes
+from github_analyzer import analyze_repository, get_remote_head_sha
+from chat_handler import handle_chat_async, handle_chat_stream, handle_modify_request_async, apply_changes
 from dotenv import load_dotenv
 import os
 import sys
 import db
 import traceback
 import json
-import openai
+import threading
 from code_modifier import CodeModifier
+from vector_index import index_manager
+from caches import cache_stats, answer_cache, analyze_flight, normalize_repo_url
+from model_router import route_stats
+from llm_client import get_provider
+from file_store import file_metadata
 
 load_dotenv()
 
-import openai
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-
 key = os.environ.get("OPENAI_API_KEY")
-print(f"[DEBUG] OPENAI_API_KEY loaded: {key[:8]}...{key[-4:] if key else ''}")
+if key:
+    print(f"[DEBUG] OPENAI_API_KEY loaded: {key[:8]}...{key[-4:]}")
 
-if not key:
+# 모의 제공자(LLM_PROVIDER=fake)나 로컬 호환 서버(LLM_BASE_URL)는 API 키 없이 실행 가능
+if not get_provider().is_configured():
     print("오류: OpenAI API 키가 설정되어 있지 않습니다. .env 파일에 OPENAI_API_KEY를 등록하세요.")
     sys.exit(1)
 
 db.init_db()
 
+# 세션 데이터 변경/저장 잠금 (요청 스레드와 백그라운드 작업(재인덱싱 등)이 함께 쓰므로,
+# sessions를 바꾸는 코드와 저장은 이 잠금 안에서 실행)
+sessions_lock = threading.RLock()
+
 # 세션 데이터를 파일에 저장하고 로드하는 함수
 def save_sessions(sessions_data):
     try:
         os.makedirs('sessions', exist_ok=True)
-        with open('sessions/sessions.json', 'w', encoding='utf-8') as f:
-            json.dump(sessions_data, f, ensure_ascii=False, indent=2)
+        with sessions_lock:
+            text = json.dumps(sessions_data, ensure_ascii=False, indent=2)
+            # 임시 파일에 쓴 뒤 교체하여 저장 중에 읽거나 실패해도 이전 파일이 깨지지 않도록 함
+            tmp_path = 'sessions/sessions.json.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, 'sessions/sessions.json')
         print(f"[DEBUG] 세션 데이터 저장 완료 (세션 수: {len(sessions_data)})")
     except Exception as e:
         print(f"[DEBUG] 세션 데이터 저장 오류: {e}")
@@ -46,9 +59,138 @@ def load_sessions():
         print(f"[DEBUG] 세션 데이터 로드 오류: {e}")
     return {}
 
+def analyze_progress(repo_url, token, session_id):
+    """
+    저장소를 분석하고 세션을 만들면서 진행 상황을 NDJSON 줄로 생성 (/analyze 응답 본문)
+
+    WSGI(app.py)와 ASGI(asgi.py) 서버가 같이 사용합니다.
+    같은 저장소의 같은 커밋(원격 HEAD)을 분석 중이면(중복 클릭 등) 새로 분석하지 않고
+    진행 중인 분석이 끝나기를 기다려 그 세션을 함께 사용합니다.
+    원격 HEAD 커밋을 확인하지 못하면(네트워크 오류, 권한 없음 등) 합류 없이 단독으로 분석합니다.
+    """
+    yield json.dumps({'status': '분석 시작', 'progress': 0}) + '\n'
+
+    head_sha = get_remote_head_sha(repo_url, token)
+    if head_sha is None:
+        # 커밋을 확인하지 못하면 다른 커밋의 분석과 합치지 않도록 단독으로 분석
+        print(f"[DEBUG] 원격 HEAD 커밋을 확인하지 못해 분석 합류 없이 진행: {repo_url}")
+        yield from _run_analysis(repo_url, token, session_id)
+        return
+    key = (normalize_repo_url(repo_url), head_sha)
+    future, leader = analyze_flight.begin(key)
+    if not leader:
+        print(f"[DEBUG] 진행 중인 분석에 합류: {key}")
+        yield json.dumps({'status': '같은 저장소를 분석 중입니다. 완료를 기다리는 중...', 'progress': 10}) + '\n'
+        try:
+            yield json.dumps(dict(future.result(), coalesced=True)) + '\n'
+        except Exception as e:
+            yield json.dumps({'status': '에러', 'error': str(e), 'progress': -1}) + '\n'
+        return
+
+    final = None
+    try:
+        for line in _run_analysis(repo_url, token, session_id):
+            final = line
+            yield line
+    finally:
+        # 마지막 줄(완료 또는 에러)을 기다리던 요청들에 전달
+        result = json.loads(final) if final else {}
+        if result.get('progress') not in (100, -1):
+            result = {'status': '에러', 'error': '분석이 중단되었습니다. 다시 시도해주세요.', 'progress': -1}
+        analyze_flight.finish(key, future, result)
+
+def _run_analysis(repo_url, token, session_id):
+    # analyze_progress의 실제 분석 단계 (진행 상황 줄 생성, 마지막 줄은 완료 또는 에러)
+    try:
+        # 저장소 분석 시작
+        yield json.dumps({'status': '저장소 클론 중...', 'progress': 10}) + '\n'
+
+        print(f"[DEBUG] analyze_repository 호출 시작 (repo_url: {repo_url}, session_id: {session_id})")
+        try:
+            result = analyze_repository(repo_url, token, session_id)
+            print(f"[DEBUG] analyze_repository 결과: {list(result.keys())}")
+
+            if 'files' not in result or 'directory_structure' not in result:
+                print(f"[ERROR] analyze_repository 결과가 올바르지 않습니다: {result}")
+                raise Exception("analyze_repository가 올바른 결과를 반환하지 않았습니다.")
+
+            files = result['files']
+            directory_structure = result['directory_structure']
+            commit_sha = result.get('commit_sha')
+
+            print(f"[DEBUG] 분석된 파일 수: {len(files)}")
+            print(f"[DEBUG] 디렉토리 구조 길이: {len(directory_structure) if directory_structure else 0}")
+
+            yield json.dumps({'status': '파일 분석 완료', 'progress': 60}) + '\n'
+        except Exception as e:
+            print(f"[ERROR] analyze_repository 호출 중 오류: {e}")
+            traceback.print_exc()
+            raise e
+
+        # 디렉토리 구조 정보 로그 추가
+        if directory_structure:
+            print(f"[DEBUG] 디렉토리 구조 정보 생성 성공 (길이: {len(directory_structure)} 문자)")
+            print(f"[DEBUG] 디렉토리 구조 줄 수: {directory_structure.count(chr(10)) + 1}")
+            yield json.dumps({'status': '디렉토리 구조 생성 완료', 'progress': 80}) + '\n'
+        else:
+            print("[DEBUG] 디렉토리 구조 정보가 생성되지 않았습니다.")
+            yield json.dumps({'status': '디렉토리 구조 생성 실패', 'progress': 80}) + '\n'
+
+        with sessions_lock:
+            # 기존 세션들 비활성화
+            for sid in sessions:
+                sessions[sid]['is_active'] = False
+
+            # 새 세션 데이터 저장 및 활성화
+            sessions[session_id] = {
+                'repo_url': repo_url,
+                'token': token,
+                'files': file_metadata(files),  # 내용은 세션 파일 저장소가 로컬 클론에서 필요할 때 읽음
+                'directory_structure': directory_structure,
+                'commit_sha': commit_sha,
+                'is_active': True  # 새 세션 활성화
+            }
+
+        # 재분석 시 같은 저장소의 다른 커밋에 대한 캐시 답변 무효화
+        answer_cache.invalidate(repo_url, keep_commit=commit_sha)
+
+        # 세션 데이터를 파일에 저장
+        save_sessions(sessions)
+
+        yield json.dumps({'status': '세션 데이터 저장 완료', 'progress': 90}) + '\n'
+        yield json.dumps({
+            'status': '분석 완료', 
+            'progress': 100,
+            'session_id': session_id, 
+            'file_count': len(files)
+        }) + '\n'
+
+    except Exception as e:
+        error_msg = str(e)
+        print(f"[ERROR] 저장소 분석 중 오류 발생: {error_msg}")
+        yield json.dumps({'status': '에러', 'error': error_msg, 'progress': -1}) + '\n'
+
+def chat_error_body(msg):
+    """/chat 처리 중 예외 메시지를 사용자용 오류 메시지로 변환"""
+    if 'OPENAI_API_KEY' in msg:
+        return {'error': 'OpenAI API 키가 올바르지 않거나 누락되었습니다.'}
+    elif 'context length' in msg:
+        return {'error': '질문 또는 코드가 너무 깁니다. 질문을 더 짧게 입력해 주세요.'}
+    return {'error': f'답변 생성 중 오류: {msg}'}
+
+def modify_error_body(msg):
+    """/modify_request 처리 중 예외 메시지를 사용자용 오류 메시지로 변환"""
+    if 'OPENAI_API_KEY' in msg:
+        return {'error': 'OpenAI API 키가 올바르지 않거나 누락되었습니다.'}
+    elif 'context length' in msg:
+        return {'error': '수정 요청 또는 코드가 너무 깁니다. 요청을 더 구체적으로 입력해 주세요.'}
+    return {'error': f'코드 수정 중 오류: {msg}'}
+
 app = Flask(__name__)
 
 sessions = load_sessions()  # session_id: {'repo_url': ..., 'token': ..., 'files': ...}
+# 인덱스 수명 관리 점검을 백그라운드 타이머로 시작 (오래된 인덱스 저장본과 세션이 없어진 컬렉션 정리)
+index_manager.start(session_exists=lambda sid: sid in sessions)
 
 @app.route('/')
 def index():
@@ -70,82 +212,14 @@ def analyze():
         # 새 세션 ID 생성
         session_id = str(uuid.uuid4())
         
-        # 분석 진행 상황을 위한 응답 헤더 설정
-        def generate_progress():
-            yield json.dumps({'status': '분석 시작', 'progress': 0}) + '\n'
-            
-            try:
-                # 저장소 분석 시작
-                yield json.dumps({'status': '저장소 클론 중...', 'progress': 10}) + '\n'
-                
-                print(f"[DEBUG] analyze_repository 호출 시작 (repo_url: {repo_url}, session_id: {session_id})")
-                try:
-                    result = analyze_repository(repo_url, token, session_id)
-                    print(f"[DEBUG] analyze_repository 결과: {list(result.keys())}")
-                    
-                    if 'files' not in result or 'directory_structure' not in result:
-                        print(f"[ERROR] analyze_repository 결과가 올바르지 않습니다: {result}")
-                        raise Exception("analyze_repository가 올바른 결과를 반환하지 않았습니다.")
-                    
-                    files = result['files']
-                    directory_structure = result['directory_structure']
-                    
-                    print(f"[DEBUG] 분석된 파일 수: {len(files)}")
-                    print(f"[DEBUG] 디렉토리 구조 길이: {len(directory_structure) if directory_structure else 0}")
-                    
-                    yield json.dumps({'status': '파일 분석 완료', 'progress': 60}) + '\n'
-                except Exception as e:
-                    print(f"[ERROR] analyze_repository 호출 중 오류: {e}")
-                    traceback.print_exc()
-                    raise e
-                
-                # 디렉토리 구조 정보 로그 추가
-                if directory_structure:
-                    print(f"[DEBUG] 디렉토리 구조 정보 생성 성공 (길이: {len(directory_structure)} 문자)")
-                    # 전체 디렉토리 구조 출력
-                    print("[DEBUG] 디렉토리 구조 전체:\n" + directory_structure)
-                    yield json.dumps({'status': '디렉토리 구조 생성 완료', 'progress': 80}) + '\n'
-                else:
-                    print("[DEBUG] 디렉토리 구조 정보가 생성되지 않았습니다.")
-                    yield json.dumps({'status': '디렉토리 구조 생성 실패', 'progress': 80}) + '\n'
-                
-                # 기존 세션들 비활성화
-                for sid in sessions:
-                    sessions[sid]['is_active'] = False
-                
-                # 새 세션 데이터 저장 및 활성화
-                sessions[session_id] = {
-                    'repo_url': repo_url,
-                    'token': token,
-                    'files': files,
-                    'directory_structure': directory_structure,
-                    'is_active': True  # 새 세션 활성화
-                }
-                
-                # 세션 데이터를 파일에 저장
-                save_sessions(sessions)
-                
-                yield json.dumps({'status': '세션 데이터 저장 완료', 'progress': 90}) + '\n'
-                yield json.dumps({
-                    'status': '분석 완료', 
-                    'progress': 100,
-                    'session_id': session_id, 
-                    'file_count': len(files)
-                }) + '\n'
-                
-            except Exception as e:
-                error_msg = str(e)
-                print(f"[ERROR] 저장소 분석 중 오류 발생: {error_msg}")
-                yield json.dumps({'status': '에러', 'error': error_msg, 'progress': -1}) + '\n'
-        
-        return Response(generate_progress(), mimetype='application/x-ndjson')
+        return Response(analyze_progress(repo_url, token, session_id), mimetype='application/x-ndjson')
     except Exception as e:
         print("[분석 알 수 없는 에러]", str(e))
         traceback.print_exc()
         return jsonify({'status': '에러', 'error': f'알 수 없는 오류: {str(e)}'}), 500
 
 @app.route('/chat', methods=['POST'])
-def chat_api():
+async def chat_api():
     try:
         data = request.get_json()
         session_id = data.get('session_id')
@@ -153,25 +227,46 @@ def chat_api():
         if not session_id or not message:
             return jsonify({'error': '세션ID와 질문을 모두 입력하세요.'}), 400
         try:
-            result = handle_chat(session_id, message)
+            result = await handle_chat_async(session_id, message, debug=app.debug or bool(data.get('debug')))
             return jsonify(result)
         except Exception as e:
             msg = str(e)
             print("[챗봇 에러]", msg)
             traceback.print_exc()
-            if 'OPENAI_API_KEY' in msg:
-                return jsonify({'error': 'OpenAI API 키가 올바르지 않거나 누락되었습니다.'}), 400
-            elif 'context length' in msg:
-                return jsonify({'error': '질문 또는 코드가 너무 깁니다. 질문을 더 짧게 입력해 주세요.'}), 400
-            else:
-                return jsonify({'error': f'답변 생성 중 오류: {msg}'}), 400
+            return jsonify(chat_error_body(msg)), 400
+    except Exception as e:
+        print("[챗봇 알 수 없는 에러]", str(e))
+        traceback.print_exc()
+        return jsonify({'error': f'알 수 없는 오류: {str(e)}'}), 500
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream_api():
+    # 답변을 토큰 단위로 NDJSON 스트리밍 (/analyze와 같은 방식)
+    try:
+        data = request.get_json()
+        session_id = data.get('session_id')
+        message = data.get('message')
+        if not session_id or not message:
+            return jsonify({'error': '세션ID와 질문을 모두 입력하세요.'}), 400
+        debug = app.debug or bool(data.get('debug'))
+        
+        def generate_answer():
+            try:
+                for event in handle_chat_stream(session_id, message, debug=debug):
+                    yield json.dumps(event, ensure_ascii=False) + '\n'
+            except Exception as e:
+                print("[챗봇 스트리밍 에러]", str(e))
+                traceback.print_exc()
+                yield json.dumps({'type': 'error', 'error': f'답변 생성 중 오류: {str(e)}'}, ensure_ascii=False) + '\n'
+        
+        return Response(generate_answer(), mimetype='application/x-ndjson')
     except Exception as e:
         print("[챗봇 알 수 없는 에러]", str(e))
         traceback.print_exc()
         return jsonify({'error': f'알 수 없는 오류: {str(e)}'}), 500
 
 @app.route('/modify_request', methods=['POST'])
-def modify_request():
+async def modify_request():
     try:
         data = request.get_json()
         session_id = data.get('session_id')
@@ -179,18 +274,13 @@ def modify_request():
         if not session_id or not message:
             return jsonify({'error': '세션ID와 수정 요청을 모두 입력하세요.'}), 400
         try:
-            result = handle_modify_request(session_id, message)
+            result = await handle_modify_request_async(session_id, message)
             return jsonify(result)
         except Exception as e:
             msg = str(e)
             print("[코드수정 에러]", msg)
             traceback.print_exc()
-            if 'OPENAI_API_KEY' in msg:
-                return jsonify({'error': 'OpenAI API 키가 올바르지 않거나 누락되었습니다.'}), 400
-            elif 'context length' in msg:
-                return jsonify({'error': '수정 요청 또는 코드가 너무 깁니다. 요청을 더 구체적으로 입력해 주세요.'}), 400
-            else:
-                return jsonify({'error': f'코드 수정 중 오류: {msg}'}), 400
+            return jsonify(modify_error_body(msg)), 400
     except Exception as e:
         print("[코드수정 알 수 없는 에러]", str(e))
         traceback.print_exc()
@@ -201,12 +291,11 @@ def apply_changes_api():
     try:
         data = request.get_json()
         session_id = data.get('session_id')
-        file_name = data.get('file_name')
-        new_content = data.get('new_content')
-        if not session_id or not file_name or not new_content:
-            return jsonify({'error': '세션ID, 파일명, 코드 내용을 모두 입력하세요.'}), 400
+        if not session_id:
+            return jsonify({'error': '세션ID를 입력하세요.'}), 400
         try:
-            result = apply_changes(session_id, file_name, new_content)
+            # 적용할 변경 묶음(파일 목록과 내용)은 세션에 저장된 제안에서 읽음
+            result = apply_changes(session_id, force=bool(data.get('force')))
             return jsonify(result)
         except Exception as e:
             msg = str(e)
@@ -380,5 +469,16 @@ def push_changes():
         traceback.print_exc()
         return jsonify({'error': f'알 수 없는 오류: {str(e)}'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # 캐시 적중률, 벡터 인덱스 메모리 사용량, 답변 경로별 지연/비용 지표
+    return jsonify({
+        'caches': cache_stats(),
+        'indexes': index_manager.stats(),
+        'routes': route_stats.stats()
+    })
+
 if __name__ == '__main__':
-    app.run(debug=True) 
+    # 동시 요청을 스레드로 처리하는 개발 서버 (비동기 서버는 asgi.py 참고)
+    app.run(debug=True, threaded=True)
+
@@ -0,0 +1,102 @@
+"""
+ASGI 서버 진입점
+
+/chat, /chat_stream, /modify_request, /analyze는 하나의 이벤트 루프에서 비동기로 처리하고,
+나머지 경로(페이지, 변경사항 적용, Git 작업, 지표)는 기존 Flask 앱을 스레드 풀에서 실행합니다.
+LLM 응답을 기다리는 동안 요청마다 스레드를 붙잡지 않으므로 동시 채팅 세션이 많을 때 처리량이 늘어납니다.
+
+실행:
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 8000
+
+세션 데이터(app.sessions)는 프로세스 메모리에 있으므로 워커는 하나만 사용합니다.
+"""
+
+import json
+import uuid
+import traceback
+
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+from chat_handler import handle_chat_async, handle_chat_stream_async, handle_modify_request_async
+
+
+async def _read_json(request: Request):
+    try:
+        return await request.json()
+    except Exception:
+        return {}
+
+
+async def chat_api(request: Request):
+    data = await _read_json(request)
+    session_id = data.get('session_id')
+    message = data.get('message')
+    if not session_id or not message:
+        return JSONResponse({'error': '세션ID와 질문을 모두 입력하세요.'}, status_code=400)
+    try:
+        result = await handle_chat_async(session_id, message, debug=bool(data.get('debug')))
+        return JSONResponse(result)
+    except Exception as e:
+        print("[챗봇 에러]", str(e))
+        traceback.print_exc()
+        return JSONResponse(flask_app.chat_error_body(str(e)), status_code=400)
+
+
+async def chat_stream_api(request: Request):
+    # 답변을 토큰 단위로 NDJSON 스트리밍
+    data = await _read_json(request)
+    session_id = data.get('session_id')
+    message = data.get('message')
+    if not session_id or not message:
+        return JSONResponse({'error': '세션ID와 질문을 모두 입력하세요.'}, status_code=400)
+
+    async def generate_answer():
+        try:
+            async for event in handle_chat_stream_async(session_id, message, debug=bool(data.get('debug'))):
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+        except Exception as e:
+            print("[챗봇 스트리밍 에러]", str(e))
+            traceback.print_exc()
+            yield json.dumps({'type': 'error', 'error': f'답변 생성 중 오류: {str(e)}'}, ensure_ascii=False) + '\n'
+
+    return StreamingResponse(generate_answer(), media_type='application/x-ndjson')
+
+
+async def modify_request(request: Request):
+    data = await _read_json(request)
+    session_id = data.get('session_id')
+    message = data.get('message')
+    if not session_id or not message:
+        return JSONResponse({'error': '세션ID와 수정 요청을 모두 입력하세요.'}, status_code=400)
+    try:
+        result = await handle_modify_request_async(session_id, message)
+        return JSONResponse(result)
+    except Exception as e:
+        print("[코드수정 에러]", str(e))
+        traceback.print_exc()
+        return JSONResponse(flask_app.modify_error_body(str(e)), status_code=400)
+
+
+async def analyze(request: Request):
+    data = await _read_json(request)
+    repo_url = data.get('repo_url')
+    token = data.get('token')
+    if not repo_url or not repo_url.startswith('https://github.com/'):
+        return JSONResponse({'status': '에러', 'error': '올바른 GitHub 저장소 URL을 입력하세요.'}, status_code=400)
+    # 클론/분석은 스레드 풀에서 진행하며 진행 상황을 줄 단위로 전송 (임베딩/요약은 분석 내부에서 asyncio로 병렬 처리)
+    return StreamingResponse(flask_app.analyze_progress(repo_url, token, str(uuid.uuid4())),
+                             media_type='application/x-ndjson')
+
+
+asgi_app = Starlette(routes=[
+    Route('/chat', chat_api, methods=['POST']),
+    Route('/chat_stream', chat_stream_api, methods=['POST']),
+    Route('/modify_request', modify_request, methods=['POST']),
+    Route('/analyze', analyze, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app.app)),
+])
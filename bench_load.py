@@ -0,0 +1,81 @@
+"""
+동시 요청 부하 테스트
+
+실행 중인 서버에 동시 사용자 수를 바꿔가며 /chat 요청을 보내고 처리량(req/s)과 지연 시간을 측정합니다.
+같은 세션/질문으로 WSGI 개발 서버(python app.py)와 ASGI 서버(uvicorn asgi:asgi_app)를 각각 측정해 비교합니다.
+
+사용법:
+    python bench_load.py --url http://127.0.0.1:5000 --session <session_id> [--concurrency 1,4,8,16] [--requests 32]
+    python bench_load.py --url http://127.0.0.1:8000 --session <session_id> --endpoint /modify_request
+
+답변 캐시에 적중하면 LLM 호출 없이 응답하므로, 질문마다 번호를 붙여 서로 다른 질문으로 보냅니다.
+--questions 파일(한 줄에 질문 하나)을 지정하면 그 질문들을 순서대로 사용합니다.
+"""
+
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_QUESTIONS = [
+    "이 프로젝트의 진입점은 어디야?",
+    "세션 데이터는 어떻게 저장돼?",
+    "벡터 검색은 어떤 함수에서 해?",
+    "오류 처리는 어떻게 하고 있어?",
+]
+
+
+def send(url, endpoint, session_id, message, timeout):
+    started = time.perf_counter()
+    try:
+        resp = requests.post(url + endpoint, json={'session_id': session_id, 'message': message}, timeout=timeout)
+        ok = resp.status_code == 200 and not resp.json().get('error')
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def run_level(url, endpoint, session_id, questions, concurrency, total, timeout):
+    messages = [f"{questions[i % len(questions)]} (#{i} c{concurrency})" for i in range(total)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda m: send(url, endpoint, session_id, m, timeout), messages))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(1 for ok, _ in results if not ok),
+        'rps': total / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="동시 요청 처리량/지연 시간 부하 테스트")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='서버 주소')
+    parser.add_argument('--session', required=True, help='분석이 끝난 세션 ID')
+    parser.add_argument('--endpoint', default='/chat', choices=['/chat', '/modify_request'])
+    parser.add_argument('--concurrency', default='1,4,8,16', help='동시 사용자 수 목록 (쉼표 구분)')
+    parser.add_argument('--requests', type=int, default=32, help='동시 사용자 수별 요청 수')
+    parser.add_argument('--questions', help='질문 파일 (한 줄에 하나)')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    print(f"{args.url}{args.endpoint} (세션: {args.session})")
+    print(f"{'동시':>6} {'요청':>6} {'오류':>6} {'req/s':>8} {'p50(s)':>8} {'p95(s)':>8}")
+    for level in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+        r = run_level(args.url.rstrip('/'), args.endpoint, args.session, questions, level, args.requests, args.timeout)
+        print(f"{r['concurrency']:>6} {r['requests']:>6} {r['errors']:>6} {r['rps']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
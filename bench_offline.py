@@ -0,0 +1,169 @@
+"""
+오프라인 종단 간 벤치마크 (수집 + 채팅)
+
+실제 API 대신 결정적 모의 LLM(llm_client.FakeLLM)으로 로컬 저장소를 수집(청크 분할, 임베딩, 역할 태깅,
+파일 요약, 인덱스 저장)한 뒤, 동시 사용자 수를 바꿔가며 채팅 파이프라인(임베딩, 검색, 재정렬,
+프롬프트 구성, 라우팅, LLM 호출, 기록 저장)의 처리량과 지연 시간을 측정합니다.
+모의 LLM의 지연/속도 제한/오류율을 실제 API와 비슷하게 맞추면 API 비용 없이 성능 변화를 비교할 수 있습니다.
+
+사용법:
+    python bench_offline.py --repo . [--latency-ms 400] [--token-latency-ms 15] [--embed-latency-ms 80]
+                            [--rate-limit-rps 0] [--error-rate 0] [--concurrency 1,4,8,16] [--requests 32]
+    python bench_offline.py --repo . --base-url http://127.0.0.1:8100/v1   # fake_llm_server.py 경유 (HTTP 포함)
+
+--mode thread는 handle_chat을 스레드 풀에서(WSGI 서버와 같은 방식), --mode async(기본)는
+handle_chat_async를 하나의 이벤트 루프에서(ASGI 서버와 같은 방식) 실행합니다.
+답변 캐시는 저장소 URL/커밋이 있는 세션에만 적용되므로 벤치마크 세션에서는 모든 질문이 파이프라인을 끝까지 거칩니다.
+"""
+
+import io
+import time
+import uuid
+import asyncio
+import argparse
+import contextlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_client import FakeLLM, FakeProvider, OpenAIProvider, set_provider
+
+QUESTIONS = [
+    "이 프로젝트의 진입점은 어디야?",
+    "세션 데이터는 어떻게 저장돼?",
+    "벡터 검색은 어떤 함수에서 해?",
+    "오류 처리는 어떻게 하고 있어?",
+    "임베딩은 어디서 만들어?",
+    "설정 값은 어떻게 읽어?",
+]
+
+
+def ingest(repo_path, session_id):
+    """로컬 저장소를 수집하여 (세션 데이터, 수집 결과 요약 줄 목록)을 반환"""
+    from bench_quantization import load_local_files
+    from github_analyzer import RepositoryEmbedder, chunk_files
+    from directory_tree import tree_from_paths, render_tree
+
+    files = load_local_files(repo_path)
+    n_chunks = len(chunk_files(files))
+    embedder = RepositoryEmbedder(session_id)
+    started = time.perf_counter()
+    embedder.process_and_embed(files)
+    embed_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    embedder.build_file_summary_index(files)
+    summary_seconds = time.perf_counter() - started
+    report = [
+        f"[수집] 파일 {len(files)}개, 청크 {n_chunks}개",
+        f"  임베딩+역할 태깅: {embed_seconds:.2f}s ({n_chunks / max(embed_seconds, 1e-9):.1f} 청크/s)",
+        f"  파일 요약 인덱스: {summary_seconds:.2f}s ({len(files) / max(summary_seconds, 1e-9):.1f} 파일/s)",
+    ]
+    session_data = {
+        'files': files,
+        'directory_structure': render_tree(tree_from_paths(f['path'] for f in files)),
+        'is_active': False
+    }
+    return session_data, report
+
+
+def summarize(concurrency, results, elapsed):
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': sum(1 for ok, _ in results if not ok),
+        'rps': len(results) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def run_thread_level(session_id, messages, concurrency):
+    from chat_handler import handle_chat
+
+    def send(message):
+        started = time.perf_counter()
+        result = handle_chat(session_id, message)
+        return not result.get('error'), time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, messages))
+    return summarize(concurrency, results, time.perf_counter() - started)
+
+
+def run_async_level(session_id, messages, concurrency):
+    from chat_handler import handle_chat_async
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(message):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await handle_chat_async(session_id, message)
+                return not result.get('error'), time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[send(m) for m in messages])
+        return summarize(concurrency, results, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="모의 LLM으로 수집/채팅 처리량을 오프라인 측정")
+    parser.add_argument('--repo', default='.', help='수집할 로컬 저장소 경로')
+    parser.add_argument('--base-url', help='fake_llm_server.py 주소 (지정하지 않으면 프로세스 안의 모의 제공자 사용)')
+    parser.add_argument('--latency-ms', type=float, default=400.0, help='채팅 응답의 첫 토큰까지 지연 시간')
+    parser.add_argument('--token-latency-ms', type=float, default=15.0, help='출력 토큰당 지연 시간')
+    parser.add_argument('--embed-latency-ms', type=float, default=80.0, help='임베딩 요청당 지연 시간')
+    parser.add_argument('--rate-limit-rps', type=float, default=0.0, help='초당 허용 요청 수 (0이면 제한 없음)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500 오류 주입 확률')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', default='async', choices=['async', 'thread'])
+    parser.add_argument('--concurrency', default='1,4,8,16', help='동시 사용자 수 목록 (쉼표 구분)')
+    parser.add_argument('--requests', type=int, default=32, help='동시 사용자 수별 요청 수')
+    parser.add_argument('--verbose', action='store_true', help='수집/채팅 단계의 디버그 로그 출력')
+    args = parser.parse_args()
+
+    fake = None
+    if args.base_url:
+        set_provider(OpenAIProvider(base_url=args.base_url))
+    else:
+        fake = FakeLLM(latency_ms=args.latency_ms, token_latency_ms=args.token_latency_ms,
+                       embed_latency_ms=args.embed_latency_ms, rate_limit_rps=args.rate_limit_rps,
+                       error_rate=args.error_rate, seed=args.seed)
+        set_provider(FakeProvider(fake))
+
+    import app
+    from vector_index import delete_index, INDEX_KINDS
+    from model_router import route_stats
+
+    session_id = f"bench_{uuid.uuid4().hex[:8]}"
+    run_level = run_async_level if args.mode == 'async' else run_thread_level
+    levels = []
+    # 파이프라인의 디버그 로그는 결과 표와 섞이지 않도록 기본적으로 숨김
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            app.sessions[session_id], report = ingest(args.repo, session_id)
+            for level in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+                messages = [f"{QUESTIONS[i % len(QUESTIONS)]} (#{i} c{level})" for i in range(args.requests)]
+                levels.append(run_level(session_id, messages, level))
+    finally:
+        app.sessions.pop(session_id, None)
+        for kind in INDEX_KINDS:
+            delete_index(session_id, kind)
+
+    print('\n' + '\n'.join(report))
+    print(f"\n[채팅] 모드: {args.mode}")
+    print(f"{'동시':>6} {'요청':>6} {'오류':>6} {'req/s':>8} {'p50(s)':>8} {'p95(s)':>8}")
+    for r in levels:
+        print(f"{r['concurrency']:>6} {r['requests']:>6} {r['errors']:>6} {r['rps']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f}")
+    print(f"\n[경로] {route_stats.stats()}")
+    if fake is not None:
+        print(f"[모의 LLM] {fake.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+임베딩 압축 저장 벤치마크
+
+로컬 저장소를 청크로 나누고 임베딩한 뒤, float32 원본 인덱스를 기준으로
+float16 / int8 양자화 / 차원 축소 인덱스의 메모리 사용량과 recall@5를 비교합니다.
+
+사용법:
+    python bench_quantization.py --repo ./repos/<session_id> [--queries 200] [--cache emb.npz]
+
+질의는 무작위로 고른 청크의 앞부분 텍스트를 임베딩해 사용합니다.
+--cache를 지정하면 임베딩을 파일에 저장해 다음 실행부터 API를 호출하지 않습니다.
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+from dotenv import load_dotenv
+
+from github_analyzer import MAIN_EXTENSIONS, chunk_files
+from vector_index import NumpyVectorIndex
+from llm_client import get_provider
+from file_store import decode_source
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+BATCH_SIZE = 100
+TOP_N = 5
+# (검색 행렬 타입, 차원 축소)
+VARIANTS = [
+    ('float16', None),
+    ('int8', None),
+    ('float32', 512),
+    ('int8', 512),
+    ('int8', 256),
+]
+
+
+def load_local_files(repo_path):
+    files = []
+    for root, dirs, names in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if not any(name.endswith(ext) for ext in MAIN_EXTENSIONS):
+                continue
+            full_path = os.path.join(root, name)
+            with open(full_path, 'rb') as f:
+                content, _ = decode_source(f.read())
+            if content.strip():
+                files.append({'path': os.path.relpath(full_path, repo_path), 'content': content, 'file_name': name})
+    return files
+
+
+def embed_texts(provider, texts):
+    vectors = []
+    for start in range(0, len(texts), BATCH_SIZE):
+        vectors.extend(provider.embed(texts[start:start + BATCH_SIZE], model=EMBEDDING_MODEL))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def build_index(base_dir, name, dtype, dimensions, embeddings):
+    index = NumpyVectorIndex(name, dtype=dtype, dimensions=dimensions, base_dir=base_dir)
+    ids = [str(i) for i in range(len(embeddings))]
+    index.add(ids=ids, embeddings=embeddings, documents=[''] * len(ids), metadatas=[{} for _ in ids])
+    index.persist()
+    return index
+
+
+def run_queries(index, queries):
+    start = time.perf_counter()
+    hits = [index.query([q], n_results=TOP_N, include=['distances'])['ids'][0] for q in queries]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+    return hits, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="임베딩 압축 저장 메모리/recall 벤치마크")
+    parser.add_argument('--repo', required=True, help="분석할 로컬 저장소 경로")
+    parser.add_argument('--queries', type=int, default=200, help="질의 수")
+    parser.add_argument('--cache', help="임베딩 캐시 파일 (.npz)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    load_dotenv()
+    random.seed(args.seed)
+
+    if args.cache and os.path.exists(args.cache):
+        cached = np.load(args.cache)
+        embeddings, queries = cached['embeddings'], cached['queries']
+        print(f"[DEBUG] 캐시된 임베딩 사용: {args.cache}")
+    else:
+        files = load_local_files(args.repo)
+        chunks = [c[0] for c in chunk_files(files)]
+        print(f"[DEBUG] 파일 {len(files)}개, 청크 {len(chunks)}개")
+        sample = random.sample(chunks, min(args.queries, len(chunks)))
+        query_texts = [text[:200] for text in sample]
+        provider = get_provider()
+        embeddings = embed_texts(provider, chunks)
+        queries = embed_texts(provider, query_texts)
+        if args.cache:
+            np.savez(args.cache, embeddings=embeddings, queries=queries)
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        baseline = build_index(base_dir, 'baseline', 'float32', None, embeddings)
+        truth, base_ms = run_queries(baseline, queries)
+        base_mem = baseline.memory_bytes()
+        print(f"\n청크 {len(embeddings)}개, 차원 {embeddings.shape[1]}, 질의 {len(queries)}개\n")
+        print(f"{'variant':<18}{'memory':>12}{'ratio':>8}{'disk':>12}{'recall@5':>10}{'ms/query':>10}")
+        print(f"{'float32 (base)':<18}{base_mem:>12,}{1.0:>8.2f}{baseline.disk_bytes():>12,}{1.0:>10.3f}{base_ms:>10.2f}")
+        for dtype, dimensions in VARIANTS:
+            name = f"{dtype}_{dimensions or 'full'}"
+            index = build_index(base_dir, name, dtype, dimensions, embeddings)
+            hits, ms = run_queries(index, queries)
+            recall = np.mean([len(set(h) & set(t)) / max(len(t), 1) for h, t in zip(hits, truth)])
+            mem = index.memory_bytes()
+            print(f"{name:<18}{mem:>12,}{mem / base_mem:>8.2f}{index.disk_bytes():>12,}{recall:>10.3f}{ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
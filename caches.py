@@ -0,0 +1,398 @@
+"""
+캐시 모듈
+
+질문 임베딩처럼 같은 입력에 대해 같은 결과를 돌려주는 API 호출 결과를
+메모리에 보관하여 반복 호출을 줄입니다.
+
+주요 구성:
+    - LRUCache: 크기 제한(LRU)과 만료 시간(TTL)을 갖는 스레드 안전 캐시
+    - normalize_text: 캐시 키로 쓰기 위한 텍스트 정규화
+    - embedding_cache: 질문 임베딩 캐시 (키: (모델, 정규화된 질문))
+    - SemanticAnswerCache: 질문 임베딩 유사도로 찾는 답변 캐시 (저장소 URL + 커밋 SHA 범위)
+    - file_content_cache: 세션 파일 내용 캐시 (내용 길이의 합으로 메모리 사용량 제한)
+    - PromptCacheStats: API 응답의 캐시된 프롬프트 토큰 수 집계 (제공자 측 프롬프트 캐시 효과 확인)
+    - SingleFlight: 같은 키로 동시에 들어온 요청을 하나의 실행 결과로 합침
+    - cache_stats: 모든 캐시의 적중률 등 지표
+"""
+
+import os
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# ----------------- 상수 정의 -----------------
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024"))  # 최대 항목 수
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(24 * 3600)))  # 0이면 만료 없음
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))  # 캐시 답변으로 인정할 최소 코사인 유사도
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))  # 저장소/커밋별 최대 답변 수
+FILE_CACHE_MAX_CHARS = int(os.environ.get("FILE_CACHE_MAX_MB", "64")) * 1024 * 1024  # 메모리에 둘 파일 내용 총량 (문자 수)
+FILE_CACHE_MAX_FILES = 4096  # 메모리에 둘 최대 파일 수
+
+
+def normalize_text(text: str) -> str:
+    """유니코드 정규화(NFC) 후 연속 공백을 하나로 합치고 앞뒤 공백 제거"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+class LRUCache:
+    """
+    크기 제한과 만료 시간을 갖는 스레드 안전 LRU 캐시
+
+    가장 오래 사용되지 않은 항목부터 제거하며, TTL이 지난 항목은 조회 시 제거됩니다.
+    weigher를 지정하면 항목 수와 함께 항목 무게(예: 바이트 수)의 합도 max_weight 이하로 유지합니다.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None,
+                 max_weight: Optional[int] = None, weigher: Optional[Callable[[Any], int]] = None):
+        """
+        Args:
+            name (str): 지표에 표시할 캐시 이름
+            maxsize (int): 최대 항목 수
+            ttl (Optional[float]): 항목 만료 시간(초), None 또는 0이면 만료 없음
+            max_weight (Optional[int]): 항목 무게 합의 최대값 (weigher와 함께 지정)
+            weigher (Optional[Callable[[Any], int]]): 값의 무게 계산 함수
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.max_weight = max_weight if weigher else None
+        self.weigher = weigher
+        self.weight = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, 저장 시각, 무게)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: Hashable):
+        self.weight -= self._data.pop(key)[2]
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """캐시된 값을 반환, 없거나 만료되었으면 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """값을 저장하고 크기(또는 무게 합)를 넘으면 가장 오래 사용되지 않은 항목 제거"""
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return  # 혼자서도 상한을 넘는 값은 저장하지 않음
+            self._data[key] = (value, time.time(), weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (self.max_weight is not None and self.weight > self.max_weight):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        """항목 제거 (없으면 무시)"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        캐시된 값이 있으면 반환하고, 없으면 factory()로 만들어 저장 후 반환
+
+        factory는 락 밖에서 실행되므로 느린 API 호출이 다른 스레드의 조회를 막지 않습니다.
+        빈 값(None, 빈 리스트 등)은 저장하지 않습니다.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = factory()
+        if value:
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """적중/미스 횟수, 적중률, 현재 크기 등 캐시 지표"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                **({'weight': self.weight, 'max_weight': self.max_weight} if self.max_weight is not None else {})
+            }
+
+
+def normalize_repo_url(repo_url: str) -> str:
+    """같은 저장소를 가리키는 URL이 같은 키가 되도록 정규화 (끝의 / 와 .git 제거, 소문자)"""
+    url = (repo_url or '').strip().rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    return url.lower()
+
+
+class SemanticAnswerCache:
+    """
+    질문 임베딩의 코사인 유사도로 이전 답변을 찾는 캐시
+
+    답변은 (저장소 URL, 커밋 SHA) 범위별로 저장되어, 같은 커밋을 분석한 다른 세션과도 공유됩니다.
+    범위마다 ANSWER_CACHE_MAX_ENTRIES개를 넘으면 가장 오래 사용되지 않은 답변부터 제거합니다.
+    """
+
+    def __init__(self, name: str, threshold: float, max_entries: int):
+        self.name = name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._scopes: Dict[tuple, "OrderedDict[str, Dict[str, Any]]"] = {}  # (repo_url, commit_sha) -> 질문 -> 항목
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+    def lookup(self, repo_url: str, commit_sha: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        유사도가 threshold 이상인 가장 비슷한 질문의 답변 항목을 반환
+
+        Returns:
+            Optional[Dict[str, Any]]: {'question', 'answer', 'similarity', 'prompt_tokens', 'completion_tokens'} 또는 None
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            self.lookups += 1
+            entries = self._scopes.get((normalize_repo_url(repo_url), commit_sha))
+            if not entries:
+                return None
+            keys = list(entries.keys())
+            similarity = np.stack([entries[k]['embedding'] for k in keys]) @ query
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.threshold:
+                return None
+            entry = entries[keys[best]]
+            entries.move_to_end(keys[best])
+            self.hits += 1
+            self.saved_prompt_tokens += entry['prompt_tokens']
+            self.saved_completion_tokens += entry['completion_tokens']
+            result = {k: v for k, v in entry.items() if k != 'embedding'}
+            result['similarity'] = round(float(similarity[best]), 4)
+            return result
+
+    def store(self, repo_url: str, commit_sha: str, embedding: List[float], question: str, answer: str,
+              prompt_tokens: int = 0, completion_tokens: int = 0):
+        """답변을 저장 (같은 질문이면 덮어씀)"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            entries = self._scopes.setdefault((normalize_repo_url(repo_url), commit_sha), OrderedDict())
+            entries[normalize_text(question)] = {
+                'embedding': vector,
+                'question': question,
+                'answer': answer,
+                'prompt_tokens': prompt_tokens or 0,
+                'completion_tokens': completion_tokens or 0
+            }
+            entries.move_to_end(normalize_text(question))
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, repo_url: str, keep_commit: Optional[str] = None) -> int:
+        """
+        저장소의 캐시된 답변 제거 (keep_commit이 주어지면 그 커밋의 답변은 유지)
+
+        Returns:
+            int: 제거된 답변 수
+        """
+        url = normalize_repo_url(repo_url)
+        removed = 0
+        with self._lock:
+            for scope in [s for s in self._scopes if s[0] == url and s[1] != keep_commit]:
+                removed += len(self._scopes.pop(scope))
+        if removed:
+            print(f"[DEBUG] 답변 캐시 무효화: {url} (제거: {removed}개)")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'scopes': len(self._scopes),
+                'entries': sum(len(entries) for entries in self._scopes.values()),
+                'threshold': self.threshold,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'saved_prompt_tokens': self.saved_prompt_tokens,
+                'saved_completion_tokens': self.saved_completion_tokens,
+                'saved_tokens': self.saved_prompt_tokens + self.saved_completion_tokens
+            }
+
+
+class PromptCacheStats:
+    """
+    LLM 응답 usage의 프롬프트 토큰 중 제공자 측 캐시에서 처리된 토큰 수 집계
+
+    프롬프트 앞부분(시스템 프롬프트, 저장소 개요, 디렉토리 구조)이 요청마다 동일하면
+    usage.prompt_tokens_details.cached_tokens로 캐시 적중량이 보고됩니다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, usage) -> Dict[str, int]:
+        """응답 usage를 집계하고 이번 요청의 토큰 수를 반환 (usage가 없으면 0)"""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        counts = {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'cached_tokens': getattr(details, 'cached_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0
+        }
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += counts['prompt_tokens']
+            self.cached_tokens += counts['cached_tokens']
+            self.completion_tokens += counts['completion_tokens']
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'cached_ratio': round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                'completion_tokens': self.completion_tokens
+            }
+
+
+class SingleFlight:
+    """
+    같은 키의 요청이 실행 중이면 새로 실행하지 않고 실행 중인 결과를 함께 기다리는 요청 병합기
+
+    결과는 concurrent.futures.Future로 공유하므로 스레드(WSGI)와 이벤트 루프(ASGI, 비동기 뷰)가
+    섞여 있어도 같은 키끼리 병합됩니다. 실행이 끝나면 키를 지우므로 결과를 캐시하지는 않습니다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def begin(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        키의 실행을 시작하거나 실행 중인 것에 합류
+
+        Returns:
+            Tuple[Future, bool]: (결과 Future, 직접 실행해야 하는지 여부)
+                직접 실행하는 쪽은 끝나면 반드시 finish를 호출해야 합니다.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def finish(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        """실행 결과(또는 예외)를 기다리는 요청들에 전달하고 키를 해제"""
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        fn()을 실행하거나 같은 키로 실행 중인 결과를 기다려 반환
+
+        Returns:
+            Tuple[Any, bool]: (결과, 다른 요청의 결과를 공유했는지 여부)
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+    async def do_async(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """do의 비동기 버전 (기다리는 동안 이벤트 루프를 막지 않음)"""
+        future, leader = self.begin(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await factory()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'inflight': len(self._inflight),
+                'calls': self.calls,
+                'shared': self.shared,
+                'shared_rate': round(self.shared / self.calls, 4) if self.calls else 0.0
+            }
+
+
+embedding_cache = LRUCache('question_embedding', EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+answer_cache = SemanticAnswerCache('semantic_answer', ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES)
+# 세션 파일 내용 캐시 (키: (세션 ID, 경로), 값: (내용, 인코딩), 모든 세션이 공유하며 내용 길이의 합으로 제한)
+file_content_cache = LRUCache('file_contents', FILE_CACHE_MAX_FILES, max_weight=FILE_CACHE_MAX_CHARS,
+                              weigher=lambda value: len(value[0]))
+prompt_cache_stats = PromptCacheStats('prompt_cache')
+chat_flight = SingleFlight('chat_inflight')  # 키: (세션 ID, 정규화된 질문)
+analyze_flight = SingleFlight('analyze_inflight')  # 키: (정규화된 저장소 URL, 원격 HEAD 커밋 SHA)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """모든 캐시의 지표 (/metrics 응답용)"""
+    return {cache.name: cache.stats()
+            for cache in (embedding_cache, answer_cache, file_content_cache, prompt_cache_stats, chat_flight,
+                          analyze_flight)}
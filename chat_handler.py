@@ -1,13 +1,60 @@
 # chat_handler.py
 
-import openai
-import chromadb
-from github_analyzer import chroma_client
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from llm_client import get_provider
+from vector_index import IndexLeases, index_name
+from reranker import rerank_results, role_match_scores, CANDIDATE_MULTIPLIER
+from caches import embedding_cache, answer_cache, prompt_cache_stats, chat_flight, normalize_text, LRUCache
+from context_packer import count_tokens, context_budget, pack_context, PROMPT_TOKEN_ENCODING
+from directory_tree import load_or_build_tree, tree_from_paths, render_tree, summarize_dir
+from file_store import get_file_store, invalidate_files, decode_source
+from code_edits import parse_edit_blocks, apply_edit_blocks, unified_diff, normalize_edit_path
+from code_spans import build_modify_context
+from code_validation import validate_change_set
+from conversation_memory import is_follow_up, load_history, history_messages, remember_turn
+from model_router import route_question, template_answer, route_stats
 from git_modifier import create_branch_and_commit
+from code_modifier import CodeModifier
+from github_analyzer import RepositoryEmbedder, git_blob_sha, MAIN_EXTENSIONS
+import subprocess
 import re
 
+# 질문 임베딩 모델
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 코드 수정 모델과 출력용으로 예약할 토큰 수 (질문 답변 모델은 model_router가 질문마다 선택)
+CHAT_MODEL = "gpt-4o"
+# 편집 블록은 변경된 부분만 출력하므로 파일 전체를 출력하던 때보다 작게 예약
+MODIFY_MAX_TOKENS = int(os.environ.get("MODIFY_MAX_TOKENS", "2048"))
 # top-k 유사 청크 개수
 TOP_K = 5
+# MMR 재정렬 전에 가져올 후보 청크 수와 함께 받을 필드
+CANDIDATE_K = TOP_K * CANDIDATE_MULTIPLIER
+CANDIDATE_INCLUDE = ['documents', 'metadatas', 'distances', 'embeddings']
+# 범위(파일/함수/클래스/디렉토리) 필터 검색 결과가 이보다 적으면 전체 검색으로 보충
+MIN_SCOPED_RESULTS = 3
+# 넓은 질문의 1단계 파일 요약 검색에서 고를 파일 수
+TOP_FILES = 3
+# 프로젝트 전반을 묻는 넓은 질문 패턴
+BROAD_QUESTION_PATTERN = re.compile(
+    r'(프로젝트|저장소|레포|전체 구조|구조|아키텍처|개요|흐름|뭘 하|뭐 하|무엇을 하|어떤 기능|주요 기능|'
+    r'project|repo|architecture|overview|what does|how does .* work)',
+    re.IGNORECASE
+)
+# 질문과 역할 태그의 코사인 유사도가 이 값 이상이면 역할 매칭 청크로 우선 포함
+ROLE_MATCH_THRESHOLD = 0.45
+# 디버그 모드에서 단계별 소요 시간(ms)을 응답에 포함
+CHAT_DEBUG_TIMINGS = os.environ.get("CHAT_DEBUG_TIMINGS", "0") == "1"
+# LLM 호출 전 단계(임베딩/인덱스 열기)를 동시에 실행할 스레드 풀
+_stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat-stage")
+RELEVANT_TREE_TOKEN_CAP = 300  # 유저 메시지의 관련 디렉토리 가지 최대 토큰 수 (전체 트리는 고정 접두부에 있음)
+# 세션 커밋별 고정 접두부(시스템 메시지) 캐시 - 같은 입력이면 같은 문자열을 재사용
+_prefix_cache = LRUCache('prompt_prefix', 128)
+# 변경사항 적용 후 바뀐 파일의 인덱스 갱신을 기다릴 최대 시간(초) - 넘으면 백그라운드에서 계속
+REINDEX_WAIT_SECONDS = float(os.environ.get("REINDEX_WAIT_SECONDS", "30"))
 
 # 더 구체적이고 엄격한 시스템 프롬프트
 SYSTEM_PROMPT_QA = (
@@ -23,25 +70,24 @@ SYSTEM_PROMPT_QA = (
 )
 SYSTEM_PROMPT_MODIFY = (
     "당신은 코드 리팩터링 및 버그 수정에 특화된 AI입니다. "
-    "사용자의 요청을 코드 컨텍스트와 함께 분석하여, 전체 코드를 수정해줍니다. "
-    "수정된 코드는 반드시 // FILE: 파일명\n<전체 코드> 형식으로, 주석과 함께, 한글로 친절하게 작성하세요. "
+    "사용자의 요청을 코드 컨텍스트와 함께 분석하여, 필요한 부분만 수정해줍니다. "
+    "수정 내용은 파일 전체가 아니라 반드시 SEARCH/REPLACE 편집 블록으로, 바뀌는 부분만 작성하세요. "
     "불필요한 변경은 하지 말고, 요청한 부분만 명확하게 반영하세요."
 )
 
-# 더 구체적인 유저 프롬프트
-PROMPT_TEMPLATE = """
-아래는 사용자의 질문과 관련된 코드 청크 및 프로젝트 구조, 그리고 각 코드의 메타데이터(파일명, 함수명, 클래스명, 라인, sha, 역할 태그)입니다.
+# 세션(저장소 커밋)마다 바이트 단위로 동일한 고정 접두부
+# 시스템 메시지 맨 앞에 두어 질문이 바뀌어도 제공자 측 프롬프트 캐시가 적중하도록 함
+PREFIX_TEMPLATE = """
+[저장소 개요]
+{repo_overview}
 
 [프로젝트 디렉토리 구조]
 {directory_structure}
+"""
 
-[코드 컨텍스트 및 메타데이터]
-{context}
-
-[질문]
-{question}
-
-위 코드, 메타데이터, 프로젝트 구조, 질문을 참고하여, 반드시 한글로, 예시와 함께, 친절하게 답변해 주세요.
+QA_INSTRUCTIONS = """
+[답변 지침]
+사용자 메시지의 코드, 메타데이터, 관련 디렉토리 구조, 질문과 위 프로젝트 구조를 참고하여, 반드시 한글로, 예시와 함께, 친절하게 답변해 주세요.
 - 답변에는 반드시 근거(파일명, 함수명, 클래스명, 라인, 역할 태그 등)를 명확히 포함하세요.
 - 코드가 필요한 경우 코드 블록(```)과 한글 주석을 적극적으로 활용하세요.
 - 단계별 설명, 표, 요약, 비교, 한계 등도 적극적으로 활용하세요.
@@ -51,10 +97,45 @@ PROMPT_TEMPLATE = """
 - 답변의 신뢰도를 높이기 위해, 항상 답변의 출처(파일명, 함수명, 역할 등)를 함께 제시하세요.
 """
 
+MODIFY_INSTRUCTIONS = """
+[수정 형식]
+파일 전체를 다시 쓰지 말고, 바꿀 부분마다 아래 편집 블록을 작성하세요. 여러 파일, 여러 블록을 이어서 쓸 수 있습니다.
+// FILE: 경로/파일명
+<<<<<<< SEARCH
+<원본 코드에서 바꿀 줄들 (공백, 들여쓰기, 주석까지 원본과 똑같이)>
+=======
+<바뀐 줄들>
+>>>>>>> REPLACE
+
+- SEARCH 부분은 파일에서 한 곳과만 일치하도록 필요한 만큼의 주변 줄을 포함하되, 최대한 짧게 작성하세요.
+- 경로는 코드 컨텍스트의 // FILE: 경로를 그대로 사용하세요. (줄 범위 표시는 빼고 경로만)
+- SEARCH 부분은 코드 컨텍스트에 보이는 줄에서만 가져오세요.
+- 새 파일은 SEARCH 부분을 비우고 REPLACE 부분에 파일 전체 내용을 작성하세요.
+- 추가하거나 바꾸는 코드에는 한글 주석을 포함하세요.
+- 프로젝트 구조에 대한 이해를 바탕으로 코드를 수정하세요.
+- 불필요한 변경은 하지 말고, 요청한 부분만 명확하게 반영하세요.
+- 코드 외 설명이 필요하면 편집 블록 아래에 짧게 작성하세요.
+"""
+
+# 질문마다 달라지는 유저 프롬프트 (고정 접두부 뒤에 위치)
+PROMPT_TEMPLATE = """
+아래는 사용자의 질문과 관련된 코드 청크 및 관련 디렉토리 구조, 그리고 각 코드의 메타데이터(파일명, 함수명, 클래스명, 라인, sha, 역할 태그)입니다.
+
+[관련 디렉토리 구조]
+{directory_structure}
+
+[코드 컨텍스트 및 메타데이터]
+{context}
+
+[질문]
+{question}
+"""
+
 MODIFY_PROMPT_TEMPLATE = """
-아래는 사용자의 코드 수정 요청과 관련된 코드 청크 및 프로젝트 구조입니다.
+아래는 사용자의 코드 수정 요청과 관련된 코드 및 관련 디렉토리 구조입니다.
+코드 컨텍스트는 작은 파일은 전체(// FILE: 경로), 큰 파일은 관련 함수/클래스 범위의 원본 줄(// FILE: 경로 (줄 시작-끝))입니다.
 
-[프로젝트 디렉토리 구조]
+[관련 디렉토리 구조]
 {directory_structure}
 
 [코드 컨텍스트]
@@ -62,15 +143,6 @@ MODIFY_PROMPT_TEMPLATE = """
 
 [수정 요청]
 {request}
-
-아래 형식으로 전체 코드를 수정해서 보여주세요.
-// FILE: 파일명
-<수정된 전체 코드>
-
-- 반드시 한글 주석을 포함하세요.
-- 프로젝트 구조에 대한 이해를 바탕으로 코드를 수정하세요.
-- 불필요한 변경은 하지 말고, 요청한 부분만 명확하게 반영하세요.
-- 코드 외 설명이 필요하면 코드 아래에 추가로 작성하세요.
 """
 
 def parse_llm_code_response(llm_response):
@@ -83,7 +155,46 @@ def parse_llm_code_response(llm_response):
         return m2.group(1).strip(), m2.group(2).strip()
     return None, llm_response.strip()
 
-def handle_chat(session_id, message):
+def _timed(timings, stage, fn, *args, **kwargs):
+    """fn을 실행하고 소요 시간(ms)을 timings[stage]에 기록"""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+def create_question_embedding(message, model=EMBEDDING_MODEL):
+    """질문 임베딩 생성 (정규화된 질문 텍스트와 모델을 키로 LRU 캐시 사용)"""
+    text = normalize_text(message)
+    key = (model, text)
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        print(f"[DEBUG] 질문 임베딩 캐시 적중: '{text[:50]}...'")
+        return cached
+    vectors = get_provider().embed(text, model=model)
+    if not vectors or not vectors[0]:
+        print(f"[ERROR] 임베딩 결과가 비어 있습니다: {vectors}")
+        return None
+    embedding = vectors[0]
+    embedding_cache.set(key, embedding)
+    return embedding
+
+def prepare_chat(session_id, message, timings, started):
+    """
+    답변 생성 전 단계(임베딩, 검색, 재정렬, 컨텍스트/프롬프트 구성)를 수행
+
+    handle_chat과 handle_chat_stream이 공통으로 사용합니다.
+    검색에 사용하는 인덱스는 준비가 끝날 때까지 대여하여 수명 관리 점검이 내리지 않도록 합니다.
+
+    Returns:
+        tuple: (prepared, result)
+            prepared: LLM 호출에 필요한 {'messages', 'embedding', 'repo_url', 'commit_sha', 'chunk_ids', 'follow_up', 'route'}
+            result: 오류, 캐시된 답변 또는 템플릿 답변 응답 (이 경우 prepared는 None)
+    """
+    with IndexLeases() as leases:
+        return _prepare_chat(session_id, message, timings, started, leases)
+
+def _prepare_chat(session_id, message, timings, started, leases):
     # app.py의 sessions 데이터에서 세션 정보 확인
     from app import sessions
     print(f"[DEBUG] 현재 세션 ID: {session_id}")
@@ -94,7 +205,7 @@ def handle_chat(session_id, message):
     
     # 세션 데이터가 없으면 오류 반환
     if not session_data:
-        return {
+        return None, {
             'answer': "세션 데이터가 없습니다. 새로운 레포지토리를 분석해주세요.",
             'error': "session_not_found"
         }
@@ -104,233 +215,214 @@ def handle_chat(session_id, message):
     # 1. 질문 임베딩 생성
     print(f"[DEBUG] 질문 임베딩 생성 시작: '{message[:50]}...'")
     try:
-        # OpenAI API 키 확인
-        api_key = openai.api_key
-        if not api_key:
+        # LLM 제공자 설정(OpenAI API 키) 확인
+        provider = get_provider()
+        if not provider.is_configured():
             print("[ERROR] OpenAI API 키가 설정되지 않았습니다.")
-            return {
+            return None, {
                 'answer': "OpenAI API 키가 설정되지 않았습니다.",
                 'error': "api_key_missing"
             }
-        print(f"[DEBUG] OpenAI API 키 확인: {api_key[:4]}...{api_key[-4:]}")
+        print(f"[DEBUG] LLM 제공자 확인: {provider.name}")
         
-        # 임베딩 생성 시도
-        print(f"[DEBUG] OpenAI 임베딩 API 호출 시도")
-        embedding_response = openai.embeddings.create(
-            input=message,
-            model="text-embedding-3-small"
-        )
+        # 서로 의존하지 않는 단계(질문 임베딩 / 청크 인덱스 열기 / 역할 태그 인덱스 열기)를 동시에 시작
+        # 검색은 임베딩과 인덱스가 준비되면 바로 실행되고, 역할 태그 인덱스는 컨텍스트 구성 직전에만 기다림
+        print(f"[DEBUG] 임베딩 API 호출 시도")
+        embedding_future = _stage_executor.submit(_timed, timings, 'embedding', create_question_embedding, message)
+        index_future = _stage_executor.submit(_timed, timings, 'open_index', leases.open, session_id)
+        role_index_future = _stage_executor.submit(_timed, timings, 'open_role_index', leases.open, session_id, 'roles')
+        history_future = _stage_executor.submit(_timed, timings, 'history', load_history, session_id)
+        embedding = embedding_future.result()
         
         # 임베딩 결과 처리
-        if not embedding_response or not embedding_response.data or not embedding_response.data[0].embedding:
-            print(f"[ERROR] 임베딩 결과가 비어 있습니다: {embedding_response}")
-            return {
+        if not embedding:
+            return None, {
                 'answer': "임베딩 생성 중 오류가 발생했습니다: 임베딩 결과가 비어 있습니다.",
                 'error': "empty_embedding"
             }
             
-        embedding = embedding_response.data[0].embedding
         print(f"[DEBUG] 질문 임베딩 생성 성공 (차원: {len(embedding)})")
+
+        # 이전 대화 (실패해도 대화 기억 없이 진행)
+        try:
+            history = history_future.result()
+        except Exception as e:
+            print(f"[WARNING] 대화 기록 로드 실패: {e}")
+            history = {'summary': '', 'messages': [], 'tokens': 0, 'last_chunk_ids': []}
+        follow_up = history['has_history'] and is_follow_up(message)
+        print(f"[DEBUG] 대화 기록: 최근 메시지 {len(history['messages'])}개, 요약 {'있음' if history['summary'] else '없음'}, "
+              f"{history['tokens']} 토큰 (후속 질문: {follow_up})")
+
+        # 같은 저장소/커밋에서 비슷한 질문의 답변이 캐시되어 있으면 LLM 호출 없이 반환
+        # (후속 질문은 이전 대화에 따라 답이 달라지므로 캐시를 사용하지 않음)
+        repo_url, commit_sha = session_data.get('repo_url'), session_data.get('commit_sha')
+        if repo_url and commit_sha and not follow_up:
+            cached = answer_cache.lookup(repo_url, commit_sha, embedding)
+            if cached:
+                print(f"[DEBUG] 답변 캐시 적중 (유사도: {cached['similarity']}, 원래 질문: '{cached['question'][:50]}...')")
+                timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+                route_stats.record({'route': 'cache', 'model': None, 'reason': 'semantic_cache',
+                                    'similarity': cached['similarity']}, timings['total'])
+                return None, {'answer': cached['answer'], 'cached': True, 'cache_similarity': cached['similarity']}
     except Exception as e:
         import traceback
         print(f"[ERROR] 질문 임베딩 생성 실패: {e}")
         traceback.print_exc()
-        return {
+        return None, {
             'answer': f"임베딩 생성 중 오류가 발생했습니다: {str(e)}",
             'error': "embedding_error"
         }
 
-    # 2. ChromaDB에서 유사 코드 청크 검색
+    # 2. 벡터 인덱스에서 유사 코드 청크 검색
     try:
-        # ChromaDB 클라이언트 상태 확인
-        if not chroma_client:
-            print("[ERROR] ChromaDB 클라이언트가 초기화되지 않았습니다.")
-            return {
-                'answer': "저장소 분석 데이터에 접근할 수 없습니다. 서버를 재시작하고 저장소를 다시 분석해주세요.",
-                'error': "chroma_client_not_initialized"
-            }
-        
-        # 컬렉션 이름 생성 및 조회 시도
-        collection_name = f"repo_{session_id}"
-        print(f"[DEBUG] ChromaDB 컬렉션 조회 시도: {collection_name}")
-        
-        # 컬렉션 목록 확인
+        # 세션 인덱스 열기 (NumPy 또는 ChromaDB 백엔드)
+        collection_name = index_name(session_id)
+        print(f"[DEBUG] 벡터 인덱스 조회 시도: {collection_name}")
         try:
-            collections = chroma_client.list_collections()
-            collection_names = [col.name for col in collections]
-            print(f"[DEBUG] 사용 가능한 컬렉션 목록: {collection_names}")
+            collection = index_future.result()
         except Exception as e:
             import traceback
-            print(f"[ERROR] ChromaDB 컬렉션 목록 조회 실패: {e}")
+            print(f"[ERROR] 벡터 인덱스 열기 실패: {e}")
             traceback.print_exc()
-            return {
+            return None, {
                 'answer': f"저장소 분석 데이터 접근 중 오류가 발생했습니다: {str(e)}",
-                'error': "collection_list_error"
+                'error': "collection_access_error"
             }
         
-        # 컬렉션 존재 여부 확인
-        if collection_name not in collection_names:
-            print(f"[ERROR] 컬렉션을 찾을 수 없음: {collection_name}")
-            return {
+        # 인덱스 존재 여부 확인
+        if collection is None:
+            print(f"[ERROR] 벡터 인덱스를 찾을 수 없음: {collection_name}")
+            return None, {
                 'answer': f"저장소 분석 데이터를 찾을 수 없습니다. 저장소를 다시 분석해주세요.",
                 'error': "collection_not_found"
             }
+        print(f"[DEBUG] 벡터 인덱스 조회 성공: {collection_name} (백엔드: {collection.backend})")
         
-        # 컬렉션 가져오기
-        try:    
-            collection = chroma_client.get_collection(name=collection_name)
-            print(f"[DEBUG] 컬렉션 조회 성공: {collection_name}")
-        except Exception as e:
-            import traceback
-            print(f"[ERROR] 컬렉션 가져오기 실패: {e}")
-            traceback.print_exc()
-            return {
-                'answer': f"저장소 분석 데이터 접근 중 오류가 발생했습니다: {str(e)}",
-                'error': "collection_access_error"
-            }
-        
-        # 컬렉션 내 문서 수 확인
+        # 인덱스 내 문서 수 확인
         try:
             collection_count = collection.count()
-            print(f"[DEBUG] 컬렉션 내 문서 수: {collection_count}")
+            print(f"[DEBUG] 인덱스 내 문서 수: {collection_count}")
             if collection_count == 0:
-                print(f"[WARNING] 컬렉션이 비어 있습니다: {collection_name}")
-                return {
+                print(f"[WARNING] 인덱스가 비어 있습니다: {collection_name}")
+                return None, {
                     'answer': "저장소 분석 데이터가 비어 있습니다. 저장소를 다시 분석해주세요.",
                     'error': "empty_collection"
                 }
         except Exception as e:
             import traceback
-            print(f"[WARNING] 컬렉션 문서 수 확인 실패: {e}")
+            print(f"[WARNING] 인덱스 문서 수 확인 실패: {e}")
             traceback.print_exc()
             # 문서 수 확인 실패는 치명적이지 않을 수 있으므로 계속 진행
         
-        # 유사 코드 청크 검색
-        print(f"[DEBUG] 유사 코드 청크 검색 시작 (TOP_K={TOP_K})")
+        # 유사 코드 청크 검색 (질문 범위를 메타데이터 필터로 적용)
+        scope = extract_scope_from_question(message)
+        file_summaries = []
+        print(f"[DEBUG] 유사 코드 청크 검색 시작 (TOP_K={TOP_K}, 범위: {scope})")
+        search_start = time.perf_counter()
         try:
-            results = collection.query(
-                query_embeddings=[embedding],
-                n_results=TOP_K
-            )
+            results = None
+            broad = is_broad_question(message, scope)
+            # 범위 지정이 없는 후속 질문은 직전 답변에 사용한 청크를 다시 사용 (새 검색 생략)
+            if follow_up and not broad and not any(scope.values()) and history['last_chunk_ids']:
+                results = reuse_chunks(collection, history['last_chunk_ids'])
+            # 넓은 질문은 파일 요약 인덱스로 핵심 파일을 먼저 고른 뒤 그 파일 안에서만 청크 검색
+            if not results and broad:
+                results, file_summaries = query_two_stage(session_id, collection, embedding, leases,
+                                                          n_results=CANDIDATE_K, include=CANDIDATE_INCLUDE)
+            if not results:
+                results = query_with_scope(collection, embedding, scope, session_data.get('files', []),
+                                           n_results=CANDIDATE_K, include=CANDIDATE_INCLUDE)
+            # 후보를 MMR로 재정렬하고 겹치는 청크를 병합하여 TOP_K개 구간만 사용
+            results = rerank_results(results, embedding, TOP_K)
+            timings['search'] = round((time.perf_counter() - search_start) * 1000, 1)
             print(f"[DEBUG] 검색 결과 구조: {list(results.keys())}")
         except Exception as e:
             import traceback
             print(f"[ERROR] 유사 코드 청크 검색 실패: {e}")
             traceback.print_exc()
-            return {
+            return None, {
                 'answer': f"코드 검색 중 오류가 발생했습니다: {str(e)}",
                 'error': "query_error"
             }
         
-        # 1. 질문 의도 태깅 (LLM)
+        # 1. 질문 임베딩과 역할 태그 임베딩의 코사인 유사도 (분석 시 미리 임베딩한 역할 태그 사용)
         try:
-            tag_prompt = f"아래 질문의 의도(원하는 코드 역할/기능)를 한글로 간단히 요약해줘.\n\n질문:\n{message}"
-            tag_resp = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": tag_prompt}],
-                temperature=0.0,
-                max_tokens=32
-            )
-            question_role_tag = tag_resp.choices[0].message.content.strip()
-            print(f"[DEBUG] 질문 의도 태그: {question_role_tag}")
+            role_scores = role_match_scores(role_index_future.result(), results.get('chunk_ids', [[]])[0], embedding)
         except Exception as e:
-            print(f"[WARNING] 질문 의도 태깅 실패: {e}")
-            question_role_tag = ''
-        # 2. role_tag 매칭 청크 우선 포함
-        context_chunks = []
-        if 'documents' in results and 'metadatas' in results and results['documents'][0] and results['metadatas'][0]:
-            for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-                role_tag = meta.get('role_tag', '')
-                if question_role_tag and role_tag and (question_role_tag in role_tag or role_tag in question_role_tag):
-                    meta_info = []
-                    if meta.get('file_name'): meta_info.append(f"파일명: {meta['file_name']}")
-                    if meta.get('function_name'): meta_info.append(f"함수: {meta['function_name']}")
-                    if meta.get('class_name'): meta_info.append(f"클래스: {meta['class_name']}")
-                    if meta.get('start_line') and meta.get('end_line'):
-                        meta_info.append(f"라인: {meta['start_line']}~{meta['end_line']}")
-                    if meta.get('sha'): meta_info.append(f"sha: {meta['sha']}")
-                    meta_info.append(f"역할: {role_tag}")
-                    context_chunks.append(f"[{'/'.join(meta_info)}]\n{doc}")
-        # 3. 매칭된 청크가 부족하면 기존 방식으로 보충
-        if len(context_chunks) < 3:
-            for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-                role_tag = meta.get('role_tag', '')
-                meta_info = []
-                if meta.get('file_name'): meta_info.append(f"파일명: {meta['file_name']}")
-                if meta.get('function_name'): meta_info.append(f"함수: {meta['function_name']}")
-                if meta.get('class_name'): meta_info.append(f"클래스: {meta['class_name']}")
-                if meta.get('start_line') and meta.get('end_line'):
-                    meta_info.append(f"라인: {meta['start_line']}~{meta['end_line']}")
-                if meta.get('sha'): meta_info.append(f"sha: {meta['sha']}")
-                if role_tag: meta_info.append(f"역할: {role_tag}")
-                chunk_str = f"[{'/'.join(meta_info)}]\n{doc}"
-                if chunk_str not in context_chunks:
-                    context_chunks.append(chunk_str)
-                if len(context_chunks) >= 5:
-                    break
-        # 4. 프롬프트에 컨텍스트 범위 안내
-        context = '\n\n'.join(context_chunks)
-        context = f"아래는 [파일/함수/클래스/라인/역할] 단위로 추출된 컨텍스트입니다.\n{context}"
-        print(f"[DEBUG] 유사 코드 청크 {len(context_chunks)}개 찾음 (총 {len(context)} 문자)")
-        
-        # 검색된 파일 경로 로깅
-        if 'metadatas' in results and results['metadatas'] and results['metadatas'][0]:
-            paths = [meta.get('path', 'unknown') for meta in results['metadatas'][0]]
-            print(f"[DEBUG] 검색된 파일 경로: {paths}")
-            # 유사도 점수 로깅 (있는 경우)
-            if 'distances' in results and results['distances'] and results['distances'][0]:
-                distances = results['distances'][0]
-                print(f"[DEBUG] 검색 유사도 점수: {distances}")
-                # 파일 경로와 유사도 점수 매핑
-                path_scores = list(zip(paths, distances))
-                print(f"[DEBUG] 파일별 유사도 점수: {path_scores}")
-        else:
-            print("[WARNING] 검색 결과에 메타데이터가 없습니다.")
+            print(f"[WARNING] 역할 태그 매칭 실패: {e}")
+            role_scores = [0.0] * len(results['ids'][0])
+        print(f"[DEBUG] 역할 태그 유사도: {[round(score, 3) for score in role_scores]}")
+        # 2. 역할 매칭 구간을 우선으로 관련도 순서의 컨텍스트 항목 구성 (토큰 수 포함)
+        context_items = build_context_items(results, role_scores)
+        print(f"[DEBUG] 유사 코드 청크 {len(context_items)}개 찾음 (총 {sum(item['tokens'] for item in context_items)} 토큰)")
 
     except Exception as e:
         print(f"[ERROR] 코드 청크 검색 오류: {e}")
-        return {
+        return None, {
             'answer': f"코드 검색 중 오류가 발생했습니다: {str(e)}",
             'error': "search_error"
         }
+
+    # 파일 전체 코드 요구 패턴 감지
+    file_full_keywords = ["전체", "전체 코드", "전체내용", "전체 보여", "전체 출력"]
+    is_full_file_request = any(kw in message for kw in file_full_keywords)
+
+    # 질문 복잡도와 검색 신뢰도로 답변 경로(메타데이터 템플릿 / 작은 모델 / gpt-4o) 결정
+    route = route_question(message, scope, results, broad=broad, follow_up=follow_up,
+                           full_file=is_full_file_request and bool(scope['file']))
+    print(f"[DEBUG] 답변 경로: {route}")
+    if route['route'] == 'template':
+        # 위치 질문은 검색된 청크의 메타데이터만으로 답변 (LLM 호출 없음)
+        timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+        route_stats.record(route, timings['total'])
+        return None, {
+            'answer': template_answer(scope, results),
+            'route': 'template',
+            'chunk_ids': [cid for ids in results.get('chunk_ids', [[]])[0] for cid in ids]
+        }
     
-    # 디렉토리 구조 확인
-    directory_structure = session_data.get('directory_structure')
+    # 고정 접두부(시스템 프롬프트 + 저장소 개요 + 전체 압축 트리 + 지침)와 검색된 파일로 가는 관련 가지
+    system_prompt = build_system_prompt(session_data, repo_path, 'qa')
+    focus_paths = [meta.get('path') for meta in results['metadatas'][0] if meta.get('path')]
+    directory_structure = render_session_tree(session_data, repo_path, focus_paths)
     
-    if directory_structure:
+    if file_summaries:
+        # 넓은 질문은 전체 디렉토리 구조 대신 1단계에서 고른 핵심 파일 요약을 제공
+        directory_structure = "[핵심 파일 요약]\n" + "\n".join(f"- {path}: {summary}" for path, summary in file_summaries)
+        print(f"[DEBUG] 핵심 파일 요약 제공 (파일 수: {len(file_summaries)})")
+    elif directory_structure:
         print(f"[DEBUG] 디렉토리 구조 정보 제공 (길이: {len(directory_structure)} 문자)")
     else:
-        print("[DEBUG] 디렉토리 구조 정보가 없습니다.")
-        directory_structure = "프로젝트 구조 정보가 없습니다. 파일 내용만 참고하여 응답하겠습니다."
+        print("[DEBUG] 관련 디렉토리 구조 정보가 없습니다.")
+        directory_structure = "관련 디렉토리 정보가 없습니다. 위 프로젝트 구조와 파일 내용만 참고하여 응답하겠습니다."
 
-    # 파일 전체 코드 요구 패턴 감지
-    file_full_keywords = ["전체", "전체 코드", "전체내용", "전체 보여", "전체 출력"]
-    is_full_file_request = any(kw in message for kw in file_full_keywords)
-    scope = extract_scope_from_question(message)
     full_file_contexts = []
     if is_full_file_request and scope['file']:
+        # 세션 파일 저장소의 경로/파일명 색인으로 찾고, 내용은 메모리 캐시에서 재사용
+        store = get_file_store(session_id, session_data)
         for fname in scope['file']:
-            # 세션 데이터에서 파일 경로 찾기
-            file_path = None
-            for f in session_data.get('files', []):
-                if f.get('file_name') and fname in f['file_name']:
-                    file_path = f['path']
-                    break
-            if file_path:
-                try:
-                    with open(f"{repo_path}/{file_path}", 'r', encoding='utf-8') as f:
-                        code = f.read()
-                    full_file_contexts.append(f"// FILE: {file_path}\n{code}")
-                except Exception as e:
-                    print(f"[WARNING] 파일 전체 코드 로드 실패: {file_path}, {e}")
-
-    # 청크 검색 결과와 파일 전체 내용 합치기
+            for file_path in store.resolve(fname)[:1]:
+                code = store.read(file_path)
+                if code is None:
+                    print(f"[WARNING] 파일 전체 코드 로드 실패: {file_path}")
+                    continue
+                full_file_contexts.append(f"// FILE: {file_path}\n{code}")
+
+    # 고정 프롬프트(시스템 메시지, 대화 기록, 질문, 관련 디렉토리 구조)를 뺀 토큰 예산 안에서 컨텍스트 패킹
+    context_header = "아래는 [파일/함수/클래스/라인/역할] 단위로 추출된 컨텍스트입니다.\n"
+    fixed_tokens = count_tokens(system_prompt) + history['tokens'] + count_tokens(PROMPT_TEMPLATE.format(
+        context=context_header,
+        question=message,
+        directory_structure=directory_structure
+    ))
+    budget = context_budget(route['model'], fixed_tokens, route['max_tokens'])
+    packed = []
     if full_file_contexts:
-        context = '\n\n'.join(full_file_contexts)
-    else:
-        # 기존 방식
-        context = '\n\n'.join(context_chunks)
-    context = f"아래는 [파일/함수/클래스/라인/역할] 단위로 추출된 컨텍스트입니다.\n{context}"
+        packed, used_tokens = pack_context([{'text': text} for text in full_file_contexts], budget)
+    if not packed:
+        # 파일 전체 요청이 아니거나 파일이 예산보다 크면 청크 검색 결과 사용
+        packed, used_tokens = pack_context(context_items, budget)
+    context = context_header + '\n\n'.join(packed)
     
     # 검색된 파일 경로 로깅
     if 'metadatas' in results and results['metadatas'] and results['metadatas'][0]:
@@ -346,71 +438,334 @@ def handle_chat(session_id, message):
     else:
         print("[WARNING] 검색 결과에 메타데이터가 없습니다.")
 
+    # 프롬프트 생성
+    prompt = PROMPT_TEMPLATE.format(
+        context=context, 
+        question=message,
+        directory_structure=directory_structure
+    )
+    print("\n[LLM 프롬프트]\n" + prompt + "\n")  # 프롬프트 확인용 출력
+    print(f"[DEBUG] 프롬프트 토큰 수: 약 {fixed_tokens + used_tokens} (컨텍스트 예산: {budget})")
+    
+    timings['pre_llm'] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[DEBUG] 단계별 소요 시간(ms): {timings}")
+    return {
+        # 고정 접두부 뒤에 대화 요약/최근 대화, 마지막에 이번 질문
+        'messages': [{"role": "system", "content": system_prompt}]
+                    + history_messages(history)
+                    + [{"role": "user", "content": prompt}],
+        'embedding': embedding,
+        'repo_url': repo_url,
+        'commit_sha': commit_sha,
+        'chunk_ids': [cid for ids in results.get('chunk_ids', [[]])[0] for cid in ids],
+        'follow_up': follow_up,
+        'route': route
+    }, None
+
+def record_usage(usage):
+    """응답 usage의 프롬프트/캐시된 토큰 수를 집계하고 로그로 남김"""
+    counts = prompt_cache_stats.record(usage)
+    if usage is not None:
+        print(f"[DEBUG] 프롬프트 토큰: {counts['prompt_tokens']} (캐시 적중: {counts['cached_tokens']}), "
+              f"완료 토큰: {counts['completion_tokens']}")
+    return counts
+
+def store_answer(prepared, message, answer, usage):
+    """답변 캐시에 저장 (같은 커밋을 분석한 다른 세션도 재사용, 후속 질문은 제외)"""
+    if prepared['repo_url'] and prepared['commit_sha'] and not prepared['follow_up']:
+        answer_cache.store(prepared['repo_url'], prepared['commit_sha'], prepared['embedding'], message, answer,
+                           prompt_tokens=getattr(usage, 'prompt_tokens', 0),
+                           completion_tokens=getattr(usage, 'completion_tokens', 0))
+
+def chat_request(prepared, **kwargs):
+    """답변 생성용 chat.completions.create 인자 (라우팅된 모델과 출력 토큰 수)"""
+    route = prepared['route']
+    return dict(model=route['model'], messages=prepared['messages'], temperature=0.2, max_tokens=route['max_tokens'],
+                **kwargs)
+
+def early_chat_result(session_id, message, result, timings, debug):
+    """LLM 호출 전에 끝난 요청(오류, 캐시된 답변 또는 템플릿 답변)의 응답"""
+    chunk_ids = result.pop('chunk_ids', None)
+    if result.get('cached') or result.get('route') == 'template':
+        remember_turn(session_id, message, result['answer'], chunk_ids)
+    if debug and not result.get('error'):
+        result['timings'] = timings
+    return result
+
+def finish_chat(session_id, message, prepared, response, timings, started, debug):
+    """LLM 응답을 검사하여 답변을 저장(답변 캐시, 대화 기록)하고 응답 생성"""
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    
+    # 응답 처리
+    if not response or not response.choices or not response.choices[0].message:
+        print(f"[ERROR] LLM 응답이 비어 있습니다: {response}")
+        return {
+            'answer': "응답 생성 중 오류가 발생했습니다. 다시 시도해주세요.",
+            'error': "empty_response"
+        }
+    
+    answer = response.choices[0].message.content.strip()
+    print(f"[DEBUG] LLM 응답 성공 (길이: {len(answer)} 문자)")
+    
+    # 응답이 비어있는지 확인
+    if not answer:
+        print("[WARNING] LLM이 비어있는 응답을 리턴했습니다.")
+        return {
+            'answer': "질문에 대한 답변을 생성하지 못했습니다. 다른 질문을 시도해주세요.",
+            'error': "empty_answer"
+        }
+    
+    # 프롬프트 캐시 적중량과 경로별 지연/비용 집계 후 답변 캐시에 저장
+    usage = record_usage(getattr(response, 'usage', None))
+    route_stats.record(prepared['route'], timings['total'], usage)
+    store_answer(prepared, message, answer, getattr(response, 'usage', None))
+    remember_turn(session_id, message, answer, prepared['chunk_ids'])
+    
+    # 성공적인 응답 반환
+    if debug:
+        return {'answer': answer, 'timings': timings, 'usage': usage, 'route': prepared['route']}
+    return {'answer': answer}
+
+def llm_error_result(e):
+    import traceback
+    print(f"[ERROR] LLM 호출 오류: {e}")
+    traceback.print_exc()
+    return {
+        'answer': f"응답 생성 중 오류가 발생했습니다: {str(e)}",
+        'error': "llm_error"
+    }
+
+def _handle_chat(session_id, message, debug=False):
+    debug = debug or CHAT_DEBUG_TIMINGS
+    timings = {}
+    started = time.perf_counter()
+    prepared, result = prepare_chat(session_id, message, timings, started)
+    if result is not None:
+        return early_chat_result(session_id, message, result, timings, debug)
+
     # 3. LLM에 컨텍스트와 함께 전달하여 답변 생성
     try:
-        # 프롬프트 생성
-        prompt = PROMPT_TEMPLATE.format(
-            context=context, 
-            question=message,
-            directory_structure=directory_structure
-        )
-        print("\n[LLM 프롬프트]\n" + prompt + "\n")  # 프롬프트 확인용 출력
-        print(f"[DEBUG] 프롬프트 길이: {len(prompt)} 문자")
-        
-        # 프롬프트 길이 제한 확인
-        if len(prompt) > 100000:  # OpenAI API의 토큰 제한을 고려한 값
-            print(f"[WARNING] 프롬프트가 너무 깁니다. 컨텍스트 일부를 잘라냅니다.")
-            # 컨텍스트 길이 제한
-            max_context_length = 80000  # 적절한 길이로 조정
-            truncated_context = context[:max_context_length] + "\n... (컨텍스트 길이 제한으로 인해 일부 내용이 생략되었습니다) ..."
-            prompt = PROMPT_TEMPLATE.format(
-                context=truncated_context, 
-                question=message,
-                directory_structure=directory_structure
-            )
-            print(f"[DEBUG] 수정된 프롬프트 길이: {len(prompt)} 문자")
-        
         # LLM 호출
-        print(f"[DEBUG] OpenAI API 호출 시작 (model=gpt-4o, temperature=0.2)")
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": SYSTEM_PROMPT_QA},
-                      {"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=2048
-        )
-        
-        # 응답 처리
-        if not response or not response.choices or not response.choices[0].message:
-            print(f"[ERROR] LLM 응답이 비어 있습니다: {response}")
-            return {
-                'answer': "응답 생성 중 오류가 발생했습니다. 다시 시도해주세요.",
-                'error': "empty_response"
-            }
-        
-        answer = response.choices[0].message.content.strip()
-        print(f"[DEBUG] LLM 응답 성공 (길이: {len(answer)} 문자)")
-        
-        # 응답이 비어있는지 확인
-        if not answer:
-            print("[WARNING] LLM이 비어있는 응답을 리턴했습니다.")
-            return {
-                'answer': "질문에 대한 답변을 생성하지 못했습니다. 다른 질문을 시도해주세요.",
-                'error': "empty_answer"
-            }
-        
-        # 성공적인 응답 반환
-        return {'answer': answer}
+        print(f"[DEBUG] LLM API 호출 시작 (model={prepared['route']['model']}, temperature=0.2)")
+        llm_start = time.perf_counter()
+        response = get_provider().chat(**chat_request(prepared))
+        timings['llm'] = round((time.perf_counter() - llm_start) * 1000, 1)
+        return finish_chat(session_id, message, prepared, response, timings, started, debug)
     except Exception as e:
-        import traceback
-        print(f"[ERROR] LLM 호출 오류: {e}")
-        traceback.print_exc()
+        return llm_error_result(e)
+
+async def _handle_chat_async(session_id, message, debug=False):
+    """
+    handle_chat의 비동기 버전
+
+    검색/컨텍스트 구성과 기록 저장은 스레드에서 실행하고, 가장 오래 걸리는 LLM 호출은
+    비동기 클라이언트로 기다리므로 응답을 기다리는 동안 이벤트 루프가 다른 요청을 처리할 수 있습니다.
+    """
+    debug = debug or CHAT_DEBUG_TIMINGS
+    timings = {}
+    started = time.perf_counter()
+    prepared, result = await asyncio.to_thread(prepare_chat, session_id, message, timings, started)
+    if result is not None:
+        return await asyncio.to_thread(early_chat_result, session_id, message, result, timings, debug)
+
+    try:
+        print(f"[DEBUG] LLM 비동기 API 호출 시작 (model={prepared['route']['model']}, temperature=0.2)")
+        llm_start = time.perf_counter()
+        response = await get_provider().chat_async(**chat_request(prepared))
+        timings['llm'] = round((time.perf_counter() - llm_start) * 1000, 1)
+        return await asyncio.to_thread(finish_chat, session_id, message, prepared, response, timings, started, debug)
+    except Exception as e:
+        return llm_error_result(e)
+
+def finish_chat_stream(session_id, message, prepared, parts, usage, timings, started, debug):
+    """스트리밍이 끝난 답변을 저장하고 마지막 이벤트(done 또는 error) 생성"""
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    answer = ''.join(parts).strip()
+    print(f"[DEBUG] LLM 스트리밍 응답 완료 (길이: {len(answer)} 문자, 단계별 소요 시간(ms): {timings})")
+    if not answer:
+        print("[WARNING] LLM이 비어있는 응답을 리턴했습니다.")
         return {
-            'answer': f"응답 생성 중 오류가 발생했습니다: {str(e)}",
-            'error': "llm_error"
+            'type': 'error',
+            'answer': "질문에 대한 답변을 생성하지 못했습니다. 다른 질문을 시도해주세요.",
+            'error': "empty_answer"
         }
 
-def handle_modify_request(session_id, message):
+    usage_counts = record_usage(usage)
+    route_stats.record(prepared['route'], timings['total'], usage_counts)
+    store_answer(prepared, message, answer, usage)
+    remember_turn(session_id, message, answer, prepared['chunk_ids'])
+    event = {'type': 'done', 'answer': answer}
+    if debug:
+        event['timings'] = timings
+        event['usage'] = usage_counts
+        event['route'] = prepared['route']
+    return event
+
+def llm_stream_error_event(e):
+    import traceback
+    print(f"[ERROR] LLM 스트리밍 호출 오류: {e}")
+    traceback.print_exc()
+    return {
+        'type': 'error',
+        'answer': f"응답 생성 중 오류가 발생했습니다: {str(e)}",
+        'error': "llm_error"
+    }
+
+def _handle_chat_stream(session_id, message, debug=False):
+    debug = debug or CHAT_DEBUG_TIMINGS
+    timings = {}
+    started = time.perf_counter()
+    prepared, result = prepare_chat(session_id, message, timings, started)
+    if result is not None:
+        # 오류 또는 캐시된 답변은 한 번에 전달
+        result = early_chat_result(session_id, message, result, timings, debug)
+        yield dict(result, type='error' if result.get('error') else 'done')
+        return
+
+    try:
+        print(f"[DEBUG] LLM 스트리밍 API 호출 시작 (model={prepared['route']['model']}, temperature=0.2)")
+        llm_start = time.perf_counter()
+        stream = get_provider().chat(**chat_request(
+            prepared, stream=True, stream_options={"include_usage": True}
+        ))
+        parts = []
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if not parts:
+                timings['first_token'] = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(chunk.choices[0].delta.content)
+            yield {'type': 'token', 'content': chunk.choices[0].delta.content}
+        timings['llm'] = round((time.perf_counter() - llm_start) * 1000, 1)
+        yield finish_chat_stream(session_id, message, prepared, parts, usage, timings, started, debug)
+    except Exception as e:
+        yield llm_stream_error_event(e)
+
+async def _handle_chat_stream_async(session_id, message, debug=False):
+    debug = debug or CHAT_DEBUG_TIMINGS
+    timings = {}
+    started = time.perf_counter()
+    prepared, result = await asyncio.to_thread(prepare_chat, session_id, message, timings, started)
+    if result is not None:
+        result = await asyncio.to_thread(early_chat_result, session_id, message, result, timings, debug)
+        yield dict(result, type='error' if result.get('error') else 'done')
+        return
+
+    try:
+        print(f"[DEBUG] LLM 비동기 스트리밍 API 호출 시작 (model={prepared['route']['model']}, temperature=0.2)")
+        llm_start = time.perf_counter()
+        stream = await get_provider().chat_async(**chat_request(
+            prepared, stream=True, stream_options={"include_usage": True}
+        ))
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if not parts:
+                timings['first_token'] = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(chunk.choices[0].delta.content)
+            yield {'type': 'token', 'content': chunk.choices[0].delta.content}
+        timings['llm'] = round((time.perf_counter() - llm_start) * 1000, 1)
+        yield await asyncio.to_thread(finish_chat_stream, session_id, message, prepared, parts, usage,
+                                      timings, started, debug)
+    except Exception as e:
+        yield llm_stream_error_event(e)
+
+def chat_flight_key(session_id, message):
+    """동시 중복 질문 병합 키: (세션 ID, 공백/대소문자를 정규화한 질문)"""
+    return (session_id, normalize_text(message).casefold())
+
+def _coalesced(result):
+    """실행 중이던 같은 질문의 결과를 공유한 응답"""
+    print(f"[DEBUG] 동시 중복 질문 병합: 실행 중인 요청의 답변을 공유")
+    return dict(result, coalesced=True)
+
+# 스트림이 답변 없이 끝났을 때(클라이언트 연결 종료 등) 기다리던 요청에 전달할 응답
+STREAM_ABORTED_RESULT = {'answer': "응답 생성이 중단되었습니다. 다시 시도해주세요.", 'error': "stream_aborted"}
+
+def handle_chat(session_id, message, debug=False):
+    """
+    질문에 대한 답변 생성
+
+    같은 세션에서 같은 질문이 이미 처리 중이면(공유 링크 동시 질문, 중복 클릭)
+    임베딩/검색/LLM 호출을 다시 하지 않고 그 결과를 기다려 'coalesced': True와 함께 반환합니다.
+    """
+    result, shared = chat_flight.do(chat_flight_key(session_id, message),
+                                    lambda: _handle_chat(session_id, message, debug))
+    return _coalesced(result) if shared else result
+
+async def handle_chat_async(session_id, message, debug=False):
+    """handle_chat의 비동기 버전 (병합된 요청은 이벤트 루프를 막지 않고 기다림)"""
+    result, shared = await chat_flight.do_async(chat_flight_key(session_id, message),
+                                                lambda: _handle_chat_async(session_id, message, debug))
+    return _coalesced(result) if shared else result
+
+def handle_chat_stream(session_id, message, debug=False):
+    """
+    handle_chat의 스트리밍 버전: LLM 답변을 토큰이 생성되는 대로 이벤트로 전달
+
+    같은 질문이 처리 중이면 토큰 없이 완료 이벤트 하나로 그 결과를 전달합니다.
+
+    Yields:
+        Dict[str, Any]: NDJSON으로 전송할 이벤트
+            {'type': 'token', 'content': ...}: 답변 조각
+            {'type': 'done', 'answer': ..., 'cached': ...}: 완료 (전체 답변 포함)
+            {'type': 'error', 'answer': ..., 'error': ...}: 오류
+    """
+    key = chat_flight_key(session_id, message)
+    future, leader = chat_flight.begin(key)
+    if not leader:
+        result = _coalesced(future.result())
+        yield dict(result, type='error' if result.get('error') else 'done')
+        return
+    final = None
+    try:
+        for event in _handle_chat_stream(session_id, message, debug):
+            if event['type'] != 'token':
+                final = {k: v for k, v in event.items() if k != 'type'}
+            yield event
+    finally:
+        chat_flight.finish(key, future, final or STREAM_ABORTED_RESULT)
+
+async def handle_chat_stream_async(session_id, message, debug=False):
+    """handle_chat_stream의 비동기 버전 (ASGI 서버의 /chat_stream에서 사용)"""
+    key = chat_flight_key(session_id, message)
+    future, leader = chat_flight.begin(key)
+    if not leader:
+        result = _coalesced(await asyncio.wrap_future(future))
+        yield dict(result, type='error' if result.get('error') else 'done')
+        return
+    final = None
+    try:
+        async for event in _handle_chat_stream_async(session_id, message, debug):
+            if event['type'] != 'token':
+                final = {k: v for k, v in event.items() if k != 'type'}
+            yield event
+    finally:
+        chat_flight.finish(key, future, final or STREAM_ABORTED_RESULT)
+
+def prepare_modify(session_id, message):
+    """
+    코드 수정 요청의 LLM 호출 전 단계(임베딩, 검색, 관련 파일 로드, 프롬프트 구성)
+
+    handle_modify_request와 handle_modify_request_async가 공통으로 사용합니다.
+    검색에 사용하는 인덱스는 준비가 끝날 때까지 대여합니다.
+
+    Returns:
+        tuple: (messages, result)
+            messages: LLM에 보낼 메시지 목록
+            result: 오류 응답 (이 경우 messages는 None)
+    """
+    with IndexLeases() as leases:
+        return _prepare_modify(session_id, message, leases)
+
+def _prepare_modify(session_id, message, leases):
     # 세션 데이터 확인
     from app import sessions
     print(f"[DEBUG] 현재 세션 ID: {session_id}")
@@ -421,7 +776,7 @@ def handle_modify_request(session_id, message):
     
     # 세션 데이터가 없으면 오류 반환
     if not session_data:
-        return {
+        return None, {
             'answer': "세션 데이터가 없습니다. 새로운 레포지토리를 분석해주세요.",
             'error': "session_not_found",
             'modified_code': "",
@@ -432,121 +787,89 @@ def handle_modify_request(session_id, message):
     
     # 1단계: 청크 검색으로 관련 파일 식별
     try:
-        # OpenAI API 키 확인
-        api_key = openai.api_key
-        if not api_key:
+        # LLM 제공자 설정(OpenAI API 키) 확인
+        provider = get_provider()
+        if not provider.is_configured():
             print("[ERROR] OpenAI API 키가 설정되지 않았습니다.")
-            return {
+            return None, {
                 'answer': "OpenAI API 키가 설정되지 않았습니다.",
                 'error': "api_key_missing",
                 'modified_code': "",
                 'file_name': ""
             }
-        print(f"[DEBUG] OpenAI API 키 확인: {api_key[:4]}...{api_key[-4:]}")
+        print(f"[DEBUG] LLM 제공자 확인: {provider.name}")
         
-        # 임베딩 생성
+        # 임베딩 생성 (인덱스 열기와 동시에 실행)
         print(f"[DEBUG] 수정 요청 임베딩 생성 시작: '{message[:50]}...'")
-        embedding_response = openai.embeddings.create(
-            input=message,
-            model="text-embedding-3-small"
-        )
+        index_future = _stage_executor.submit(leases.open, session_id)
+        embedding = create_question_embedding(message)
         
         # 임베딩 결과 처리
-        if not embedding_response or not embedding_response.data or not embedding_response.data[0].embedding:
-            print(f"[ERROR] 임베딩 결과가 비어 있습니다: {embedding_response}")
-            return {
+        if not embedding:
+            return None, {
                 'answer': "임베딩 생성 중 오류가 발생했습니다: 임베딩 결과가 비어 있습니다.",
                 'error': "empty_embedding",
                 'modified_code': "",
                 'file_name': ""
             }
             
-        embedding = embedding_response.data[0].embedding
         print(f"[DEBUG] 수정 요청 임베딩 생성 성공 (차원: {len(embedding)})")
         
-        # ChromaDB 클라이언트 상태 확인
-        if not chroma_client:
-            print("[ERROR] ChromaDB 클라이언트가 초기화되지 않았습니다.")
-            return {
-                'answer': "저장소 분석 데이터에 접근할 수 없습니다. 서버를 재시작하고 저장소를 다시 분석해주세요.",
-                'error': "chroma_client_not_initialized",
-                'modified_code': "",
-                'file_name': ""
-            }
-        
-        # 컬렉션 이름 생성 및 조회 시도
-        collection_name = f"repo_{session_id}"
-        print(f"[DEBUG] ChromaDB 컬렉션 조회 시도: {collection_name}")
-        
-        # 컬렉션 존재 확인
+        # 세션 인덱스 열기 (NumPy 또는 ChromaDB 백엔드)
+        collection_name = index_name(session_id)
+        print(f"[DEBUG] 벡터 인덱스 조회 시도: {collection_name}")
         try:
-            collections = chroma_client.list_collections()
-            collection_names = [col.name for col in collections]
-            print(f"[DEBUG] 사용 가능한 컬렉션 목록: {collection_names}")
-            
-            if collection_name not in collection_names:
-                print(f"[ERROR] 컬렉션을 찾을 수 없음: {collection_name}")
-                return {
-                    'answer': "저장소 분석 데이터를 찾을 수 없습니다. 저장소를 다시 분석해주세요.",
-                    'error': "collection_not_found",
-                    'modified_code': "",
-                    'file_name': ""
-                }
+            collection = index_future.result()
         except Exception as e:
             import traceback
-            print(f"[ERROR] ChromaDB 컬렉션 목록 조회 실패: {e}")
+            print(f"[ERROR] 벡터 인덱스 열기 실패: {e}")
             traceback.print_exc()
-            return {
+            return None, {
                 'answer': f"저장소 분석 데이터 접근 중 오류가 발생했습니다: {str(e)}",
-                'error': "collection_list_error",
+                'error': "collection_access_error",
                 'modified_code': "",
                 'file_name': ""
             }
         
-        # 컬렉션 가져오기
-        try:
-            collection = chroma_client.get_collection(name=collection_name)
-            print(f"[DEBUG] 컬렉션 조회 성공: {collection_name}")
-            
-            # 컬렉션 내 문서 수 확인
-            try:
-                collection_count = collection.count()
-                print(f"[DEBUG] 컬렉션 내 문서 수: {collection_count}")
-                if collection_count == 0:
-                    print(f"[WARNING] 컬렉션이 비어 있습니다: {collection_name}")
-                    return {
-                        'answer': "저장소 분석 데이터가 비어 있습니다. 저장소를 다시 분석해주세요.",
-                        'error': "empty_collection",
-                        'modified_code': "",
-                        'file_name': ""
-                    }
-            except Exception as e:
-                print(f"[WARNING] 컬렉션 문서 수 확인 실패: {e}")
-                # 문서 수 확인 실패는 치명적이지 않을 수 있으므로 계속 진행
-        except Exception as e:
-            import traceback
-            print(f"[ERROR] 컬렉션 가져오기 실패: {e}")
-            traceback.print_exc()
-            return {
-                'answer': f"저장소 분석 데이터 접근 중 오류가 발생했습니다: {str(e)}",
-                'error': "collection_access_error",
+        if collection is None:
+            print(f"[ERROR] 벡터 인덱스를 찾을 수 없음: {collection_name}")
+            return None, {
+                'answer': "저장소 분석 데이터를 찾을 수 없습니다. 저장소를 다시 분석해주세요.",
+                'error': "collection_not_found",
                 'modified_code': "",
                 'file_name': ""
             }
+        print(f"[DEBUG] 벡터 인덱스 조회 성공: {collection_name} (백엔드: {collection.backend})")
         
-        # 유사 코드 청크 검색
-        print(f"[DEBUG] 유사 코드 청크 검색 시작 (TOP_K={TOP_K})")
+        # 인덱스 내 문서 수 확인
         try:
-            results = collection.query(
-                query_embeddings=[embedding],
-                n_results=TOP_K
-            )
+            collection_count = collection.count()
+            print(f"[DEBUG] 인덱스 내 문서 수: {collection_count}")
+            if collection_count == 0:
+                print(f"[WARNING] 인덱스가 비어 있습니다: {collection_name}")
+                return None, {
+                    'answer': "저장소 분석 데이터가 비어 있습니다. 저장소를 다시 분석해주세요.",
+                    'error': "empty_collection",
+                    'modified_code': "",
+                    'file_name': ""
+                }
+        except Exception as e:
+            print(f"[WARNING] 인덱스 문서 수 확인 실패: {e}")
+            # 문서 수 확인 실패는 치명적이지 않을 수 있으므로 계속 진행
+        
+        # 유사 코드 청크 검색 (요청 범위를 메타데이터 필터로 적용)
+        scope = extract_scope_from_question(message)
+        print(f"[DEBUG] 유사 코드 청크 검색 시작 (TOP_K={TOP_K}, 범위: {scope})")
+        try:
+            results = query_with_scope(collection, embedding, scope, session_data.get('files', []),
+                                       n_results=CANDIDATE_K, include=CANDIDATE_INCLUDE)
+            results = rerank_results(results, embedding, TOP_K)
             print(f"[DEBUG] 검색 결과 구조: {list(results.keys())}")
         except Exception as e:
             import traceback
             print(f"[ERROR] 유사 코드 청크 검색 실패: {e}")
             traceback.print_exc()
-            return {
+            return None, {
                 'answer': f"코드 검색 중 오류가 발생했습니다: {str(e)}",
                 'error': "query_error",
                 'modified_code': "",
@@ -556,24 +879,25 @@ def handle_modify_request(session_id, message):
         # 검색 결과 유효성 검증
         if not results or 'metadatas' not in results or not results['metadatas'] or not results['metadatas'][0]:
             print(f"[WARNING] 검색 결과가 비어 있습니다")
-            return {
+            return None, {
                 'answer': "질문과 관련된 코드를 찾을 수 없습니다. 다른 질문을 시도해보세요.",
                 'error': "no_results",
                 'modified_code': "",
                 'file_name': ""
             }
         
-        # 관련 파일 경로 추출
-        related_files = set()
+        # 관련 파일 경로 추출 (검색 관련도 순서 유지)
+        related_files = []
         for metadata in results['metadatas'][0]:
             if 'path' in metadata:
-                related_files.add(metadata['path'])
+                if metadata['path'] not in related_files:
+                    related_files.append(metadata['path'])
             else:
                 print(f"[WARNING] 메타데이터에 'path' 키가 없습니다: {metadata}")
         
         if not related_files:
             print("[WARNING] 관련 파일을 찾을 수 없습니다.")
-            return {
+            return None, {
                 'answer': "질문과 관련된 코드 파일을 찾을 수 없습니다. 다른 질문을 시도해보세요.",
                 'error': "no_related_files",
                 'modified_code': "",
@@ -598,116 +922,55 @@ def handle_modify_request(session_id, message):
 
     except Exception as e:
         print(f"[ERROR] 코드 청크 검색 오류: {e}")
-        return {
+        return None, {
             'answer': "코드 검색 중 오류가 발생했습니다. 새로운 레포지토리를 분석해주세요.",
             'error': "search_error",
             'modified_code': "",
             'file_name': ""
         }
     
-    # 관련 파일들의 전체 내용 로드
-    print(f"[DEBUG] 관련 파일 {len(related_files)}개의 전체 내용 로드 시작")
-    full_file_contents = []
-    failed_files = []
+    # 검색된 청크를 감싸는 함수/클래스 범위와 참조 심볼 정의로 컨텍스트 구성 (작은 파일은 전체)
+    store = get_file_store(session_id, session_data)
+    context_items = build_modify_context(store, results['documents'][0], results['metadatas'][0])
+    kinds = {}
+    for item in context_items:
+        kinds[item['kind']] = kinds.get(item['kind'], 0) + 1
+    print(f"[DEBUG] 코드수정 컨텍스트 항목: {kinds}")
     
-    for file_path in related_files:
-        print(f"[DEBUG] 파일 로드 시도: {file_path}")
-        try:
-            # 로컬 저장소 경로 확인
-            local_file_path = f"{repo_path}/{file_path}"
-            print(f"[DEBUG] 로컬 파일 경로: {local_file_path}")
-            
-            # 파일 존재 확인
-            import os
-            if not os.path.exists(local_file_path):
-                print(f"[WARNING] 파일이 로컬에 존재하지 않음: {local_file_path}")
-                raise FileNotFoundError(f"파일을 찾을 수 없습니다: {local_file_path}")
-                
-            # 로컬 저장소에서 파일 읽기
-            with open(local_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                print(f"[DEBUG] 파일 로드 성공: {file_path} (길이: {len(content)} 문자)")
-                full_file_contents.append(f"// FILE: {file_path}\n{content}")
-        except UnicodeDecodeError as ude:
-            print(f"[WARNING] 파일 인코딩 오류 ({file_path}): {ude}")
-            try:
-                # 다른 인코딩으로 시도
-                with open(f"{repo_path}/{file_path}", 'r', encoding='latin-1') as f:
-                    content = f.read()
-                    print(f"[DEBUG] 파일 latin-1 인코딩으로 로드 성공: {file_path}")
-                    full_file_contents.append(f"// FILE: {file_path}\n{content}")
-            except Exception as e_inner:
-                print(f"[ERROR] 다른 인코딩으로도 파일 읽기 실패 ({file_path}): {e_inner}")
-                failed_files.append(file_path)
-        except Exception as e:
-            import traceback
-            print(f"[ERROR] 파일 읽기 오류 ({file_path}): {e}")
-            traceback.print_exc()
-            
-            # 읽기 실패 시 GitHub에서 직접 가져오기 시도
-            try:
-                print(f"[DEBUG] GitHub에서 파일 가져오기 시도: {file_path}")
-                from github_analyzer import GitHubAnalyzer
-                
-                # 저장소 URL 확인
-                repo_url = session_data.get('repo_url')
-                if not repo_url:
-                    print(f"[ERROR] 저장소 URL이 없습니다.")
-                    failed_files.append(file_path)
-                    continue
-                    
-                analyzer = GitHubAnalyzer(repo_url, session_data.get('token'), session_id)
-                content = analyzer.fetch_file_content(file_path)
-                
-                if content:
-                    print(f"[DEBUG] GitHub에서 파일 가져오기 성공: {file_path} (길이: {len(content)} 문자)")
-                    full_file_contents.append(f"// FILE: {file_path}\n{content}")
-                else:
-                    print(f"[WARNING] GitHub에서 파일 가져오기 실패 (내용 없음): {file_path}")
-                    failed_files.append(file_path)
-            except Exception as e2:
-                import traceback
-                print(f"[ERROR] GitHub에서 파일 가져오기 오류 ({file_path}): {e2}")
-                traceback.print_exc()
-                failed_files.append(file_path)
-    
-    # 파일 로드 결과 요약
-    print(f"[DEBUG] 총 {len(related_files)}개 파일 중 {len(full_file_contents)}개 로드 성공, {len(failed_files)}개 실패")
-    if failed_files:
-        print(f"[WARNING] 로드 실패한 파일들: {failed_files}")
-        
-    # 로드된 파일이 없는 경우 처리
-    if not full_file_contents:
-        print(f"[ERROR] 파일을 하나도 로드하지 못했습니다.")
-        return {
+    # 컨텍스트를 구성하지 못한 경우 처리
+    if not context_items:
+        print(f"[ERROR] 관련 코드를 하나도 로드하지 못했습니다.")
+        return None, {
             'answer': "관련 코드 파일을 로드하지 못했습니다. 저장소를 다시 분석해주세요.",
             'error': "file_load_error",
             'modified_code': "",
             'file_name': ""
         }
     
-    # 청크 검색 결과도 함께 컨텍스트로 사용
-    context_chunks = [doc for doc in results['documents'][0]]
-    
-    # 청크 검색 결과와 파일 전체 내용 합치기
-    if full_file_contents:
-        context = "\n\n=== 관련 파일 전체 내용 ===\n\n" + "\n\n---\n\n".join(full_file_contents)
-        context += "\n\n=== 관련 코드 청크 ===\n\n" + "\n---\n".join(context_chunks)
-    else:
-        # 파일 전체 내용을 가져오지 못한 경우 청크만 사용
-        context = "\n---\n".join(context_chunks)
-    
-    # 디렉토리 구조 가져오기
-    directory_structure = session_data.get('directory_structure')
+    # 고정 접두부와 관련 파일로 가는 디렉토리 가지
+    system_prompt = build_system_prompt(session_data, repo_path, 'modify')
+    context_paths = list(dict.fromkeys(item['path'] for item in context_items))
+    directory_structure = render_session_tree(session_data, repo_path, context_paths)
     
     if directory_structure:
-        print(f"[DEBUG] 디렉토리 구조 정보 제공 (길이: {len(directory_structure)} 문자)")
+        print(f"[DEBUG] 관련 디렉토리 구조 정보 제공 (길이: {len(directory_structure)} 문자)")
     else:
-        print("[DEBUG] 디렉토리 구조 정보가 없습니다.")
-        directory_structure = "프로젝트 구조 정보가 없습니다. 파일 내용만 참고하여 응답하겠습니다."
+        print("[DEBUG] 관련 디렉토리 구조 정보가 없습니다.")
+        directory_structure = "관련 디렉토리 정보가 없습니다. 위 프로젝트 구조와 파일 내용만 참고하여 응답하겠습니다."
     
-    # 프롬프트 생성 및 LLM 호출
+    # 토큰 예산 안에서 프롬프트 구성
     try:
+        # 토큰 예산 안에서 우선순위 순서로 컨텍스트 항목을 채움 (항목은 자르지 않음)
+        separator = "\n\n---\n\n"
+        fixed_tokens = count_tokens(system_prompt) + count_tokens(MODIFY_PROMPT_TEMPLATE.format(
+            context="",
+            request=message,
+            directory_structure=directory_structure
+        ))
+        budget = context_budget(CHAT_MODEL, fixed_tokens, MODIFY_MAX_TOKENS)
+        packed, used_tokens = pack_context(context_items, budget, separator=separator)
+        context = separator.join(packed)
+        
         # 프롬프트 생성
         prompt = MODIFY_PROMPT_TEMPLATE.format(
             context=context, 
@@ -715,93 +978,181 @@ def handle_modify_request(session_id, message):
             directory_structure=directory_structure
         )
         print("\n[LLM 프롬프트 - 코드수정]\n" + prompt + "\n")  # 프롬프트 확인용 출력
-        print(f"[DEBUG] 코드수정 프롬프트 길이: {len(prompt)} 문자")
-        
-        # 프롬프트 길이 제한 확인
-        if len(prompt) > 100000:  # OpenAI API의 토큰 제한을 고려한 값
-            print(f"[WARNING] 코드수정 프롬프트가 너무 깁니다. 컨텍스트 일부를 잘라냅니다.")
-            # 컨텍스트 길이 제한
-            max_context_length = 80000  # 적절한 길이로 조정
-            truncated_context = context[:max_context_length] + "\n... (컨텍스트 길이 제한으로 인해 일부 내용이 생략되었습니다) ..."
-            prompt = MODIFY_PROMPT_TEMPLATE.format(
-                context=truncated_context, 
-                request=message,
-                directory_structure=directory_structure
-            )
-            print(f"[DEBUG] 수정된 코드수정 프롬프트 길이: {len(prompt)} 문자")
-        
-        # LLM 호출
-        print(f"[DEBUG] 코드수정용 OpenAI API 호출 시작 (model=gpt-4o, temperature=0.2, max_tokens=4096)")
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": SYSTEM_PROMPT_MODIFY},
-                      {"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=4096
-        )
-        
-        # 응답 처리
-        if not response or not response.choices or not response.choices[0].message:
-            print(f"[ERROR] 코드수정 LLM 응답이 비어 있습니다: {response}")
-            return {
-                'answer': "코드 수정 중 오류가 발생했습니다. 다시 시도해주세요.",
-                'error': "empty_response",
-                'modified_code': "",
-                'file_name': ""
-            }
-        
-        llm_code = response.choices[0].message.content.strip()
-        print(f"[DEBUG] 코드수정 LLM 응답 성공 (길이: {len(llm_code)} 문자)")
-        
-        # 응답이 비어있는지 확인
-        if not llm_code:
-            print("[WARNING] 코드수정 LLM이 비어있는 응답을 리턴했습니다.")
+        print(f"[DEBUG] 코드수정 프롬프트 토큰 수: 약 {fixed_tokens + used_tokens} (컨텍스트 예산: {budget})")
+    except Exception as e:
+        import traceback
+        print(f"[ERROR] 코드수정 프롬프트 구성 오류: {e}")
+        traceback.print_exc()
+        return None, {
+            'answer': f"코드 수정 중 오류가 발생했습니다: {str(e)}",
+            'error': "llm_error",
+            'modified_code': "",
+            'file_name': ""
+        }
+    return [{"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}], None
+
+def modify_request_args(messages):
+    """코드 수정용 chat.completions.create 인자"""
+    return dict(model=CHAT_MODEL, messages=messages, temperature=0.2, max_tokens=MODIFY_MAX_TOKENS)
+
+def finish_modify(session_id, response):
+    """코드수정 LLM 응답에서 파일명과 코드를 분리하여 세션에 제안된 변경사항으로 저장"""
+    from app import sessions
+    # 응답 처리
+    if not response or not response.choices or not response.choices[0].message:
+        print(f"[ERROR] 코드수정 LLM 응답이 비어 있습니다: {response}")
+        return {
+            'answer': "코드 수정 중 오류가 발생했습니다. 다시 시도해주세요.",
+            'error': "empty_response",
+            'modified_code': "",
+            'file_name': ""
+        }
+    
+    llm_code = response.choices[0].message.content.strip()
+    record_usage(getattr(response, 'usage', None))
+    print(f"[DEBUG] 코드수정 LLM 응답 성공 (길이: {len(llm_code)} 문자)")
+    
+    # 응답이 비어있는지 확인
+    if not llm_code:
+        print("[WARNING] 코드수정 LLM이 비어있는 응답을 리턴했습니다.")
+        return {
+            'answer': "코드 수정을 생성하지 못했습니다. 다른 수정 요청을 시도해주세요.",
+            'error': "empty_code",
+            'modified_code': "",
+            'file_name': ""
+        }
+    
+    # 편집 블록을 세션 파일 원본에 적용 (블록이 없으면 이전 형식인 파일 전체 코드로 처리)
+    session_data = sessions.get(session_id, {})
+    store = get_file_store(session_id, session_data)
+    def resolve_edit_path(name):
+        # LLM이 지정한 경로는 저장소 안의 상대 경로만 허용하고, 여러 파일과 일치하면 추측하지 않음
+        path = normalize_edit_path(name)
+        if path is None:
+            raise ValueError(f"저장소 밖을 가리키는 파일 경로는 사용할 수 없습니다: {name}")
+        matches = store.resolve(path)
+        if len(matches) > 1:
+            raise ValueError(f"파일 경로가 여러 파일과 일치합니다 ({', '.join(matches[:5])}). 전체 경로를 지정해야 합니다.")
+        return (matches[0], True) if matches else (path, False)
+
+    blocks = parse_edit_blocks(llm_code)
+    if blocks:
+        def read_file(name):
+            path, exists = resolve_edit_path(name)
+            return path, store.read(path) if exists else None
+        changes, errors = apply_edit_blocks(blocks, read_file)
+        print(f"[DEBUG] 편집 블록 {len(blocks)}개 파싱, 변경 파일 {len(changes)}개, 실패 {len(errors)}개")
+        if errors:
+            for error in errors:
+                print(f"[WARNING] 편집 블록 적용 실패: {error}")
             return {
-                'answer': "코드 수정을 생성하지 못했습니다. 다른 수정 요청을 시도해주세요.",
-                'error': "empty_code",
+                'answer': "제안된 수정 내용을 원본 코드에 적용하지 못했습니다. 다시 시도해주세요.\n" + "\n".join(errors),
+                'error': "edit_apply_failed",
                 'modified_code': "",
                 'file_name': ""
             }
-        
-        # 파일명과 코드 분리
+    else:
         file_name, code = parse_llm_code_response(llm_code)
-        print(f"[DEBUG] 파싱된 파일명: '{file_name or '(none)'}', 코드 길이: {len(code)} 문자")
-        
-        # 코드가 비어있는지 확인
-        if not code:
-            print("[WARNING] 파싱된 코드가 비어 있습니다.")
-            return {
-                'answer': "코드 수정을 생성하지 못했습니다. 다른 수정 요청을 시도해주세요.",
-                'error': "empty_parsed_code",
-                'modified_code': "",
-                'file_name': ""
-            }
-        
-        # 성공적인 응답 반환
-        # LLM이 제안한 변경사항을 세션에 임시 저장합니다.
-        sessions[session_id]['suggested_change'] = {
-            'file_name': file_name or '',
-            'modified_code': code
-        }
-        # 세션 파일에 저장
-        from app import save_sessions # app 모듈에서 import
-        save_sessions(sessions)
-        print(f"[DEBUG] 제안된 변경사항 세션에 저장 완료: {file_name or '(none)'}")
-
-        return {'modified_code': code, 'file_name': file_name or ''}
-    except Exception as e:
-        import traceback
-        print(f"[ERROR] 코드수정 LLM 호출 오류: {e}")
-        traceback.print_exc()
+        print(f"[DEBUG] 편집 블록 없음, 전체 코드로 처리 - 파일명: '{file_name or '(none)'}', 코드 길이: {len(code)} 문자")
+        path, original = file_name or '', None
+        if file_name and code:
+            try:
+                path, exists = resolve_edit_path(file_name)
+            except ValueError as e:
+                print(f"[WARNING] 수정 파일 경로 오류: {e}")
+                return {
+                    'answer': f"제안된 수정 내용을 적용할 파일을 정할 수 없습니다. 다시 시도해주세요.\n{e}",
+                    'error': "edit_apply_failed",
+                    'modified_code': "",
+                    'file_name': ""
+                }
+            original = store.read(path) if exists else None
+        changes = [{'file_name': path, 'original': original, 'modified_code': code, 'is_new': original is None}] if code else []
+    
+    # 변경된 코드가 없는지 확인
+    if not changes:
+        print("[WARNING] 적용할 변경사항이 없습니다.")
         return {
-            'answer': f"코드 수정 중 오류가 발생했습니다: {str(e)}",
-            'error': "llm_error",
+            'answer': "코드 수정을 생성하지 못했습니다. 다른 수정 요청을 시도해주세요.",
+            'error': "empty_parsed_code",
             'modified_code': "",
             'file_name': ""
         }
+    
+    files = []
+    for change in changes:
+        diff = unified_diff(change['file_name'], change['original'], change['modified_code'])
+        files.append({'file_name': change['file_name'], 'modified_code': change['modified_code'],
+                      'diff': diff, 'is_new': change['is_new']})
+    
+    # 성공적인 응답 반환
+    # LLM이 제안한 변경사항(여러 파일의 변경 묶음)을 세션에 임시 저장합니다.
+    # 원래 파일의 인코딩을 함께 저장하여 적용할 때 같은 인코딩으로 씁니다.
+    change_files = [{'file_name': f['file_name'], 'modified_code': f['modified_code'], 'is_new': f['is_new'],
+                     'encoding': store.encoding(f['file_name'])} for f in files]
+    # 미리보기 전에 변경 묶음 전체를 정적 검사 (설정된 경우 빠른 테스트도 실행)
+    validation = validate_change_set(change_files, repo_path=f"./repos/{session_id}")
+    from app import save_sessions, sessions_lock # app 모듈에서 import
+    with sessions_lock:
+        sessions[session_id]['suggested_change'] = {
+            'files': change_files,
+            'validation': validation
+        }
+    # 세션 파일에 저장
+    save_sessions(sessions)
+    print(f"[DEBUG] 제안된 변경사항 세션에 저장 완료: {[f['file_name'] for f in files]}")
+    
+    return {
+        'modified_code': files[0]['modified_code'],
+        'file_name': files[0]['file_name'],
+        'diff': ''.join(f['diff'] for f in files),
+        'files': files,
+        'validation': validation
+    }
 
-def apply_changes(session_id, file_name, new_content):
-    """코드 변경사항을 저장소에 적용하고 커밋/푸시하는 함수"""
+def modify_llm_error_result(e):
+    import traceback
+    print(f"[ERROR] 코드수정 LLM 호출 오류: {e}")
+    traceback.print_exc()
+    return {
+        'answer': f"코드 수정 중 오류가 발생했습니다: {str(e)}",
+        'error': "llm_error",
+        'modified_code': "",
+        'file_name': ""
+    }
+
+def handle_modify_request(session_id, message):
+    messages, result = prepare_modify(session_id, message)
+    if result is not None:
+        return result
+    try:
+        print(f"[DEBUG] 코드수정용 LLM API 호출 시작 (model={CHAT_MODEL}, temperature=0.2, max_tokens={MODIFY_MAX_TOKENS})")
+        response = get_provider().chat(**modify_request_args(messages))
+        return finish_modify(session_id, response)
+    except Exception as e:
+        return modify_llm_error_result(e)
+
+async def handle_modify_request_async(session_id, message):
+    """handle_modify_request의 비동기 버전 (LLM 호출은 비동기 클라이언트로, 나머지 단계는 스레드에서 실행)"""
+    messages, result = await asyncio.to_thread(prepare_modify, session_id, message)
+    if result is not None:
+        return result
+    try:
+        print(f"[DEBUG] 코드수정용 LLM 비동기 API 호출 시작 (model={CHAT_MODEL}, temperature=0.2, max_tokens={MODIFY_MAX_TOKENS})")
+        response = await get_provider().chat_async(**modify_request_args(messages))
+        return await asyncio.to_thread(finish_modify, session_id, response)
+    except Exception as e:
+        return modify_llm_error_result(e)
+
+def apply_changes(session_id, file_name=None, new_content=None, force=False):
+    """
+    제안된 변경 묶음(여러 파일)을 저장소에 적용하고 하나의 커밋으로 커밋/푸시하는 함수
+
+    적용할 내용은 세션의 suggested_change에서 읽습니다. (file_name/new_content는 이전 API 호환용으로 사용하지 않음)
+    검증에 실패한 변경 묶음은 force가 아니면 적용하지 않습니다.
+    커밋이 실패하면 CodeModifier.commit_files가 이미 쓴 파일을 원래 내용으로 되돌립니다.
+    """
     print(f"[DEBUG] 코드 변경사항 적용 시작 (session_id: {session_id})")
     
     # 입력값 검증
@@ -810,7 +1161,7 @@ def apply_changes(session_id, file_name, new_content):
         return {'result': '에러: 세션 ID가 제공되지 않았습니다.'}
 
     # 세션에서 제안된 변경사항 가져오기
-    from app import sessions
+    from app import sessions, save_sessions, sessions_lock
     session_data = sessions.get(session_id, {})
     if not session_data:
         print("[ERROR] 유효하지 않은 세션 ID입니다.")
@@ -821,89 +1172,197 @@ def apply_changes(session_id, file_name, new_content):
         print("[ERROR] 적용할 제안된 변경사항이 없습니다.")
         return {'result': '에러: 적용할 제안된 변경사항이 없습니다. 코드 수정을 먼저 요청해주세요.'}
 
-    # 제안된 변경사항에서 파일명과 내용 추출
-    apply_file_name = suggested_change.get('file_name')
-    apply_content = suggested_change.get('modified_code')
+    # 변경 묶음의 파일 목록 (이전 형식의 세션은 파일 하나짜리 묶음으로 처리)
+    apply_files = suggested_change.get('files') or [
+        {'file_name': suggested_change.get('file_name'), 'modified_code': suggested_change.get('modified_code')}
+    ]
 
-    if not apply_file_name or not apply_content:
+    if not all(f.get('file_name') and f.get('modified_code') for f in apply_files):
         print("[ERROR] 제안된 변경사항의 파일명 또는 내용이 비어 있습니다.")
-        # 세션에서 해당 정보 삭제 (다음 요청을 위해) - 필요에 따라 주석 처리 가능
-        # del sessions[session_id]['suggested_change']
-        # from app import save_sessions
-        # save_sessions(sessions)
         return {'result': '에러: 적용할 코드 내용이 비어 있습니다.'}
 
-    print(f"[DEBUG] 적용할 파일: {apply_file_name}, 내용 길이: {len(apply_content)}")
+    file_names = [f['file_name'] for f in apply_files]
+    validation = suggested_change.get('validation')
+    if validation and not validation.get('ok') and not force:
+        failed = [c['file_name'] for c in validation.get('files', []) if not c.get('ok')]
+        if validation.get('tests') and not validation['tests'].get('ok'):
+            failed.append('(테스트)')
+        print(f"[ERROR] 검증에 실패한 변경사항은 적용하지 않습니다: {failed}")
+        return {'result': f"에러: 검증에 실패한 변경사항입니다 - {', '.join(failed)}", 'files': file_names,
+                'validation': validation}
+
+    for f in apply_files:
+        print(f"[DEBUG] 적용할 파일: {f['file_name']}, 내용 길이: {len(f['modified_code'])}")
 
     # 저장소 경로 확인
     repo_path = f"./repos/{session_id}"
     print(f"[DEBUG] 저장소 경로: {repo_path}")
     
-    import os
     if not os.path.exists(repo_path):
         print(f"[ERROR] 저장소 경로가 존재하지 않습니다: {repo_path}")
-        # 세션에서 해당 정보 삭제 (다음 요청을 위해)
-        # del sessions[session_id]['suggested_change']
-        # from app import save_sessions
-        # save_sessions(sessions)
         return {'result': f'에러: 저장소 경로가 존재하지 않습니다: {repo_path}'}
     
     # CodeModifier 인스턴스 생성
     modifier = CodeModifier()
 
     commit_msg = "AI 코드 자동 수정" # 기본 커밋 메시지
+    if len(file_names) > 1:
+        commit_msg += "\n\n" + "\n".join(f"- {name}" for name in file_names)
     # TODO: 사용자로부터 커밋 메시지를 입력받는 로직 추가 필요
 
     try:
-        # 변경사항 커밋
-        print(f"[DEBUG] 코드 변경사항 커밋 시작: {apply_file_name}")
-        commit_result = modifier.commit_changes(repo_path, apply_file_name, apply_content, commit_msg)
+        # 모든 파일을 한 번에 스테이징하고 하나의 커밋으로 (실패하면 파일별로 되돌림)
+        print(f"[DEBUG] 코드 변경사항 커밋 시작: {file_names}")
+        commit_result = modifier.commit_files(repo_path, apply_files, commit_msg)
         
         if not commit_result['success']:
-            print(f"[ERROR] 커밋 실패: {commit_result['error']}")
-            # 세션에서 해당 정보 삭제 (다음 요청을 위해)
-            # del sessions[session_id]['suggested_change']
-            # from app import save_sessions
-            # save_sessions(sessions)
-            return {'result': f"에러: 커밋 실패 - {commit_result['error']}"}
+            print(f"[ERROR] 커밋 실패: {commit_result['error']} (되돌린 파일: {commit_result.get('rolled_back', [])})")
+            return {'result': f"에러: 커밋 실패 - {commit_result['error']}", 'files': file_names,
+                    'rolled_back': commit_result.get('rolled_back', [])}
 
         print(commit_result['message']) # 커밋 성공 메시지 출력
+        # 파일 저장소에 캐시된 이전 내용 제거 (다음 요청은 커밋된 내용을 읽음)
+        invalidate_files(session_id, file_names)
+        # 바뀐 파일만 다시 인덱싱 (푸시와 동시에 실행)
+        reindex_future = _stage_executor.submit(reindex_applied_files, session_id, file_names)
+
+        # 세션에서 제안된 변경사항 삭제 (커밋 완료, 같은 변경을 다시 적용하지 않도록 - 저장은 재인덱싱 결과와 함께)
+        with sessions_lock:
+            session_data.pop('suggested_change', None)
+        print("[DEBUG] 세션에서 제안된 변경사항 삭제 완료")
 
-        # 변경사항 푸시
+        # 변경사항 푸시 (커밋 하나를 한 번에)
         print("[DEBUG] 코드 변경사항 푸시 시작")
         push_result = modifier.push_changes(repo_path)
         
+        # 재인덱싱 결과(세션 파일 목록/커밋 SHA)를 반영하고 세션을 한 번만 저장
+        # (시간 안에 끝나지 않으면 끝날 때 반영/저장)
+        reindex = wait_reindex(reindex_future)
+        if reindex.get('pending'):
+            reindex_future.add_done_callback(lambda future: finish_late_reindex(session_id, future))
+        else:
+            apply_reindex_update(session_id, reindex.pop('session_update', None))
+        save_sessions(sessions)
         if not push_result['success']:
             print(f"[ERROR] 푸시 실패: {push_result['error']}")
-            # 세션에서 해당 정보 삭제 (다음 요청을 위해)
-            # del sessions[session_id]['suggested_change']
-            # from app import save_sessions
-            # save_sessions(sessions)
-            return {'result': f"경고: 커밋은 성공했으나 푸시 실패 - {push_result['error']}"} # 푸시 실패는 경고로 처리 가능
+            return {'result': f"경고: 커밋은 성공했으나 푸시 실패 - {push_result['error']}", 'files': file_names,
+                    'reindex': reindex} # 푸시 실패는 경고로 처리 가능
 
         print(push_result['message']) # 푸시 성공 메시지 출력
-
-        # 세션에서 제안된 변경사항 삭제 (성공적으로 적용 완료)
-        if 'suggested_change' in sessions[session_id]:
-            del sessions[session_id]['suggested_change']
-            from app import save_sessions
-            save_sessions(sessions)
-            print("[DEBUG] 세션에서 제안된 변경사항 삭제 완료")
-
-        return {'result': '코드가 성공적으로 커밋 및 푸시되었습니다.'}
+        return {'result': f'코드가 성공적으로 커밋 및 푸시되었습니다. (파일 {len(file_names)}개)', 'files': file_names,
+                'reindex': reindex}
         
     except Exception as e:
         import traceback
         print(f"[ERROR] 코드 변경사항 적용(커밋/푸시) 실패: {e}")
         traceback.print_exc()
         # 오류 발생 시에도 세션에서 제안된 변경사항 삭제 (다음 요청을 위해)
-        if session_id in sessions and 'suggested_change' in sessions[session_id]:
-             del sessions[session_id]['suggested_change']
-             from app import save_sessions
+        with sessions_lock:
+            removed = sessions.get(session_id, {}).pop('suggested_change', None)
+        if removed is not None:
              save_sessions(sessions)
              print("[DEBUG] 오류 발생 후 세션에서 제안된 변경사항 삭제 완료")
         return {'result': f'에러: 코드 적용 중 오류 발생 - {str(e)}'}
 
+def reindex_applied_files(session_id, file_names):
+    """
+    커밋된 파일만 다시 청크 분할/임베딩하여 세션 인덱스를 갱신하는 함수 (_stage_executor에서 실행)
+
+    내용이 바뀌지 않은 청크는 이전 임베딩을 재사용합니다.
+    세션 데이터는 바꾸거나 저장하지 않고, 새 세션 파일 목록과 커밋 SHA를 'session_update'로 돌려주며
+    apply_changes가 apply_reindex_update로 반영합니다.
+
+    Returns:
+        dict: {'files', 'chunks', 'reused', 'embedded', 'seconds', 'session_update': {'files', 'commit_sha'}}
+    """
+    from app import sessions
+    started = time.perf_counter()
+    session_data = sessions.get(session_id, {})
+    repo_path = f"./repos/{session_id}"
+    by_path = {f['path']: f for f in session_data.get('files') or []}
+
+    changed, removed = [], []
+    for file_name in file_names:
+        full_path = os.path.join(repo_path, file_name)
+        if not os.path.exists(full_path):
+            removed.append(file_name)
+            continue
+        if file_name not in by_path and os.path.splitext(file_name)[1] not in MAIN_EXTENSIONS:
+            # 분석 대상이 아닌 확장자의 새 파일은 인덱싱하지 않음 (분석할 때와 같은 기준)
+            continue
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        content, _ = decode_source(data)
+        meta = dict(by_path.get(file_name) or {
+            'path': file_name,
+            'file_name': os.path.basename(file_name),
+            'file_type': os.path.splitext(file_name)[1].lstrip('.'),
+            'source_url': '',
+        })
+        meta['sha'] = git_blob_sha(data)
+        changed.append(dict(meta, content=content))
+
+    stats = RepositoryEmbedder(session_id).update_files(changed, removed) if changed or removed else {}
+
+    # 새 세션 파일 목록(내용 제외)과 커밋 SHA
+    updated = {f['path']: {k: v for k, v in f.items() if k != 'content'} for f in changed}
+    files = [updated.pop(f['path'], f) for f in session_data.get('files') or [] if f['path'] not in removed]
+    files.extend(updated.values())
+    commit_sha = None
+    try:
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_path, capture_output=True, text=True, check=True)
+        commit_sha = head.stdout.strip() or None
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"[WARNING] 커밋 SHA 확인 실패: {e}")
+
+    result = dict(stats, files=[f['path'] for f in changed] + removed, seconds=round(time.perf_counter() - started, 2))
+    print(f"[DEBUG] 적용된 파일 재인덱싱 완료: {result}")
+    result['session_update'] = {'files': files, 'commit_sha': commit_sha}
+    return result
+
+def apply_reindex_update(session_id, update):
+    """
+    재인덱싱 결과의 세션 파일 목록/커밋 SHA를 세션에 반영 (저장은 호출하는 쪽에서)
+
+    세션 파일 목록을 새 리스트로 바꾸므로 파일 저장소/심볼 색인은 다음 요청에서 다시 만들어지고,
+    커밋 SHA가 바뀌므로 고정 접두부/디렉토리 트리/답변 캐시도 새 커밋 기준으로 사용됩니다.
+    """
+    if not update:
+        return
+    from app import sessions, sessions_lock
+    with sessions_lock:
+        session_data = sessions.get(session_id)
+        if session_data is None:
+            return
+        session_data['files'] = update['files']
+        if update.get('commit_sha'):
+            session_data['commit_sha'] = update['commit_sha']
+    invalidate_files(session_id)
+
+def finish_late_reindex(session_id, future):
+    """wait_reindex 시간 안에 끝나지 않은 재인덱싱이 끝나면 결과를 세션에 반영하고 저장"""
+    from app import sessions, save_sessions
+    try:
+        result = future.result()
+    except Exception as e:
+        print(f"[ERROR] 적용된 파일 재인덱싱 실패: {e}")
+        return
+    apply_reindex_update(session_id, result.get('session_update'))
+    save_sessions(sessions)
+
+def wait_reindex(future):
+    """재인덱싱 결과를 REINDEX_WAIT_SECONDS까지 기다림 (실패/시간 초과는 응답에만 표시하고 적용은 성공으로 처리)"""
+    try:
+        return future.result(timeout=REINDEX_WAIT_SECONDS)
+    except FutureTimeoutError:
+        print("[WARNING] 재인덱싱이 아직 진행 중입니다 (백그라운드에서 계속)")
+        return {'pending': True}
+    except Exception as e:
+        import traceback
+        print(f"[ERROR] 적용된 파일 재인덱싱 실패: {e}")
+        traceback.print_exc()
+        return {'error': str(e)}
+
 def extract_scope_from_question(question: str):
     """
     질문에서 파일명, 함수명, 클래스명, 디렉토리명 등 범위 키워드 추출
@@ -912,9 +1371,263 @@ def extract_scope_from_question(question: str):
     func_match = re.findall(r'(\w+) ?함수', question)
     class_match = re.findall(r'(\w+) ?클래스', question)
     dir_match = re.findall(r'([\w_\-/]+)/', question)
+    # "templates 폴더", "static 디렉토리", "utils directory" 형태의 디렉토리 언급
+    dir_match += re.findall(r'([\w_\-]+) ?(?:폴더|디렉토리|디렉터리|directory|folder)', question, re.IGNORECASE)
     return {
         'file': file_match,
         'function': func_match,
         'class': class_match,
         'directory': dir_match
-    } 
+    }
+
+def build_scope_where(scope, session_files):
+    """
+    extract_scope_from_question 결과를 ChromaDB where 필터로 변환
+    파일명/디렉토리 언급은 세션의 실제 파일 경로로 해석하여 path 조건으로 만듭니다.
+    조건이 없으면 None을 반환합니다.
+    """
+    all_paths = [f['path'] for f in session_files if f.get('path')]
+    scoped_paths = set()
+    for name in scope.get('file', []):
+        name = name.strip('/')
+        for path in all_paths:
+            if path == name or path.endswith('/' + name):
+                scoped_paths.add(path)
+    for directory in scope.get('directory', []):
+        directory = directory.strip('/')
+        if not directory:
+            continue
+        for path in all_paths:
+            if path.startswith(directory + '/') or f"/{directory}/" in path:
+                scoped_paths.add(path)
+
+    # 함수/클래스 조건은 둘 중 하나만 맞으면 되고(OR), 파일/디렉토리 조건과는 함께 만족해야 함(AND)
+    symbol_conditions = []
+    if scope.get('function'):
+        symbol_conditions.append({'function_name': {'$in': list(dict.fromkeys(scope['function']))}})
+    if scope.get('class'):
+        symbol_conditions.append({'class_name': {'$in': list(dict.fromkeys(scope['class']))}})
+
+    conditions = []
+    if scoped_paths:
+        conditions.append({'path': {'$in': sorted(scoped_paths)}})
+    if len(symbol_conditions) == 1:
+        conditions.append(symbol_conditions[0])
+    elif symbol_conditions:
+        conditions.append({'$or': symbol_conditions})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {'$and': conditions}
+
+def query_with_scope(collection, embedding, scope, session_files, n_results=TOP_K, include=None):
+    """
+    질문 범위를 where 필터로 적용해 유사 청크를 검색
+    필터 검색 결과가 MIN_SCOPED_RESULTS보다 적을 때만 전체 검색 결과로 빈 자리를 채웁니다.
+    반환 형식은 collection.query와 동일합니다 (ids/documents/metadatas/distances[/embeddings]).
+    """
+    where = build_scope_where(scope, session_files)
+    scoped = None
+    if where:
+        print(f"[DEBUG] 범위 필터 검색: {where}")
+        try:
+            scoped = collection.query(
+                query_embeddings=[embedding],
+                n_results=n_results,
+                where=where,
+                include=include
+            )
+        except Exception as e:
+            print(f"[WARNING] 범위 필터 검색 실패, 전체 검색으로 대체: {e}")
+            scoped = None
+        if scoped and len(scoped['ids'][0]) >= MIN_SCOPED_RESULTS:
+            print(f"[DEBUG] 범위 필터 검색 결과 {len(scoped['ids'][0])}개 사용")
+            return scoped
+
+    results = collection.query(
+        query_embeddings=[embedding],
+        n_results=n_results,
+        include=include
+    )
+    if not scoped or not scoped['ids'][0]:
+        return results
+
+    # 범위 내 결과를 앞에 두고, 부족한 자리만 전체 검색 결과로 보충
+    print(f"[DEBUG] 범위 필터 검색 결과 부족 ({len(scoped['ids'][0])}개), 전체 검색으로 보충")
+    merged = {'ids': [[]], 'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+    with_embeddings = include is not None and 'embeddings' in include
+    if with_embeddings:
+        merged['embeddings'] = [[]]
+    for source in (scoped, results):
+        count = len(source['ids'][0])
+        distances = (source.get('distances') or [[]])[0] or [None] * count
+        embeddings = source['embeddings'][0] if with_embeddings else [None] * count
+        for doc_id, doc, meta, dist, emb in zip(source['ids'][0], source['documents'][0], source['metadatas'][0],
+                                                distances, embeddings):
+            if doc_id in merged['ids'][0] or len(merged['ids'][0]) >= n_results:
+                continue
+            merged['ids'][0].append(doc_id)
+            merged['documents'][0].append(doc)
+            merged['metadatas'][0].append(meta)
+            merged['distances'][0].append(dist)
+            if with_embeddings:
+                merged['embeddings'][0].append(emb)
+    return merged
+
+def is_broad_question(question: str, scope) -> bool:
+    """
+    특정 파일/함수/클래스를 지목하지 않고 프로젝트 전반을 묻는 질문인지 판별
+    """
+    if scope.get('file') or scope.get('function') or scope.get('class'):
+        return False
+    return bool(BROAD_QUESTION_PATTERN.search(question))
+
+def query_two_stage(session_id, collection, embedding, leases, n_files=TOP_FILES, n_results=TOP_K, include=None):
+    """
+    2단계 검색: 파일 요약 인덱스에서 핵심 파일을 고른 뒤 해당 파일들 안에서만 청크 검색
+    (파일 요약 인덱스는 leases(IndexLeases)로 대여)
+
+    Returns:
+        Tuple[Optional[dict], List[Tuple[str, str]]]:
+            (collection.query 형식의 청크 검색 결과 또는 None, [(파일 경로, 요약), ...])
+    """
+    file_index = leases.open(session_id, kind='files')
+    if file_index is None or file_index.count() == 0:
+        print("[DEBUG] 파일 요약 인덱스가 없어 일반 검색을 사용합니다.")
+        return None, []
+    file_hits = file_index.query(query_embeddings=[embedding], n_results=n_files)
+    paths = [meta['path'] for meta in file_hits['metadatas'][0]]
+    summaries = list(zip(paths, file_hits['documents'][0]))
+    print(f"[DEBUG] 1단계 파일 요약 검색 결과: {paths}")
+    if not paths:
+        return None, []
+    results = collection.query(
+        query_embeddings=[embedding],
+        n_results=n_results,
+        where={'path': {'$in': paths}},
+        include=include
+    )
+    if not results['ids'][0]:
+        return None, summaries
+    return results, summaries
+
+def reuse_chunks(collection, chunk_ids):
+    """
+    직전 답변에 사용한 청크를 ID로 다시 가져와 collection.query 형식으로 반환 (없으면 None)
+
+    임베딩을 함께 가져오므로 rerank_results가 새 질문 기준으로 다시 정렬/병합합니다.
+    """
+    data = collection.get(ids=list(chunk_ids), include=['documents', 'metadatas', 'embeddings'])
+    if not len(data['ids']):
+        return None
+    print(f"[DEBUG] 후속 질문: 직전 답변의 청크 {len(data['ids'])}개 재사용 (검색 생략)")
+    return {
+        'ids': [list(data['ids'])],
+        'documents': [data['documents']],
+        'metadatas': [data['metadatas']],
+        'distances': [[None] * len(data['ids'])],
+        'embeddings': [data['embeddings']]
+    }
+
+def build_context_items(results, role_scores):
+    """
+    재정렬된 검색 결과를 관련도 순서의 컨텍스트 항목 목록으로 변환
+
+    역할 태그 유사도가 ROLE_MATCH_THRESHOLD 이상인 구간을 유사도 순으로 먼저 두고, 나머지는 검색 순서를 유지합니다.
+    토큰 수는 인덱싱 시 답변 모델 인코딩으로 저장한 token_count에 헤더 토큰 수만 더해 계산하고,
+    token_count가 없거나 다른 인코딩으로 저장된 이전 인덱스의 청크만 다시 인코딩합니다.
+
+    Returns:
+        list: [{'text': str, 'tokens': int}, ...]
+    """
+    documents, metadatas = results['documents'][0], results['metadatas'][0]
+    scores = list(role_scores) + [0.0] * (len(documents) - len(role_scores))
+    matched = sorted(
+        [i for i, meta in enumerate(metadatas) if meta.get('role_tag') and scores[i] >= ROLE_MATCH_THRESHOLD],
+        key=lambda i: -scores[i]
+    )
+    order = matched + [i for i in range(len(documents)) if i not in matched]
+    items = []
+    for i in order:
+        doc, meta = documents[i], metadatas[i]
+        meta_info = []
+        if meta.get('file_name'): meta_info.append(f"파일명: {meta['file_name']}")
+        if meta.get('function_name'): meta_info.append(f"함수: {meta['function_name']}")
+        if meta.get('class_name'): meta_info.append(f"클래스: {meta['class_name']}")
+        if meta.get('start_line') and meta.get('end_line'):
+            meta_info.append(f"라인: {meta['start_line']}~{meta['end_line']}")
+        if meta.get('sha'): meta_info.append(f"sha: {meta['sha']}")
+        if meta.get('role_tag'): meta_info.append(f"역할: {meta['role_tag']}")
+        header = f"[{'/'.join(meta_info)}]\n"
+        if meta.get('token_encoding') == PROMPT_TOKEN_ENCODING and meta.get('token_count', -1) >= 0:
+            tokens = meta['token_count'] + count_tokens(header)
+        else:
+            tokens = count_tokens(header + doc)
+        items.append({'text': header + doc, 'tokens': tokens})
+    return items
+
+def load_session_tree(session_data, repo_path):
+    """
+    세션 저장소의 전체 디렉토리 트리
+
+    로컬 저장소가 있으면 커밋별로 캐시된 트리를, 없으면 세션 파일 목록으로 만든 트리를 반환합니다.
+    """
+    if os.path.isdir(repo_path):
+        return load_or_build_tree(repo_path, session_data.get('commit_sha'))
+    return tree_from_paths(f['path'] for f in session_data.get('files', []) if f.get('path'))
+
+def build_system_prompt(session_data, repo_path, mode):
+    """
+    시스템 메시지(고정 접두부): 시스템 프롬프트 + 저장소 개요 + 전체 압축 트리 + 답변/수정 지침
+
+    질문에 따라 달라지는 내용은 넣지 않으므로, 같은 세션 커밋에서는 바이트 단위로 동일하여
+    제공자 측 프롬프트 캐시가 요청 사이에 재사용됩니다.
+
+    Args:
+        session_data (dict): 세션 데이터
+        repo_path (str): 로컬 저장소 경로
+        mode (str): 'qa' 또는 'modify'
+    """
+    files = session_data.get('files', [])
+    key = (mode, repo_path, session_data.get('repo_url'), session_data.get('commit_sha'), len(files))
+    cached = _prefix_cache.get(key)
+    if cached is not None:
+        return cached
+
+    overview = [f"저장소: {session_data.get('repo_url') or '알 수 없음'}"]
+    if session_data.get('commit_sha'):
+        overview.append(f"커밋: {session_data['commit_sha']}")
+    overview.append(f"분석된 주요 파일 수: {len(files)}")
+    try:
+        tree = load_session_tree(session_data, repo_path)
+        overview.append(f"전체 파일: {summarize_dir(tree)}")
+        directory_structure = render_tree(tree)
+    except Exception as e:
+        print(f"[WARNING] 디렉토리 트리 생성 실패: {e}")
+        directory_structure = session_data.get('directory_structure')
+    if not directory_structure:
+        directory_structure = "프로젝트 구조 정보가 없습니다. 파일 내용만 참고하여 응답하겠습니다."
+
+    system_prompt, instructions = (SYSTEM_PROMPT_QA, QA_INSTRUCTIONS) if mode == 'qa' else (SYSTEM_PROMPT_MODIFY, MODIFY_INSTRUCTIONS)
+    prefix = system_prompt + PREFIX_TEMPLATE.format(
+        repo_overview='\n'.join(overview),
+        directory_structure=directory_structure
+    ) + instructions
+    _prefix_cache.set(key, prefix)
+    print(f"[DEBUG] 고정 접두부 생성 (mode={mode}, 토큰 수: {count_tokens(prefix)})")
+    return prefix
+
+def render_session_tree(session_data, repo_path, focus_paths):
+    """
+    focus_paths로 가는 디렉토리 가지만 담은 압축 트리 (유저 메시지용, 전체 트리는 고정 접두부에 있음)
+    """
+    if not focus_paths:
+        return ''
+    try:
+        tree = load_session_tree(session_data, repo_path)
+        return render_tree(tree, focus_paths, max_tokens=RELEVANT_TREE_TOKEN_CAP, focus_only=True)
+    except Exception as e:
+        print(f"[WARNING] 관련 디렉토리 트리 생성 실패: {e}")
+        return ''
@@ -0,0 +1,248 @@
+"""
+코드 수정 편집 블록 모듈
+
+코드 수정 요청에서 LLM이 파일 전체를 다시 출력하는 대신, 바꿀 부분만 SEARCH/REPLACE 편집 블록으로 돌려주면
+이 모듈이 블록을 파싱하여 세션 파일 저장소의 원본 내용에 적용하고 미리보기용 unified diff를 만듭니다.
+출력 토큰 수와 응답 시간이 파일 크기가 아니라 변경 크기에 비례합니다.
+
+편집 블록 형식 (한 응답에 여러 파일, 한 파일에 여러 블록 가능):
+
+    // FILE: 경로/파일명.py
+    <<<<<<< SEARCH
+    원본에서 바꿀 부분 (원본과 똑같이)
+    =======
+    바뀐 내용
+    >>>>>>> REPLACE
+
+SEARCH 부분이 비어 있으면 새 파일(파일이 없을 때) 또는 파일 끝에 추가로 처리합니다.
+
+주요 함수:
+    - parse_edit_blocks: LLM 응답에서 편집 블록 목록 추출
+    - normalize_edit_path: LLM이 지정한 파일 경로를 저장소 기준 상대 경로로 정규화 (저장소 밖 경로 거부)
+    - apply_edit_blocks: 편집 블록을 원본 내용에 적용하여 파일별 변경사항과 오류 목록 반환
+    - unified_diff: 원본/수정본의 unified diff (미리보기용)
+"""
+
+import re
+import difflib
+import posixpath
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ----------------- 상수 정의 -----------------
+FILE_HEADER_PATTERN = re.compile(r'^\s*(?://|#)?\s*(?:FILE|파일명)\s*[:：]\s*(.+?)\s*$')
+SEARCH_MARKER = re.compile(r'^\s*<{5,9}\s*SEARCH\s*$')
+DIVIDER_MARKER = re.compile(r'^\s*={5,9}\s*$')
+REPLACE_MARKER = re.compile(r'^\s*>{5,9}\s*REPLACE\s*$')
+EXCERPT_SUFFIX = re.compile(r'\s*\((?:줄|lines?|청크)[^)]*\)\s*$')
+DIFF_CONTEXT_LINES = 3
+DRIVE_PREFIX = re.compile(r'^[A-Za-z]:')
+
+
+def parse_edit_blocks(text: str) -> List[Dict[str, str]]:
+    """
+    LLM 응답에서 SEARCH/REPLACE 편집 블록 추출
+
+    블록 앞의 가장 가까운 `// FILE:` 줄을 블록의 파일로 사용하며, 블록 밖의 설명과 코드 펜스(```)는 무시합니다.
+    끝나지 않은 블록(출력이 잘린 경우)은 버립니다.
+
+    Returns:
+        List[Dict[str, str]]: [{'path', 'search', 'replace'}, ...] (응답에 나온 순서)
+    """
+    blocks = []
+    current_path = None
+    lines = (text or '').splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        header = FILE_HEADER_PATTERN.match(line)
+        if header:
+            # 발췌 표시("경로 (줄 10-40)")는 경로에서 제외
+            current_path = EXCERPT_SUFFIX.sub('', header.group(1)).strip().strip('`')
+            i += 1
+            continue
+        if not SEARCH_MARKER.match(line):
+            i += 1
+            continue
+        search, replace = [], []
+        target = search
+        closed = False
+        i += 1
+        while i < len(lines):
+            line = lines[i]
+            if target is search and DIVIDER_MARKER.match(line):
+                target = replace
+            elif target is replace and REPLACE_MARKER.match(line):
+                closed = True
+                break
+            else:
+                target.append(line)
+            i += 1
+        i += 1
+        if not closed or target is search:
+            print(f"[WARNING] 끝나지 않은 편집 블록을 건너뜀 (파일: {current_path})")
+            continue
+        if not current_path:
+            print("[WARNING] 파일이 지정되지 않은 편집 블록을 건너뜀")
+            continue
+        blocks.append({'path': current_path, 'search': '\n'.join(search), 'replace': '\n'.join(replace)})
+    return blocks
+
+
+def normalize_edit_path(name: str) -> Optional[str]:
+    """
+    LLM이 지정한 파일 경로를 저장소 기준 상대 경로로 정규화
+
+    절대 경로, 드라이브 경로, 상위 디렉토리(..)를 포함한 경로는 저장소 밖을 가리킬 수 있으므로 None을 반환합니다.
+    """
+    path = (name or '').strip().strip('`').replace('\\', '/')
+    if not path or path.startswith('/') or DRIVE_PREFIX.match(path):
+        return None
+    if '..' in path.split('/'):
+        return None
+    path = posixpath.normpath(path)
+    if path in ('', '.'):
+        return None
+    return path
+
+
+def _find_lines(lines: List[str], needle: List[str], normalize: Callable[[str], str]) -> List[int]:
+    """normalize로 비교했을 때 needle과 일치하는 lines의 시작 위치 목록"""
+    target = [normalize(line) for line in needle]
+    haystack = [normalize(line) for line in lines]
+    size = len(target)
+    return [start for start in range(len(haystack) - size + 1) if haystack[start:start + size] == target]
+
+
+def _indent_width(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _reindent(replacement: List[str], needle: List[str], matched: List[str]) -> List[str]:
+    """
+    들여쓰기를 무시하고 찾은 경우, REPLACE 줄의 들여쓰기를 원본 들여쓰기 기준으로 바꿈
+
+    SEARCH와 원본의 대응하는 줄에서 기준 들여쓰기와 한 단계 폭(예: 2칸 -> 4칸)을 구해
+    REPLACE 줄의 상대 들여쓰기를 원본 폭으로 옮깁니다.
+    """
+    pairs = [(_indent_width(s), _indent_width(o), o) for s, o in zip(needle, matched) if s.strip()]
+    if not pairs:
+        return replacement
+    search_base, original_base, first = pairs[0]
+    indent_char = '\t' if first.startswith('\t') else ' '
+    scale = 1.0
+    for search_width, original_width, _ in pairs:
+        if search_width != search_base:
+            scale = (original_width - original_base) / (search_width - search_base)
+            break
+    lines = []
+    for line in replacement:
+        if not line.strip():
+            lines.append(line)
+            continue
+        width = original_base + round((_indent_width(line) - search_base) * scale)
+        lines.append(indent_char * max(0, width) + line.lstrip())
+    return lines
+
+
+def _apply_block(content: str, search: str, replace: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    블록 하나를 적용
+
+    원본과 정확히 한 번 일치하는 곳을 바꾸고, 없으면 줄 끝 공백을 무시하고, 그래도 없으면 들여쓰기를 무시하고
+    찾습니다(이때 REPLACE 부분은 원본 들여쓰기에 맞춤). 여러 곳과 일치하면 어디를 바꿀지 알 수 없으므로 실패입니다.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (수정된 내용, 오류 메시지) 중 하나만 값이 있음
+    """
+    if not search.strip():
+        separator = '' if not content or content.endswith('\n') else '\n'
+        return content + separator + replace + '\n', None
+
+    count = content.count(search)
+    if count == 1:
+        return content.replace(search, replace, 1), None
+    if count > 1:
+        return None, f"SEARCH 부분이 파일에서 {count}번 일치합니다. 더 많은 줄을 포함해야 합니다."
+
+    lines = content.split('\n')
+    needle = search.split('\n')
+    while needle and not needle[-1].strip():
+        needle.pop()
+    while needle and not needle[0].strip():
+        needle.pop(0)
+    replacement = replace.split('\n')
+    for normalize, reindent in ((str.rstrip, False), (str.strip, True)):
+        starts = _find_lines(lines, needle, normalize)
+        if len(starts) > 1:
+            return None, f"SEARCH 부분이 파일에서 {len(starts)}번 일치합니다. 더 많은 줄을 포함해야 합니다."
+        if not starts:
+            continue
+        start = starts[0]
+        matched = lines[start:start + len(needle)]
+        new_lines = _reindent(replacement, needle, matched) if reindent else replacement
+        return '\n'.join(lines[:start] + new_lines + lines[start + len(needle):]), None
+    return None, "SEARCH 부분이 파일 내용과 일치하지 않습니다."
+
+
+def apply_edit_blocks(blocks: List[Dict[str, str]],
+                      read_file: Callable[[str], Tuple[str, Optional[str]]]) -> Tuple[List[Dict], List[str]]:
+    """
+    편집 블록을 원본 내용에 순서대로 적용
+
+    같은 파일의 블록은 앞 블록을 적용한 결과에 이어서 적용합니다.
+    원본의 줄바꿈(CRLF)은 적용 후 그대로 복원합니다.
+
+    Args:
+        blocks (List[Dict[str, str]]): parse_edit_blocks 결과
+        read_file (Callable): 블록의 경로 -> (세션 파일 경로, 원본 내용 또는 None(새 파일))
+            경로를 사용할 수 없으면(저장소 밖, 여러 파일과 일치 등) ValueError를 발생시키며, 해당 블록의 오류가 됩니다.
+
+    Returns:
+        Tuple[List[Dict], List[str]]:
+            변경사항 목록 [{'file_name', 'original', 'modified_code', 'is_new'}, ...] (처음 나온 순서),
+            블록별 오류 메시지 목록 (하나라도 있으면 변경사항을 적용하면 안 됨)
+    """
+    changes: Dict[str, Dict] = {}
+    errors = []
+    for number, block in enumerate(blocks, 1):
+        try:
+            path, original = read_file(block['path'])
+        except ValueError as e:
+            errors.append(f"블록 {number} ({block['path']}): {e}")
+            continue
+        if path not in changes:
+            crlf = original is not None and '\r\n' in original
+            text = original.replace('\r\n', '\n') if crlf else original
+            changes[path] = {'file_name': path, 'original': original, 'text': text or '',
+                             'is_new': original is None, 'crlf': crlf}
+        change = changes[path]
+        if change['is_new'] and block['search'].strip():
+            errors.append(f"블록 {number} ({block['path']}): 세션에 없는 파일입니다.")
+            continue
+        modified, error = _apply_block(change['text'], block['search'], block['replace'])
+        if error:
+            errors.append(f"블록 {number} ({path}): {error}")
+            continue
+        change['text'] = modified
+
+    results = []
+    for change in changes.values():
+        text = change.pop('text')
+        modified = text.replace('\n', '\r\n') if change.pop('crlf') else text
+        if modified == change['original']:
+            continue
+        change['modified_code'] = modified
+        results.append(change)
+    return results, errors
+
+
+def unified_diff(file_name: str, original: Optional[str], modified: str) -> str:
+    """미리보기용 unified diff (새 파일이면 /dev/null 기준)"""
+    diff = difflib.unified_diff(
+        (original or '').splitlines(keepends=True),
+        modified.splitlines(keepends=True),
+        fromfile='/dev/null' if original is None else f"a/{file_name}",
+        tofile=f"b/{file_name}",
+        n=DIFF_CONTEXT_LINES,
+    )
+    return ''.join(line if line.endswith('\n') else line + '\n' for line in diff)
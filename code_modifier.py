@@ -1,8 +1,23 @@
 import os
 import subprocess
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
 
+def contained_path(repo_path: str, file_path: str) -> Optional[str]:
+    """
+    저장소 안의 실제 파일 경로 (절대 경로, 상위 디렉토리 참조, 심볼릭 링크 등으로 저장소 밖을 가리키거나
+    .git 디렉토리 안이면 None)
+    """
+    if not file_path or os.path.isabs(file_path):
+        return None
+    root = os.path.realpath(repo_path)
+    full_path = os.path.realpath(os.path.join(root, file_path))
+    if full_path == root or os.path.commonpath([root, full_path]) != root:
+        return None
+    if os.path.relpath(full_path, root).split(os.sep)[0] == '.git':
+        return None
+    return full_path
+
 class CodeModifier:
     def __init__(self):
         load_dotenv()
@@ -141,6 +156,103 @@ class CodeModifier:
                 'error': f"코드 변경사항 적용 중 오류 발생: {str(e)}"
             }
 
+    def commit_files(self, repo_path: str, files: List[Dict[str, str]], commit_message: str) -> Dict[str, Any]:
+        """
+        여러 파일의 변경사항을 한 번에 스테이징하고 하나의 커밋으로 만드는 함수
+
+        파일 쓰기나 커밋이 실패하면 이미 쓴 파일을 원래 내용으로 되돌리고(새 파일은 삭제) 스테이징도 취소합니다.
+
+        Args:
+            repo_path (str): 레포지토리 경로
+            files (List[Dict[str, str]]): [{'file_name': 파일 경로, 'modified_code': 새로운 코드 내용, 'encoding'(선택)}, ...]
+            commit_message (str): 커밋 메시지
+
+        Returns:
+            Dict[str, Any]: 커밋 결과 (실패 시 'rolled_back'에 되돌린 파일 목록)
+        """
+        # GitHub 토큰 확인
+        token = self.get_github_token()
+        if not token:
+            return {
+                'success': False,
+                'error': "GitHub 토큰이 필요합니다."
+            }
+
+        paths = [f['file_name'] for f in files]
+        # 쓰기 전에 모든 경로가 저장소 안인지 확인 (하나라도 밖이면 아무 파일도 쓰지 않음)
+        full_paths = {}
+        for file_path in paths:
+            full_path = contained_path(repo_path, file_path)
+            if full_path is None:
+                print(f"저장소 밖(또는 .git 안)을 가리키는 파일 경로는 쓸 수 없습니다: {file_path}")
+                return {
+                    'success': False,
+                    'error': f"저장소 밖(또는 .git 안)을 가리키는 파일 경로는 쓸 수 없습니다: {file_path}",
+                    'rolled_back': []
+                }
+            full_paths[file_path] = full_path
+
+        originals: Dict[str, Optional[bytes]] = {}  # 경로 -> 원래 내용 (없던 파일이면 None)
+        staged = False
+        try:
+            for f in files:
+                full_path = full_paths[f['file_name']]
+                try:
+                    with open(full_path, 'rb') as fp:
+                        originals[f['file_name']] = fp.read()
+                except FileNotFoundError:
+                    originals[f['file_name']] = None
+                os.makedirs(os.path.dirname(full_path) or '.', exist_ok=True)
+                # 원래 파일의 인코딩(예: cp949)이 있으면 그대로 유지
+                with open(full_path, 'w', encoding=f.get('encoding') or 'utf-8', newline='') as fp:
+                    fp.write(f['modified_code'])
+
+            # 변경사항 스테이징 (모든 파일을 한 번에)
+            subprocess.run(['git', 'add', '--', *paths], cwd=repo_path, check=True)
+            staged = True
+
+            # 커밋
+            subprocess.run(['git', 'commit', '-m', commit_message], cwd=repo_path, check=True)
+
+            return {
+                'success': True,
+                'message': f'코드 변경사항이 성공적으로 커밋되었습니다. (파일 {len(paths)}개)',
+                'files': paths
+            }
+
+        except Exception as e:
+            print(f"Git 커밋 중 오류 발생, 변경된 파일을 되돌립니다: {e}")
+            rolled_back = self._restore_files(repo_path, originals, full_paths, staged)
+            return {
+                'success': False,
+                'error': f"Git 커밋 중 오류 발생: {str(e)}",
+                'rolled_back': rolled_back
+            }
+
+    def _restore_files(self, repo_path: str, originals: Dict[str, Optional[bytes]], full_paths: Dict[str, str],
+                       staged: bool) -> List[str]:
+        """
+        commit_files 실패 시 파일을 원래 내용으로 되돌리는 함수 (되돌린 파일 목록 반환)
+
+        경로를 다시 만들지 않고 commit_files가 contained_path로 검사한 full_paths에만 씁니다.
+        """
+        if staged:
+            subprocess.run(['git', 'reset', '-q', '--', *originals], cwd=repo_path)
+        rolled_back = []
+        for file_path, content in originals.items():
+            full_path = full_paths[file_path]
+            try:
+                if content is None:
+                    if os.path.exists(full_path):
+                        os.remove(full_path)
+                else:
+                    with open(full_path, 'wb') as fp:
+                        fp.write(content)
+                rolled_back.append(file_path)
+            except OSError as e:
+                print(f"파일 되돌리기 실패 ({file_path}): {e}")
+        return rolled_back
+
     def push_changes(self, repo_path: str) -> Dict[str, Any]:
         """
         커밋된 변경사항을 원격 저장소에 푸시하는 함수
@@ -160,17 +272,8 @@ class CodeModifier:
                     'error': "GitHub 토큰이 필요합니다."
                 }
 
-            # 현재 디렉토리 저장
-            current_dir = os.getcwd()
-            
-            # 레포지토리 디렉토리로 이동
-            os.chdir(repo_path)
-            
-            # 푸시
-            subprocess.run(['git', 'push'], check=True)
-            
-            # 원래 디렉토리로 복귀
-            os.chdir(current_dir)
+            # 푸시 (작업 디렉토리는 바꾸지 않음 - 실패해도 서버 프로세스의 현재 디렉토리가 유지됨)
+            subprocess.run(['git', 'push'], cwd=repo_path, check=True)
             
             return {
                 'success': True,
@@ -0,0 +1,316 @@
+"""
+코드 범위(span) 모듈
+
+코드 수정 요청의 컨텍스트를 관련 파일 전체 대신, 검색된 청크를 감싸는 함수/클래스 범위와
+그 범위가 참조하는 심볼(호출하는 함수, 사용하는 클래스)의 정의 범위로 구성합니다.
+작은 파일만 통째로 넣고, 큰 파일은 파일별 토큰 예산 안에서 필요한 범위만 넣으므로
+큰 파일 하나가 실제로 고쳐야 할 파일을 프롬프트에서 밀어내지 않습니다.
+
+범위는 원본 줄을 그대로 잘라 넣으므로 편집 블록(code_edits)의 SEARCH 부분과 정확히 일치합니다.
+
+주요 구성:
+    - file_spans: 파일의 함수/클래스 범위 목록 (Python: ast, JS: 중괄호 매칭)
+    - SymbolIndex: 세션 파일 전체의 심볼 이름 -> 정의 범위 색인
+    - get_symbol_index: 세션 심볼 색인 (세션 파일 저장소가 바뀌면 다시 만듦)
+    - build_modify_context: 검색 결과로 우선순위 순서의 컨텍스트 항목 목록 구성
+
+범위 형식:
+    {'name', 'kind'('function'|'class'), 'start', 'end'(1부터 시작, 끝 줄 포함), 'parent',
+     'refs'(참조하는 이름 목록), 'attrs'(참조하는 속성 이름 목록, Python만)}
+"""
+
+import os
+import re
+import ast
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from caches import LRUCache
+from context_packer import count_tokens
+
+# ----------------- 상수 정의 -----------------
+SMALL_FILE_TOKENS = int(os.environ.get("MODIFY_SMALL_FILE_TOKENS", "1500"))  # 이 토큰 수 이하인 파일은 통째로 포함
+FILE_TOKEN_BUDGET = int(os.environ.get("MODIFY_FILE_TOKEN_BUDGET", "3000"))  # 큰 파일 하나에서 넣을 범위의 최대 토큰 수
+NEIGHBOR_LIMIT = int(os.environ.get("MODIFY_NEIGHBOR_LIMIT", "6"))  # 함께 넣을 참조 심볼 정의의 최대 개수
+NEIGHBOR_SPAN_TOKENS = 800  # 이보다 큰 참조 심볼 정의는 넣지 않음
+HIT_CONTEXT_LINES = 3  # 감싸는 범위가 없거나 너무 클 때 청크 위아래로 더 넣을 줄 수
+SPAN_EXTENSIONS = {'.py', '.js', '.jsx', '.ts', '.tsx', '.mjs'}
+IGNORED_REFS = {'self', 'cls', 'print', 'len', 'str', 'int', 'dict', 'list', 'set', 'tuple', 'range', 'super',
+                'isinstance', 'getattr', 'setattr', 'hasattr', 'Exception', 'None', 'True', 'False',
+                'this', 'console', 'function', 'return', 'const', 'let', 'var', 'new', 'await', 'async',
+                'if', 'else', 'for', 'while', 'switch', 'case', 'break', 'continue', 'typeof', 'null', 'undefined',
+                'true', 'false', 'of', 'in', 'try', 'catch', 'throw'}
+
+JS_DEFINITION = re.compile(
+    r'^\s*(?:export\s+)?(?:default\s+)?(?:'
+    r'(?:async\s+)?function\s*\*?\s*(?P<func>[A-Za-z_$][\w$]*)\s*\(|'
+    r'class\s+(?P<cls>[A-Za-z_$][\w$]*)|'
+    r'(?:const|let|var)\s+(?P<var>[A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*=>|[A-Za-z_$][\w$]*\s*=>)'
+    r')'
+)
+IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+
+_span_cache = LRUCache('code_spans', 4096)  # (경로, 내용 해시) -> 범위 목록
+
+
+# ----------------- 범위 추출 -----------------
+def _python_spans(content: str) -> List[Dict[str, Any]]:
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return []
+    spans = []
+
+    def visit(node, parent):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([d.lineno for d in child.decorator_list] + [child.lineno])
+                refs, attrs = {}, {}
+                for sub in ast.walk(child):
+                    if isinstance(sub, ast.Name):
+                        refs[sub.id] = None
+                    elif isinstance(sub, ast.Attribute):
+                        attrs[sub.attr] = None
+                spans.append({
+                    'name': child.name,
+                    'kind': 'class' if isinstance(child, ast.ClassDef) else 'function',
+                    'start': start,
+                    'end': getattr(child, 'end_lineno', None) or start,
+                    'parent': parent,
+                    'refs': [r for r in refs if r != child.name and r not in IGNORED_REFS],
+                    'attrs': [a for a in attrs if a != child.name and a not in refs],
+                })
+                visit(child, child.name)
+            else:
+                visit(child, parent)
+
+    visit(tree, None)
+    return spans
+
+
+def _block_end(lines: List[str], start: int) -> Optional[int]:
+    """start 줄(0부터)에서 시작하는 중괄호 블록의 끝 줄 (문자열/주석 안의 괄호는 대략적으로만 구분)"""
+    depth = 0
+    opened = False
+    for index in range(start, len(lines)):
+        line = re.sub(r'//.*$|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`', '', lines[index])
+        for char in line:
+            if char == '{':
+                depth += 1
+                opened = True
+            elif char == '}':
+                depth -= 1
+                if opened and depth == 0:
+                    return index
+        if not opened and index - start > 2:
+            return None
+    return None
+
+
+def _js_spans(content: str) -> List[Dict[str, Any]]:
+    lines = content.split('\n')
+    spans = []
+    for index, line in enumerate(lines):
+        match = JS_DEFINITION.match(line)
+        if not match:
+            continue
+        end = _block_end(lines, index)
+        if end is None:
+            continue
+        name = match.group('func') or match.group('cls') or match.group('var')
+        parent = next((s['name'] for s in reversed(spans) if s['start'] <= index + 1 <= s['end']), None)
+        refs = dict.fromkeys(IDENTIFIER.findall('\n'.join(lines[index + 1:end + 1])))
+        spans.append({
+            'name': name,
+            'kind': 'class' if match.group('cls') else 'function',
+            'start': index + 1,
+            'end': end + 1,
+            'parent': parent,
+            'refs': [r for r in refs if r != name and r not in IGNORED_REFS],
+            'attrs': [],
+        })
+    return spans
+
+
+def file_spans(path: str, content: str) -> List[Dict[str, Any]]:
+    """파일의 함수/클래스 범위 목록 (지원하지 않는 파일 형식이면 빈 목록, 내용별로 캐시)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in SPAN_EXTENSIONS or not content:
+        return []
+    key = (path, hash(content))
+    spans = _span_cache.get(key)
+    if spans is None:
+        spans = _python_spans(content) if ext == '.py' else _js_spans(content)
+        _span_cache.set(key, spans)
+    return spans
+
+
+# ----------------- 심볼 색인 -----------------
+class SymbolIndex:
+    """
+    세션 파일 전체의 심볼 이름 -> 정의 범위 색인
+
+    참조 심볼의 정의를 찾을 때 처음 한 번만 모든 소스 파일의 범위를 추출합니다.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._definitions: Optional[Dict[str, List[Tuple[str, Dict[str, Any]]]]] = None
+        self._lock = threading.Lock()
+
+    def _build(self) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+        definitions: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for path in self.store.paths:
+            if os.path.splitext(path)[1].lower() not in SPAN_EXTENSIONS:
+                continue
+            for span in file_spans(path, self.store.read(path) or ''):
+                definitions.setdefault(span['name'], []).append((path, span))
+        print(f"[DEBUG] 심볼 색인 생성: {self.store.session_id} (심볼 수: {len(definitions)})")
+        return definitions
+
+    def definitions(self, name: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """이름이 name인 정의 범위 목록 [(경로, 범위), ...]"""
+        with self._lock:
+            if self._definitions is None:
+                self._definitions = self._build()
+        return self._definitions.get(name, [])
+
+
+_symbol_indexes: Dict[str, SymbolIndex] = {}
+_symbol_indexes_lock = threading.Lock()
+
+
+def get_symbol_index(store) -> SymbolIndex:
+    """세션 심볼 색인 (세션 파일 저장소가 새로 만들어졌으면 색인도 다시 만듦)"""
+    with _symbol_indexes_lock:
+        index = _symbol_indexes.get(store.session_id)
+        if index is None or index.store is not store:
+            index = SymbolIndex(store)
+            _symbol_indexes[store.session_id] = index
+        return index
+
+
+# ----------------- 컨텍스트 구성 -----------------
+def _hit_lines(content: str, document: str, metadata: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """청크가 파일에서 차지하는 줄 범위 (1부터, 끝 줄 포함)"""
+    position = content.find(document) if document else -1
+    if position >= 0:
+        start = content.count('\n', 0, position) + 1
+        return start, start + document.count('\n')
+    start, end = metadata.get('start_line', -1), metadata.get('end_line', -1)
+    if isinstance(start, int) and isinstance(end, int) and start > 0 and end >= start:
+        return start, end
+    return None
+
+
+def _excerpt(path: str, lines: List[str], start: int, end: int) -> str:
+    return f"// FILE: {path} (줄 {start}-{end})\n" + '\n'.join(lines[start - 1:end])
+
+
+def _enclosing_span(spans: List[Dict[str, Any]], start: int, end: int) -> Optional[Dict[str, Any]]:
+    """start~end 줄을 감싸는 가장 안쪽 범위"""
+    inside = [s for s in spans if s['start'] <= start and end <= s['end']]
+    return min(inside, key=lambda s: s['end'] - s['start']) if inside else None
+
+
+def _covered(ranges: List[Tuple[int, int]], start: int, end: int) -> bool:
+    return any(a <= start and end <= b for a, b in ranges)
+
+
+def build_modify_context(store, documents: List[str], metadatas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    검색 결과로 코드 수정용 컨텍스트 항목 목록 구성
+
+    1. 검색 관련도 순서로 파일마다: 작은 파일은 전체, 큰 파일은 청크를 감싸는 함수/클래스 범위
+       (범위가 파일 예산보다 크면 청크 줄과 위아래 몇 줄)를 파일별 토큰 예산 안에서 추가
+    2. 추가한 범위가 참조하는 심볼의 정의 범위(같은 파일 우선)를 NEIGHBOR_LIMIT개까지 추가
+
+    Args:
+        store (SessionFileStore): 세션 파일 저장소
+        documents (List[str]): 검색된 청크 내용 (관련도 순)
+        metadatas (List[Dict[str, Any]]): 검색된 청크 메타데이터 (path, start_line, end_line 등)
+
+    Returns:
+        List[Dict[str, Any]]: [{'text', 'tokens', 'path', 'kind'('file'|'span'|'chunk'|'neighbor')}, ...] (우선순위 순)
+    """
+    items = []
+    whole_files = set()
+    ranges: Dict[str, List[Tuple[int, int]]] = {}  # 경로 -> 추가한 줄 범위
+    used: Dict[str, int] = {}  # 경로 -> 추가한 범위의 토큰 수
+    selected_spans = []
+    file_lines: Dict[str, List[str]] = {}
+
+    for document, metadata in zip(documents, metadatas):
+        path = metadata.get('path')
+        if not path or path in whole_files:
+            continue
+        content = store.read(path)
+        if content is None:
+            # 저장소에서 읽을 수 없는 파일은 청크만 사용
+            items.append({'text': f"// FILE: {path} (청크)\n{document}", 'tokens': None, 'path': path, 'kind': 'chunk'})
+            continue
+        if path not in file_lines:
+            tokens = count_tokens(content)
+            if tokens <= SMALL_FILE_TOKENS:
+                whole_files.add(path)
+                items.append({'text': f"// FILE: {path}\n{content}", 'tokens': tokens, 'path': path, 'kind': 'file'})
+                continue
+            file_lines[path] = content.split('\n')
+            ranges[path] = []
+            used[path] = 0
+        lines = file_lines[path]
+        hit = _hit_lines(content, document, metadata)
+        if hit is None:
+            continue
+        if _covered(ranges[path], *hit):
+            continue
+        span = _enclosing_span(file_spans(path, content), *hit)
+        candidates = []
+        if span is not None:
+            candidates.append((span['start'], span['end'], span))
+        candidates.append((max(1, hit[0] - HIT_CONTEXT_LINES), min(len(lines), hit[1] + HIT_CONTEXT_LINES), None))
+        for start, end, source in candidates:
+            text = _excerpt(path, lines, start, end)
+            tokens = count_tokens(text)
+            if used[path] + tokens > FILE_TOKEN_BUDGET:
+                continue
+            used[path] += tokens
+            ranges[path].append((start, end))
+            items.append({'text': text, 'tokens': tokens, 'path': path, 'kind': 'span'})
+            selected_spans.append((path, source))
+            break
+
+    # 추가한 범위가 참조하는 심볼의 정의 (같은 파일의 정의를 먼저)
+    symbol_index = get_symbol_index(store)
+    neighbors = 0
+    seen = set()
+    for path, span in selected_spans:
+        if span is None or neighbors >= NEIGHBOR_LIMIT:
+            continue
+        # 속성 이름(obj.method)은 같은 이름의 메서드가 여럿일 수 있으므로 정의가 하나뿐일 때만 사용
+        references = [(name, False) for name in span['refs']] + [(name, True) for name in span['attrs']]
+        for name, is_attr in references:
+            if neighbors >= NEIGHBOR_LIMIT:
+                break
+            definitions = symbol_index.definitions(name)
+            if is_attr and len(definitions) != 1:
+                continue
+            definitions = sorted(definitions, key=lambda d: d[0] != path)
+            for def_path, definition in definitions[:1]:
+                key = (def_path, definition['start'])
+                if key in seen or def_path in whole_files or _covered(ranges.get(def_path, []), definition['start'], definition['end']):
+                    continue
+                seen.add(key)
+                content = store.read(def_path)
+                if content is None:
+                    continue
+                lines = file_lines.get(def_path) or content.split('\n')
+                text = _excerpt(def_path, lines, definition['start'], definition['end'])
+                tokens = count_tokens(text)
+                if tokens > NEIGHBOR_SPAN_TOKENS or used.get(def_path, 0) + tokens > FILE_TOKEN_BUDGET:
+                    continue
+                used[def_path] = used.get(def_path, 0) + tokens
+                ranges.setdefault(def_path, []).append((definition['start'], definition['end']))
+                items.append({'text': text, 'tokens': tokens, 'path': def_path, 'kind': 'neighbor'})
+                neighbors += 1
+    return items
@@ -0,0 +1,196 @@
+"""
+생성 코드 검증 모듈
+
+코드 수정 결과를 미리보기로 보내기 전에 변경 묶음의 모든 파일을 작업자 풀에서 동시에 정적 검사하여,
+문법이 깨진 코드가 커밋/푸시된 뒤에야 발견되지 않도록 합니다.
+결과는 응답에 포함되어 UI가 다른 LLM 호출 없이 적용을 막을 수 있습니다.
+
+검사 방식:
+    - 모든 파일: 저장소 안의 상대 경로인지 (저장소 밖/.git 안을 가리키면 실패)
+    - Python: compile (py_compile과 같은 문법/컴파일 오류 검사, .pyc는 쓰지 않음)
+    - JSON: json.loads
+    - JavaScript: node --check (node가 없으면 건너뜀)
+    - 그 외 파일: 건너뜀
+
+VALIDATION_TEST_COMMAND를 지정하면 변경을 적용한 임시 git worktree에서 저장소의 빠른 테스트를
+VALIDATION_TEST_TIMEOUT초 제한으로 함께 실행합니다. (예: "python -m pytest -q -x")
+
+주요 함수:
+    - validate_file: 파일 하나 검사
+    - validate_change_set: 변경 묶음 전체 검사 (+ 선택적으로 테스트 실행)
+"""
+
+import os
+import json
+import time
+import shlex
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from code_edits import normalize_edit_path
+from code_modifier import contained_path
+
+# ----------------- 상수 정의 -----------------
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", "4"))  # 파일 검사 작업자 수
+NODE_CHECK_TIMEOUT = 10  # node --check 최대 대기 시간(초)
+VALIDATION_TEST_COMMAND = os.environ.get("VALIDATION_TEST_COMMAND", "")  # 비어 있으면 테스트를 실행하지 않음
+VALIDATION_TEST_TIMEOUT = int(os.environ.get("VALIDATION_TEST_TIMEOUT", "60"))  # 테스트 실행 최대 시간(초)
+TEST_OUTPUT_CHARS = 2000  # 응답에 포함할 테스트 출력 끝부분 길이
+JS_EXTENSIONS = {'.js', '.mjs', '.cjs'}
+
+_validation_executor = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix="validate")
+
+
+def _result(file_name: str, checker: str, errors: Optional[List[Dict[str, Any]]] = None,
+            skipped: bool = False) -> Dict[str, Any]:
+    return {'file_name': file_name, 'checker': checker, 'ok': not errors, 'skipped': skipped, 'errors': errors or []}
+
+
+def _check_python(file_name: str, content: str) -> Dict[str, Any]:
+    try:
+        compile(content, file_name, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return _result(file_name, 'python', [{'line': e.lineno, 'message': f"{type(e).__name__}: {e.msg}"}])
+    except ValueError as e:  # 널 문자 등
+        return _result(file_name, 'python', [{'line': None, 'message': str(e)}])
+    return _result(file_name, 'python')
+
+
+def _check_json(file_name: str, content: str) -> Dict[str, Any]:
+    try:
+        json.loads(content)
+    except json.JSONDecodeError as e:
+        return _result(file_name, 'json', [{'line': e.lineno, 'message': e.msg}])
+    return _result(file_name, 'json')
+
+
+def _check_js(file_name: str, content: str) -> Dict[str, Any]:
+    node = shutil.which('node')
+    if not node:
+        return _result(file_name, 'node', skipped=True)
+    suffix = os.path.splitext(file_name)[1]
+    with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as f:
+        f.write(content)
+        tmp_path = f.name
+    try:
+        proc = subprocess.run([node, '--check', tmp_path], capture_output=True, text=True, timeout=NODE_CHECK_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return _result(file_name, 'node', skipped=True)
+    finally:
+        os.remove(tmp_path)
+    if proc.returncode == 0:
+        return _result(file_name, 'node')
+    # node 출력: "<경로>:<줄>\n<코드>\n^^^\n\nSyntaxError: ..." - 첫 줄의 줄 번호와 오류 메시지만 사용
+    lines = proc.stderr.splitlines()
+    line = None
+    if lines and lines[0].startswith(tmp_path + ':'):
+        tail = lines[0][len(tmp_path) + 1:]
+        line = int(tail) if tail.isdigit() else None
+    message = next((l.strip() for l in lines if 'Error' in l), proc.stderr.strip()[:200])
+    return _result(file_name, 'node', [{'line': line, 'message': message}])
+
+
+def validate_file(file_name: str, content: str) -> Dict[str, Any]:
+    """
+    파일 하나의 문법 검사
+
+    Returns:
+        Dict[str, Any]: {'file_name', 'checker', 'ok', 'skipped', 'errors': [{'line', 'message'}]}
+    """
+    path = normalize_edit_path(file_name)
+    if path is None or path.split('/')[0] == '.git':
+        # 저장소 안의 상대 경로가 아닌 파일은 적용할 수 없으므로 내용과 관계없이 실패
+        return _result(file_name, 'path', [{'line': None, 'message': "저장소 밖(또는 .git 안)을 가리키는 파일 경로입니다."}])
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext == '.py':
+        return _check_python(file_name, content)
+    if ext == '.json':
+        return _check_json(file_name, content)
+    if ext in JS_EXTENSIONS:
+        return _check_js(file_name, content)
+    return _result(file_name, '', skipped=True)
+
+
+def run_quick_tests(repo_path: str, files: List[Dict[str, Any]], command: str,
+                    timeout: int = VALIDATION_TEST_TIMEOUT) -> Dict[str, Any]:
+    """
+    변경을 적용한 임시 git worktree에서 저장소의 빠른 테스트 실행 (작업 트리/브랜치는 건드리지 않음)
+
+    Returns:
+        Dict[str, Any]: {'command', 'ok', 'returncode', 'timed_out', 'output'(끝부분), 'seconds'}
+    """
+    started = time.perf_counter()
+    result = {'command': command, 'ok': False, 'returncode': None, 'timed_out': False, 'output': ''}
+    # 승인 전 단계이므로 worktree 밖을 가리키는 파일이 하나라도 있으면 아무것도 쓰지 않고 실패 처리
+    escaped = [f['file_name'] for f in files if contained_path(repo_path, f['file_name']) is None]
+    if escaped:
+        print(f"[WARNING] 저장소 밖을 가리키는 파일이 있어 테스트를 실행하지 않습니다: {escaped}")
+        result.update(output=f"저장소 밖(또는 .git 안)을 가리키는 파일 경로: {', '.join(escaped)}",
+                      seconds=round(time.perf_counter() - started, 2))
+        return result
+    worktree = tempfile.mkdtemp(prefix='validate_')
+    try:
+        subprocess.run(['git', 'worktree', 'add', '--detach', '-f', worktree, 'HEAD'], cwd=repo_path,
+                       capture_output=True, check=True)
+        for f in files:
+            full_path = contained_path(worktree, f['file_name'])
+            if full_path is None:
+                raise ValueError(f"worktree 밖을 가리키는 파일 경로: {f['file_name']}")
+            os.makedirs(os.path.dirname(full_path) or '.', exist_ok=True)
+            with open(full_path, 'w', encoding=f.get('encoding') or 'utf-8', newline='') as fp:
+                fp.write(f['modified_code'])
+        try:
+            proc = subprocess.run(shlex.split(command), cwd=worktree, capture_output=True, text=True, timeout=timeout)
+            result.update(ok=proc.returncode == 0, returncode=proc.returncode,
+                          output=(proc.stdout + proc.stderr)[-TEST_OUTPUT_CHARS:])
+        except subprocess.TimeoutExpired as e:
+            output = (e.stdout or b'') + (e.stderr or b'')
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', errors='replace')
+            result.update(timed_out=True, output=output[-TEST_OUTPUT_CHARS:])
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"[WARNING] 테스트용 worktree 준비/실행 실패: {e}")
+        result['output'] = str(e)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=repo_path, capture_output=True)
+        shutil.rmtree(worktree, ignore_errors=True)
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    return result
+
+
+def validate_change_set(files: List[Dict[str, Any]], repo_path: Optional[str] = None,
+                        run_tests: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    변경 묶음의 모든 파일을 작업자 풀에서 동시에 검사하고, 설정된 경우 빠른 테스트도 함께 실행
+
+    Args:
+        files (List[Dict[str, Any]]): [{'file_name', 'modified_code', 'encoding'(선택)}, ...]
+        repo_path (Optional[str]): 테스트를 실행할 로컬 클론 경로 (없으면 테스트 생략)
+        run_tests (Optional[bool]): 테스트 실행 여부 (None이면 VALIDATION_TEST_COMMAND가 있을 때만)
+
+    Returns:
+        Dict[str, Any]: {'ok', 'files': [validate_file 결과], 'tests': run_quick_tests 결과 또는 None, 'seconds'}
+    """
+    started = time.perf_counter()
+    command = VALIDATION_TEST_COMMAND.strip()
+    if run_tests is None:
+        run_tests = bool(command)
+    run_tests = run_tests and bool(command) and bool(repo_path) and os.path.isdir(os.path.join(repo_path or '', '.git'))
+    # 테스트는 파일 검사와 동시에 시작
+    test_future = _validation_executor.submit(run_quick_tests, repo_path, files, command) if run_tests else None
+    checks = list(_validation_executor.map(lambda f: validate_file(f['file_name'], f['modified_code']), files))
+    if repo_path:
+        # 심볼릭 링크 등으로 실제 클론 밖을 가리키는 경로도 실패 처리
+        checks = [c if not c['ok'] or contained_path(repo_path, c['file_name']) is not None else
+                  _result(c['file_name'], 'path', [{'line': None, 'message': "저장소 밖(또는 .git 안)을 가리키는 파일 경로입니다."}])
+                  for c in checks]
+    tests = test_future.result() if test_future is not None else None
+    ok = all(c['ok'] for c in checks) and (tests is None or tests['ok'])
+    result = {'ok': ok, 'files': checks, 'tests': tests, 'seconds': round(time.perf_counter() - started, 2)}
+    failed = [c['file_name'] for c in checks if not c['ok']]
+    print(f"[DEBUG] 변경 검증 완료: {'통과' if ok else '실패'} (파일 {len(checks)}개, 실패: {failed}, "
+          f"테스트: {tests and ('통과' if tests['ok'] else '실패')}, {result['seconds']}s)")
+    return result
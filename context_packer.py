@@ -0,0 +1,96 @@
+"""
+토큰 예산 기반 컨텍스트 패킹 모듈
+
+프롬프트 길이를 문자 수 대신 tiktoken 토큰 수로 계산합니다.
+토큰 수는 답변 모델(gpt-4o/gpt-4o-mini)의 인코딩(o200k_base)으로 계산하며,
+청크 분할/임베딩용 인코더(cl100k, github_analyzer.get_encoder)와는 별개입니다.
+모델의 컨텍스트 창에서 출력 토큰과 고정 프롬프트(시스템 프롬프트, 질문, 디렉토리 구조)를 뺀 예산 안에
+관련도가 높은 컨텍스트 항목부터 통째로 채워, 청크가 줄 중간에서 잘리지 않도록 합니다.
+
+주요 함수:
+    - count_tokens: 텍스트의 토큰 수 (답변 모델 인코딩 기준)
+    - context_budget: 모델/고정 토큰/출력 예약 토큰으로 컨텍스트 예산 계산
+    - pack_context: 관련도 순서대로 예산 안에 들어가는 항목만 선택
+"""
+
+import os
+from typing import Any, Dict, List, Tuple
+
+import tiktoken
+
+# ----------------- 상수 정의 -----------------
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 16385
+# 모델 창이 넉넉해도 질문당 비용/지연을 제한하기 위한 컨텍스트 토큰 상한
+CONTEXT_TOKEN_CAP = int(os.environ.get("CONTEXT_TOKEN_CAP", "24000"))
+# 메시지 포맷(역할 구분 등) 오버헤드를 위한 여유분
+PROMPT_OVERHEAD_TOKENS = 64
+# 프롬프트 토큰 계산용 인코딩 (gpt-4o 계열은 o200k_base, 다른 모델을 쓰는 로컬 서버는 환경 변수로 변경)
+PROMPT_TOKEN_ENCODING = os.environ.get("PROMPT_TOKEN_ENCODING", "o200k_base")
+
+_prompt_encoder = None
+
+
+def get_prompt_encoder():
+    """프롬프트 토큰 계산용 tiktoken 인코더 (최초 호출 시 1회 로드)"""
+    global _prompt_encoder
+    if _prompt_encoder is None:
+        _prompt_encoder = tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+    return _prompt_encoder
+
+
+def count_tokens(text: str) -> int:
+    """텍스트의 프롬프트 토큰 수 (답변 모델 인코딩 기준)"""
+    return len(get_prompt_encoder().encode(text)) if text else 0
+
+
+def context_budget(model: str, fixed_tokens: int, reserved_output_tokens: int) -> int:
+    """
+    컨텍스트에 쓸 수 있는 토큰 수
+
+    Args:
+        model (str): 호출할 모델 이름
+        fixed_tokens (int): 컨텍스트를 뺀 나머지 프롬프트(시스템 프롬프트 포함)의 토큰 수
+        reserved_output_tokens (int): 답변용으로 예약할 토큰 수 (max_tokens)
+
+    Returns:
+        int: 컨텍스트 토큰 예산 (0 이상, CONTEXT_TOKEN_CAP 이하)
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    available = window - reserved_output_tokens - fixed_tokens - PROMPT_OVERHEAD_TOKENS
+    return max(0, min(available, CONTEXT_TOKEN_CAP))
+
+
+def pack_context(items: List[Dict[str, Any]], budget: int, separator: str = '\n\n') -> Tuple[List[str], int]:
+    """
+    관련도가 높은 항목부터 예산 안에 들어가는 항목만 통째로 선택
+
+    예산을 넘는 항목은 자르지 않고 건너뛰며, 뒤의 더 작은 항목으로 남은 예산을 채웁니다.
+
+    Args:
+        items (List[Dict[str, Any]]): 관련도 순서의 {'text': str, 'tokens': Optional[int]} 목록
+            tokens가 없으면 여기서 계산합니다.
+        budget (int): 토큰 예산
+        separator (str): 항목 사이 구분자
+
+    Returns:
+        Tuple[List[str], int]: 선택된 텍스트 목록(입력 순서 유지), 사용한 토큰 수
+    """
+    separator_tokens = count_tokens(separator)
+    packed, used, skipped = [], 0, 0
+    for item in items:
+        tokens = item.get('tokens')
+        if tokens is None:
+            tokens = count_tokens(item['text'])
+        cost = tokens + (separator_tokens if packed else 0)
+        if used + cost > budget:
+            skipped += 1
+            continue
+        packed.append(item['text'])
+        used += cost
+    print(f"[DEBUG] 컨텍스트 패킹: {len(packed)}개 선택, {skipped}개 제외 (사용 토큰: {used}/{budget})")
+    return packed, used
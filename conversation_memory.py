@@ -0,0 +1,177 @@
+"""
+대화 기억 모듈
+
+질문/답변을 SQLite chat_history 테이블에 저장하고, 다음 질문의 프롬프트에
+토큰 예산 안에서 최근 대화와 오래된 대화의 요약을 함께 넣습니다. 긴 메시지는 앞부분만 잘라 넣습니다.
+후속 질문("그 함수는 어디서 호출돼?", "더 자세히")은 직전 답변에 사용한 청크 ID를 다시 사용하여
+같은 코드를 새로 검색하지 않습니다.
+
+주요 함수:
+    - is_follow_up: 직전 대화를 이어가는 질문인지 판단
+    - load_history: 토큰 예산 안의 최근 대화, 대화 요약, 직전 답변의 청크 ID
+    - history_messages: load_history 결과를 LLM 메시지 목록으로 변환
+    - remember_turn: 질문/답변 저장 후 창 밖으로 밀려난 대화를 백그라운드에서 요약
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import db
+from context_packer import count_tokens, get_prompt_encoder
+from llm_client import get_provider
+
+# ----------------- 상수 정의 -----------------
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))  # 프롬프트에 넣을 최근 대화 + 요약의 최대 토큰 수
+HISTORY_MAX_MESSAGES = 12  # 최근 대화 창으로 가져올 최대 메시지 수 (질문/답변 6턴)
+# 메시지 하나가 대화 창에서 차지할 수 있는 최대 토큰 수 (긴 답변 하나 때문에 창 전체가 비지 않도록 앞부분만 남김)
+HISTORY_MESSAGE_MAX_TOKENS = int(os.environ.get("HISTORY_MESSAGE_MAX_TOKENS", "600"))
+HISTORY_MIN_MESSAGE_TOKENS = 50  # 남은 예산이 이보다 적으면 메시지를 잘라 넣지 않고 창을 마침
+TRUNCATED_MARKER = "\n...(이하 생략)"
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_MIN_MESSAGES = 4  # 창 밖으로 밀려난 메시지가 이만큼 쌓이면 요약에 합침
+FOLLOW_UP_MAX_CHARS = 6  # 이보다 짧은 질문은 후속 질문으로 간주
+FOLLOW_UP_PATTERN = re.compile(
+    r'^(그럼|그러면|그리고|그래서|그건|그게|그거|이건|이거|왜|또|더 )|'
+    r'(그 함수|그 클래스|그 파일|그 코드|그 부분|이 함수|이 클래스|이 파일|이 코드|이 부분|위 코드|위의|방금|앞에서|아까|'
+    r'더 자세히|자세하게|예를 들어|다시 설명)|'
+    r'^(and|so|why|what about|how about|it|that|this|those|them)\b',
+    re.IGNORECASE
+)
+# 짧은 영어 질문에서 지시대명사가 주어/목적어로 쓰인 경우 ("Why does it fail?", "What does that do?")
+# "What does this project do?"처럼 명사를 꾸미는 this/that/those는 새 질문이므로 제외
+FOLLOW_UP_SHORT_WORDS = 6
+FOLLOW_UP_PRONOUN = re.compile(
+    r'\b(it|them)\b|'
+    r'\b(this|that|those)\b(?=\s*(?:[?.!,]|$|(?:is|are|was|were|does|do|did|mean|means|work|works|return|returns)\b))',
+    re.IGNORECASE
+)
+SUMMARY_PROMPT = (
+    "다음은 코드 저장소에 대한 사용자와 AI의 이전 대화입니다. "
+    "이후 질문에 답할 때 필요한 내용(언급된 파일, 함수, 클래스, 결론, 사용자의 관심사)만 남겨 "
+    "한글로 10줄 이내로 요약하세요. 기존 요약이 있으면 새 대화 내용을 합쳐 하나의 요약으로 다시 작성하세요."
+)
+
+# 요약은 답변 이후 백그라운드에서 세션 순서대로 실행
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+
+
+def is_follow_up(message: str) -> bool:
+    """
+    직전 대화를 이어가는 질문인지
+
+    매우 짧은 질문, 지시어/접속어로 시작하는 질문, 앞 대화를 가리키는 표현("그 함수", "방금")이 있는 질문,
+    지시대명사가 주어/목적어로 쓰인 짧은 영어 질문을 후속 질문으로 봅니다.
+    """
+    text = (message or '').strip()
+    if len(text) <= FOLLOW_UP_MAX_CHARS or FOLLOW_UP_PATTERN.search(text):
+        return True
+    return len(text.split()) <= FOLLOW_UP_SHORT_WORDS and bool(FOLLOW_UP_PRONOUN.search(text))
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """text를 max_tokens 토큰 이하로 앞부분만 남겨 자름 (잘린 경우 생략 표시를 붙임)"""
+    encoder = get_prompt_encoder()
+    tokens = encoder.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATED_MARKER))
+    return encoder.decode(tokens[:keep]) + TRUNCATED_MARKER
+
+
+def load_history(session_id: str, budget: int = HISTORY_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    토큰 예산 안에서 가장 최근 대화부터 담은 대화 창
+
+    메시지 하나는 HISTORY_MESSAGE_MAX_TOKENS까지만 담고, 예산에 다 들어가지 않는 메시지는
+    남은 예산만큼 앞부분만 잘라 넣은 뒤 창을 마칩니다. 긴 답변 하나 때문에 창이 비지 않습니다.
+
+    Returns:
+        Dict[str, Any]: {
+            'summary': 창 이전 대화의 요약 (없으면 ''),
+            'messages': [{'id', 'role', 'content', 'tokens'}] 오래된 순 (content는 잘렸을 수 있음),
+            'tokens': 요약 + 메시지의 토큰 수,
+            'has_history': 이전 대화가 있는지 (창이 비었더라도 저장된 메시지가 있으면 True),
+            'last_chunk_ids': 직전 답변에 사용한 청크 ID 목록
+        }
+    """
+    summary, _ = db.get_chat_summary(session_id)
+    recent = db.get_chat_messages(session_id, limit=HISTORY_MAX_MESSAGES)
+    used = count_tokens(summary)
+    window: List[Dict[str, Any]] = []
+    for message in reversed(recent):
+        content = _truncate_tokens(message['content'], HISTORY_MESSAGE_MAX_TOKENS)
+        remaining = budget - used - 4  # 역할 구분 오버헤드
+        if count_tokens(content) > remaining:
+            if remaining < HISTORY_MIN_MESSAGE_TOKENS:
+                break
+            content = _truncate_tokens(content, remaining)
+        tokens = count_tokens(content) + 4
+        window.insert(0, {'id': message['id'], 'role': message['role'], 'content': content, 'tokens': tokens})
+        used += tokens
+    # 창은 질문으로 시작하도록 앞쪽의 답변만 남은 메시지 제거
+    while window and window[0]['role'] != 'user':
+        used -= window.pop(0)['tokens']
+    last_answer = next((m for m in reversed(recent) if m['role'] == 'assistant'), None)
+    return {
+        'summary': summary,
+        'messages': window,
+        'tokens': used,
+        'has_history': bool(recent),
+        'last_chunk_ids': (last_answer or {}).get('chunk_ids') or []
+    }
+
+
+def history_messages(history: Dict[str, Any]) -> List[Dict[str, str]]:
+    """대화 요약과 최근 대화를 시스템 메시지 뒤에 넣을 LLM 메시지 목록으로 변환"""
+    messages = []
+    if history['summary']:
+        messages.append({"role": "system", "content": "[이전 대화 요약]\n" + history['summary']})
+    messages.extend({"role": m['role'], "content": m['content']} for m in history['messages'])
+    return messages
+
+
+def remember_turn(session_id: str, question: str, answer: str, chunk_ids: Optional[List[str]] = None):
+    """질문과 답변(사용한 청크 ID 포함)을 저장하고 대화 요약 갱신을 예약"""
+    try:
+        db.add_chat_message(session_id, 'user', question)
+        db.add_chat_message(session_id, 'assistant', answer, chunk_ids=chunk_ids or [])
+    except Exception as e:
+        print(f"[WARNING] 대화 기록 저장 실패: {e}")
+        return
+    _summary_executor.submit(update_summary, session_id)
+
+
+def update_summary(session_id: str):
+    """
+    최근 대화 창 밖으로 밀려났지만 아직 요약되지 않은 메시지가 SUMMARY_MIN_MESSAGES개 이상이면
+    기존 요약과 합쳐 새 요약을 저장 (창이 비어 있으면 요약되지 않은 메시지 전체가 대상)
+    """
+    try:
+        history = load_history(session_id)
+        if not history['has_history']:
+            return
+        summary, last_id = db.get_chat_summary(session_id)
+        before_id = history['messages'][0]['id'] if history['messages'] else None
+        pending = db.get_chat_messages(session_id, after_id=last_id, before_id=before_id)
+        if len(pending) < SUMMARY_MIN_MESSAGES:
+            return
+        conversation = '\n\n'.join(
+            f"{'사용자' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in pending
+        )
+        content = (f"[기존 요약]\n{summary}\n\n" if summary else '') + f"[새 대화]\n{conversation}"
+        response = get_provider().chat(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                      {"role": "user", "content": content}],
+            temperature=0.0,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        new_summary = response.choices[0].message.content.strip()
+        if new_summary:
+            db.save_chat_summary(session_id, new_summary, pending[-1]['id'])
+            print(f"[DEBUG] 대화 요약 갱신: 세션 {session_id} (메시지 {len(pending)}개 추가, {count_tokens(new_summary)} 토큰)")
+    except Exception as e:
+        print(f"[WARNING] 대화 요약 실패: {e}")
@@ -1,3 +1,4 @@
+import json
 import sqlite3
 
 DB_PATH = 'app.db'
@@ -20,6 +21,15 @@ def init_db():
         content TEXT,
         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
+    _ensure_column(c, 'chat_history', 'chunk_ids', 'TEXT')  # 답변에 사용한 청크 ID 목록 (JSON)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history (session_id, id)''')
+    # 오래된 대화 요약 테이블 (last_message_id까지의 대화를 요약)
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_summaries (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT,
+        last_message_id INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
     # 코드 변경 내역 테이블
     c.execute('''CREATE TABLE IF NOT EXISTS code_changes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,5 +43,69 @@ def init_db():
     conn.commit()
     conn.close()
 
+def _ensure_column(c, table, column, decl):
+    # 이미 만들어진 DB에 새 컬럼 추가
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def add_chat_message(session_id, role, content, chunk_ids=None):
+    """대화 메시지 저장 후 메시지 ID 반환"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        c = conn.cursor()
+        c.execute('INSERT INTO chat_history (session_id, role, content, chunk_ids) VALUES (?, ?, ?, ?)',
+                  (session_id, role, content, json.dumps(chunk_ids) if chunk_ids is not None else None))
+        conn.commit()
+        return c.lastrowid
+    finally:
+        conn.close()
+
+def get_chat_messages(session_id, after_id=0, before_id=None, limit=None):
+    """
+    세션의 대화 메시지 목록 (오래된 순)
+
+    limit이 주어지면 조건에 맞는 가장 최근 메시지 limit개를 반환합니다.
+    """
+    query = 'SELECT id, role, content, chunk_ids FROM chat_history WHERE session_id = ? AND id > ?'
+    params = [session_id, after_id]
+    if before_id is not None:
+        query += ' AND id < ?'
+        params.append(before_id)
+    query += ' ORDER BY id DESC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+    return [
+        {'id': row[0], 'role': row[1], 'content': row[2], 'chunk_ids': json.loads(row[3]) if row[3] else None}
+        for row in reversed(rows)
+    ]
+
+def get_chat_summary(session_id):
+    """세션의 대화 요약과 요약된 마지막 메시지 ID, 없으면 ('', 0)"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute('SELECT summary, last_message_id FROM chat_summaries WHERE session_id = ?',
+                           (session_id,)).fetchone()
+    finally:
+        conn.close()
+    return (row[0] or '', row[1] or 0) if row else ('', 0)
+
+def save_chat_summary(session_id, summary, last_message_id):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('''INSERT INTO chat_summaries (session_id, summary, last_message_id) VALUES (?, ?, ?)
+                        ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary,
+                        last_message_id = excluded.last_message_id, updated_at = CURRENT_TIMESTAMP''',
+                     (session_id, summary, last_message_id))
+        conn.commit()
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
     init_db() 
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+디렉토리 트리 모듈
+
+저장소 전체 디렉토리 구조를 커밋마다 한 번만 계산해 캐시하고,
+프롬프트에는 토큰 상한 안에서 압축한 트리만 넣습니다.
+
+압축 규칙:
+    - node_modules, __pycache__ 등 관심 없는 디렉토리는 파일 수만 표시하고 펼치지 않음
+    - 펼치지 않은 디렉토리는 "이름/ (N개 파일: .py 3, .md 1)" 한 줄로 요약
+    - 검색된 청크의 파일로 가는 경로는 항상 펼치고, 남은 토큰 예산으로 얕은 디렉토리부터 펼침
+    - 파일이 많은 디렉토리는 관련 파일과 앞쪽 일부만 보여주고 나머지는 개수로 표시
+
+트리 노드 형식 (JSON 저장 가능):
+    {'dirs': {이름: 노드}, 'files': [파일명], 'count': 하위 전체 파일 수, 'ext': {확장자: 개수}, 'collapsed': bool}
+"""
+
+import os
+import json
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from context_packer import count_tokens
+
+# ----------------- 상수 정의 -----------------
+TREE_CACHE_DIR = "./cache/trees"  # 커밋 SHA별 전체 트리 캐시
+DIRECTORY_TOKEN_CAP = int(os.environ.get("DIRECTORY_TOKEN_CAP", "800"))  # 프롬프트에 넣을 트리의 최대 토큰 수
+MAX_FILES_PER_DIR = 12  # 펼친 디렉토리에서 보여줄 최대 파일 수
+SKIPPED_DIRS = {'.git'}  # 트리에서 아예 제외
+COLLAPSED_DIRS = {
+    'node_modules', '__pycache__', 'venv', '.venv', 'env', 'dist', 'build', 'vendor', 'coverage',
+    'site-packages', '.idea', '.vscode', '.pytest_cache', '.mypy_cache', '.next', '.cache'
+}  # 파일 수만 표시하고 펼치지 않음
+
+_tree_memo: Dict[str, Dict[str, Any]] = {}  # 커밋 SHA -> 트리
+
+
+def _new_node(collapsed: bool = False) -> Dict[str, Any]:
+    return {'dirs': {}, 'files': [], 'count': 0, 'ext': {}, 'collapsed': collapsed}
+
+
+def _add_file(node: Dict[str, Any], name: str):
+    ext = os.path.splitext(name)[1] or name
+    node['count'] += 1
+    node['ext'][ext] = node['ext'].get(ext, 0) + 1
+
+
+def tree_from_paths(paths: Iterable[str]) -> Dict[str, Any]:
+    """파일 경로 목록으로 트리 생성 (로컬 저장소가 없는 세션용)"""
+    root = _new_node()
+    for path in paths:
+        parts = [p for p in path.split('/') if p]
+        if not parts:
+            continue
+        node = root
+        _add_file(node, parts[-1])
+        for part in parts[:-1]:
+            node = node['dirs'].setdefault(part, _new_node(part in COLLAPSED_DIRS))
+            _add_file(node, parts[-1])
+            if node['collapsed']:
+                break
+        else:
+            node['files'].append(parts[-1])
+    return root
+
+
+def scan_local_tree(repo_path: str) -> Dict[str, Any]:
+    """로컬 저장소를 순회하여 트리 생성 (관심 없는 디렉토리는 파일 수만 집계)"""
+    paths = []
+    for root, dirs, files in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS]
+        rel = os.path.relpath(root, repo_path).replace(os.sep, '/')
+        rel = '' if rel == '.' else rel + '/'
+        paths.extend(rel + name for name in files)
+    return tree_from_paths(paths)
+
+
+def load_or_build_tree(repo_path: str, commit_sha: Optional[str] = None) -> Dict[str, Any]:
+    """
+    커밋의 전체 트리를 반환 (커밋당 한 번만 계산하여 메모리와 TREE_CACHE_DIR에 캐시)
+
+    Args:
+        repo_path (str): 로컬 저장소 경로
+        commit_sha (Optional[str]): 커밋 SHA, 없으면 캐시하지 않음
+    """
+    if commit_sha and commit_sha in _tree_memo:
+        return _tree_memo[commit_sha]
+    cache_path = os.path.join(TREE_CACHE_DIR, f"{commit_sha}.json") if commit_sha else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                tree = json.load(f)
+            _tree_memo[commit_sha] = tree
+            return tree
+        except Exception as e:
+            print(f"[WARNING] 트리 캐시 로드 실패: {e}")
+    tree = scan_local_tree(repo_path)
+    if cache_path:
+        try:
+            os.makedirs(TREE_CACHE_DIR, exist_ok=True)
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(tree, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"[WARNING] 트리 캐시 저장 실패: {e}")
+        _tree_memo[commit_sha] = tree
+    print(f"[DEBUG] 디렉토리 트리 생성 (전체 파일 수: {tree['count']}, 커밋: {commit_sha or '없음'})")
+    return tree
+
+
+def summarize_dir(node: Dict[str, Any]) -> str:
+    """디렉토리 요약: 'N개 파일: .py 3, .md 1' (많은 확장자 3개까지)"""
+    top = sorted(node['ext'].items(), key=lambda item: (-item[1], item[0]))[:3]
+    detail = ', '.join(f"{ext} {n}" for ext, n in top)
+    if len(node['ext']) > 3:
+        detail += ', ...'
+    return f"{node['count']}개 파일: {detail}" if detail else "빈 디렉토리"
+
+
+def _child_lines(node: Dict[str, Any], path: str, depth: int, focus_files: set,
+                 file_limit: int = MAX_FILES_PER_DIR) -> List[tuple]:
+    """펼친 디렉토리의 바로 아래 줄 목록: (하위 디렉토리 또는 파일 경로, 디렉토리 여부, 줄 텍스트)"""
+    indent = '  ' * depth
+    lines = []
+    for name in sorted(node['dirs']):
+        child = node['dirs'][name]
+        lines.append((f"{path}{name}/", True, f"{indent}{name}/ ({summarize_dir(child)})"))
+    files = sorted(node['files'])
+    relevant = [f for f in files if path + f in focus_files]
+    others = [f for f in files if path + f not in focus_files]
+    shown = relevant + others[:max(0, file_limit - len(relevant))]
+    for name in sorted(shown):
+        lines.append((path + name, False, f"{indent}{name}"))
+    if len(shown) < len(files):
+        lines.append((None, False, f"{indent}... 외 {len(files) - len(shown)}개 파일"))
+    return lines
+
+
+def _find(tree: Dict[str, Any], path: str) -> Optional[Dict[str, Any]]:
+    node = tree
+    for part in [p for p in path.split('/') if p]:
+        node = node['dirs'].get(part)
+        if node is None:
+            return None
+    return node
+
+
+def _render(tree: Dict[str, Any], focus_files: set, focus_dirs: set, max_tokens: int, file_limit: int,
+            focus_only: bool = False) -> List[str]:
+    # 1. 관련 파일로 가는 경로를 펼치고, 남은 예산으로 얕은 디렉토리부터 너비 우선으로 펼침
+    expanded = set()
+    used = 0
+    queue = deque([('', 0)])
+    pending = deque()
+    while queue or pending:
+        path, depth = queue.popleft() if queue else pending.popleft()
+        node = _find(tree, path)
+        if node is None or node.get('collapsed') or path in expanded:
+            continue
+        lines = _child_lines(node, path, depth, focus_files, file_limit)
+        cost = sum(count_tokens(text) + 1 for _, _, text in lines)
+        if path not in focus_dirs and (focus_only or used + cost > max_tokens):
+            continue
+        expanded.add(path)
+        used += cost
+        for child_path, is_dir, _ in lines:
+            if is_dir:
+                # 관련 경로는 먼저, 나머지는 예산이 남을 때 펼침
+                (queue if child_path in focus_dirs else pending).append((child_path, depth + 1))
+
+    # 2. 펼친 디렉토리만 하위 줄을 출력
+    output = []
+    def emit(path, node, depth):
+        indent = '  ' * depth
+        for child_path, is_dir, text in _child_lines(node, path, depth, focus_files, file_limit):
+            if focus_only and depth == 0 and child_path not in focus_dirs and child_path not in focus_files:
+                continue  # 최상위에서는 관련 경로만 출력
+            if is_dir and child_path in expanded:
+                output.append(f"{indent}{child_path[len(path):]}")
+                emit(child_path, _find(tree, child_path), depth + 1)
+            else:
+                output.append(text)
+    emit('', tree, 0)
+    return output
+
+
+def render_tree(tree: Dict[str, Any], focus_paths: Iterable[str] = (), max_tokens: int = DIRECTORY_TOKEN_CAP,
+                focus_only: bool = False) -> str:
+    """
+    토큰 상한 안에서 압축한 트리 텍스트
+
+    Args:
+        tree (Dict[str, Any]): load_or_build_tree/tree_from_paths로 만든 트리
+        focus_paths (Iterable[str]): 항상 펼쳐서 보여줄 파일 경로 (검색된 청크의 파일)
+        max_tokens (int): 최대 토큰 수
+        focus_only (bool): True이면 관련 파일로 가는 가지만 출력 (전체 개요는 따로 제공하는 경우)
+
+    Returns:
+        str: 들여쓰기(공백 2칸) 트리, 디렉토리는 이름 뒤에 '/'
+    """
+    focus_files = set(focus_paths)
+    focus_dirs = {''}
+    for path in focus_files:
+        parts = path.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            focus_dirs.add('/'.join(parts[:i]) + '/')
+
+    output = _render(tree, focus_files, focus_dirs, max_tokens, MAX_FILES_PER_DIR, focus_only)
+    text = '\n'.join(output)
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # 3. 관련 경로만으로도 상한을 넘으면 관련 파일 외의 파일은 개수로만 표시
+    output = _render(tree, focus_files, focus_dirs, max_tokens, 0, focus_only)
+    text = '\n'.join(output)
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # 4. 그래도 넘으면 뒤쪽 줄을 생략
+    kept, total = [], 0
+    for line in output:
+        total += count_tokens(line) + 1
+        if total > max_tokens:
+            break
+        kept.append(line)
+    return '\n'.join(kept + [f"... (트리 {len(output) - len(kept)}줄 생략)"])
@@ -0,0 +1,105 @@
+"""
+로컬 모의 LLM 서버
+
+OpenAI 호환 REST API(/v1/chat/completions, /v1/embeddings)를 결정적 모의 응답으로 제공합니다.
+응답은 llm_client.FakeLLM이 만들므로 프로세스 안의 모의 제공자(LLM_PROVIDER=fake)와 같고,
+실제 OpenAI SDK 클라이언트(재시도, 연결 풀, 스트리밍 파싱 포함)를 그대로 거치므로
+네트워크 구간까지 포함한 처리량을 오프라인에서 측정할 수 있습니다.
+
+실행:
+    python fake_llm_server.py --port 8100 [--latency-ms 400] [--token-latency-ms 15] [--embed-latency-ms 80]
+                              [--rate-limit-rps 50] [--error-rate 0.01] [--seed 0]
+
+앱에서 사용:
+    LLM_BASE_URL=http://127.0.0.1:8100/v1 python app.py
+
+주입한 오류는 실제 API와 같은 상태 코드(429, 500)로 응답하므로 SDK 클라이언트의 재시도 동작도 함께 확인할 수 있습니다.
+요청 수와 주입된 오류 수는 GET /stats로 확인합니다.
+"""
+
+import json
+import asyncio
+import argparse
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from llm_client import FakeLLM
+
+
+def create_app(fake: FakeLLM) -> Starlette:
+    """FakeLLM 응답을 제공하는 OpenAI 호환 ASGI 앱"""
+
+    def rejected_response():
+        rejected = fake.admit()
+        if not rejected:
+            return None
+        status, message = rejected
+        error_type = 'rate_limit_error' if status == 429 else 'server_error'
+        headers = {'retry-after-ms': '200'} if status == 429 else {}
+        return JSONResponse({'error': {'message': message, 'type': error_type, 'code': None}},
+                            status_code=status, headers=headers)
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        rejected = rejected_response()
+        if rejected:
+            return rejected
+        if body.get('stream'):
+            chunks = fake.chat_chunks(body)
+
+            async def events():
+                for delay, chunk in chunks:
+                    await asyncio.sleep(delay)
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type='text/event-stream')
+        delay, response = fake.chat_completion(body)
+        await asyncio.sleep(delay)
+        return JSONResponse(response)
+
+    async def embeddings(request: Request):
+        body = await request.json()
+        rejected = rejected_response()
+        if rejected:
+            return rejected
+        delay, response = fake.embeddings(body)
+        await asyncio.sleep(delay)
+        return JSONResponse(response)
+
+    async def stats(request: Request):
+        return JSONResponse(fake.stats())
+
+    return Starlette(routes=[
+        Route('/v1/chat/completions', chat_completions, methods=['POST']),
+        Route('/v1/embeddings', embeddings, methods=['POST']),
+        Route('/stats', stats, methods=['GET']),
+    ])
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI 호환 로컬 모의 LLM 서버")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='채팅 응답의 첫 토큰까지 지연 시간')
+    parser.add_argument('--token-latency-ms', type=float, default=0.0, help='출력 토큰당 지연 시간')
+    parser.add_argument('--embed-latency-ms', type=float, default=0.0, help='임베딩 요청당 지연 시간')
+    parser.add_argument('--rate-limit-rps', type=float, default=0.0, help='초당 허용 요청 수 (0이면 제한 없음)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500 오류 주입 확률')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeLLM(latency_ms=args.latency_ms, token_latency_ms=args.token_latency_ms,
+                   embed_latency_ms=args.embed_latency_ms, rate_limit_rps=args.rate_limit_rps,
+                   error_rate=args.error_rate, seed=args.seed)
+    print(f"[DEBUG] 모의 LLM 서버 시작: http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+세션 파일 저장소 모듈
+
+분석된 세션 파일을 경로/파일명으로 바로 찾고, 파일 내용은 처음 필요할 때 한 번만 읽어
+크기 제한이 있는 메모리 캐시에 보관합니다.
+파일 전체 코드 요청과 코드 수정 컨텍스트가 같은 저장소를 사용하므로 세션 파일 목록을 매번 훑거나
+같은 파일을 디스크에서 여러 번 읽지 않습니다.
+
+내용은 로컬 클론(./repos/{session_id})에서 읽고, 로컬 파일이 없으면 세션 데이터에 함께 저장된 내용
+(이전 버전에서 분석한 세션)을 사용합니다. 모든 파일은 decode_source 하나의 정책으로 디코딩합니다.
+
+주요 구성:
+    - decode_source: 파일 바이트 디코딩 정책 (UTF-8(BOM 허용) → CP949 → Latin-1)
+    - SessionFileStore: 세션 하나의 경로/파일명 색인과 지연 로드 내용 조회
+    - get_file_store: 세션 파일 저장소 (세션 파일 목록이 바뀌면 다시 만듦)
+    - invalidate_files: 변경사항 적용 후 캐시된 파일 내용 제거
+    - file_metadata: 세션 데이터에 저장할 파일 메타데이터 (내용 제외)
+
+파일 내용은 디코딩에 사용한 인코딩과 함께 caches.file_content_cache(모든 세션 공유, 내용 길이의 합으로 제한)에
+보관하므로, 캐시에서 읽은 파일도 원래 인코딩(CP949, UTF-8 BOM 등)으로 다시 쓸 수 있습니다.
+"""
+
+import os
+import posixpath
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from caches import file_content_cache
+
+# ----------------- 상수 정의 -----------------
+SOURCE_ENCODINGS = ('utf-8', 'cp949')  # 순서대로 시도, 모두 실패하면 latin-1 (모든 바이트를 그대로 보존)
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def decode_source(data: bytes) -> Tuple[str, str]:
+    """
+    파일 바이트를 문자열로 디코딩
+
+    BOM이 있는 UTF-8 파일은 'utf-8-sig'를 반환하므로, 같은 인코딩으로 다시 쓰면 BOM이 유지됩니다.
+
+    Returns:
+        Tuple[str, str]: (내용, 사용한 인코딩)
+    """
+    if data.startswith(UTF8_BOM):
+        try:
+            return data.decode('utf-8-sig'), 'utf-8-sig'
+        except UnicodeDecodeError:
+            pass
+    for encoding in SOURCE_ENCODINGS:
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    return data.decode('latin-1'), 'latin-1'
+
+
+class SessionFileStore:
+    """
+    세션 하나의 파일 색인과 내용 조회
+
+    경로 색인(경로 -> 파일 메타데이터)과 파일명 색인(파일명 -> 경로 목록)은 만들 때 한 번 구성하고,
+    내용은 read 시점에 읽어 디코딩에 사용한 인코딩과 함께 file_content_cache에 보관합니다.
+    """
+
+    def __init__(self, session_id: str, files: Iterable[Dict[str, Any]], repo_path: Optional[str] = None):
+        """
+        Args:
+            session_id (str): 세션 ID
+            files (Iterable[Dict[str, Any]]): 세션 파일 목록 ({'path', 'file_name', ...}, 'content'는 선택)
+            repo_path (Optional[str]): 로컬 클론 경로 (기본값: ./repos/{session_id})
+        """
+        self.session_id = session_id
+        self.repo_path = repo_path or f"./repos/{session_id}"
+        self._by_path: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        for f in files:
+            path = f.get('path')
+            if not path:
+                continue
+            self._by_path[path] = f
+            self._by_name.setdefault(f.get('file_name') or posixpath.basename(path), []).append(path)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._by_path
+
+    def __len__(self) -> int:
+        return len(self._by_path)
+
+    @property
+    def paths(self) -> List[str]:
+        return list(self._by_path)
+
+    def resolve(self, name: str) -> List[str]:
+        """
+        경로 또는 파일명으로 세션 파일 경로 찾기
+
+        정확한 경로, 파일명, 경로 끝부분(dir/file.py) 순으로 일치하는 경로 목록을 반환합니다.
+        """
+        name = (name or '').strip().strip('/')
+        if not name:
+            return []
+        if name in self._by_path:
+            return [name]
+        base = posixpath.basename(name)
+        candidates = self._by_name.get(base, [])
+        if base != name:
+            candidates = [p for p in candidates if p.endswith('/' + name)]
+        return list(candidates)
+
+    def read(self, path: str) -> Optional[str]:
+        """파일 내용 (캐시 → 로컬 클론 → 세션 데이터 순, 세션 파일이 아니거나 읽을 수 없으면 None)"""
+        return self.read_with_encoding(path)[0]
+
+    def encoding(self, path: str) -> Optional[str]:
+        """파일을 디코딩한 인코딩 (다시 쓸 때 같은 인코딩/BOM 유지용, 알 수 없으면 None)"""
+        return self.read_with_encoding(path)[1]
+
+    def read_with_encoding(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        """(파일 내용, 디코딩에 사용한 인코딩) - 캐시 적중 시에도 인코딩을 함께 반환"""
+        if path not in self._by_path:
+            return None, None
+        key = (self.session_id, path)
+        cached = file_content_cache.get(key)
+        if cached is not None:
+            return cached
+        content, encoding = self._load(path)
+        if content is not None:
+            file_content_cache.set(key, (content, encoding))
+        return content, encoding
+
+    def _load(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        local_path = os.path.join(self.repo_path, path)
+        try:
+            with open(local_path, 'rb') as f:
+                content, encoding = decode_source(f.read())
+            if encoding != 'utf-8':
+                print(f"[DEBUG] 파일을 {encoding} 인코딩으로 읽음: {path}")
+            return content, encoding
+        except FileNotFoundError:
+            # 세션 데이터에 저장된 내용은 원래 인코딩을 알 수 없음
+            content = self._by_path[path].get('content')
+            if content is None:
+                print(f"[WARNING] 파일이 로컬에 존재하지 않음: {local_path}")
+            return content, None
+        except OSError as e:
+            print(f"[WARNING] 파일 읽기 실패 ({path}): {e}")
+            return None, None
+
+    def invalidate(self, paths: Optional[Iterable[str]] = None):
+        """캐시된 파일 내용 제거 (paths가 None이면 세션의 모든 파일)"""
+        for path in (self._by_path if paths is None else paths):
+            file_content_cache.pop((self.session_id, path))
+
+
+_stores: Dict[str, Tuple[tuple, SessionFileStore]] = {}
+_stores_lock = threading.Lock()
+
+
+def _signature(session_data: Dict[str, Any]) -> tuple:
+    files = session_data.get('files') or []
+    return (session_data.get('commit_sha'), len(files), id(files))
+
+
+def get_file_store(session_id: str, session_data: Dict[str, Any]) -> SessionFileStore:
+    """
+    세션 파일 저장소 (세션 파일 목록 또는 커밋이 바뀌었으면 색인을 다시 만듦)
+    """
+    signature = _signature(session_data)
+    with _stores_lock:
+        entry = _stores.get(session_id)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+    store = SessionFileStore(session_id, session_data.get('files') or [])
+    if entry is not None:
+        entry[1].invalidate()
+    with _stores_lock:
+        _stores[session_id] = (signature, store)
+    print(f"[DEBUG] 세션 파일 저장소 생성: {session_id} (파일 수: {len(store)})")
+    return store
+
+
+def invalidate_files(session_id: str, paths: Optional[Iterable[str]] = None):
+    """변경사항 적용 등으로 파일이 바뀐 뒤 캐시된 내용 제거 (paths가 None이면 세션 전체)"""
+    with _stores_lock:
+        entry = _stores.get(session_id)
+    if entry is not None:
+        entry[1].invalidate(paths)
+    elif paths is not None:
+        for path in paths:
+            file_content_cache.pop((session_id, path))
+
+
+def file_metadata(files: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """세션에 저장할 파일 메타데이터 (내용은 저장소에서 필요할 때 읽으므로 제외)"""
+    return [{k: v for k, v in f.items() if k != 'content'} for f in files]
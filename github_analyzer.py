@@ -2,7 +2,7 @@
 GitHub 저장소 분석 및 임베딩을 위한 모듈
 
 이 모듈은 GitHub 저장소의 내용을 가져와서 분석하고, 
-LangChain Document로 변환한 후 ChromaDB에 임베딩하여 저장하는 기능을 제공합니다.
+LangChain Document로 변환한 후 벡터 인덱스(NumPy 또는 ChromaDB)에 임베딩하여 저장하는 기능을 제공합니다.
 
 주요 클래스:
     - GitHubRepositoryFetcher: GitHub 저장소에서 파일을 가져오는 클래스
@@ -16,7 +16,8 @@ import requests
 import chromadb
 import os
 import re
-import openai
+from llm_client import get_provider
+from file_store import decode_source
 import git
 import base64
 from typing import Optional, List, Dict, Any, Tuple
@@ -28,15 +29,23 @@ import markdown
 import concurrent.futures
 import asyncio
 import sys
+import json
+import hashlib
+import threading
 
 # ----------------- 상수 정의 -----------------
 MAIN_EXTENSIONS = ['.py', '.js', '.md']  # 분석할 주요 파일 확장자
 CHUNK_SIZE = 500  # 텍스트 청크 크기
 GITHUB_TOKEN = "GITHUB_TOKEN"  # 환경 변수 키 이름
 KEY_FILE = ".key"  # 암호화 키 파일
+SUMMARY_CACHE_FILE = "./cache/file_summaries.json"  # 파일 SHA별 요약 캐시
+SUMMARY_MAX_INPUT_TOKENS = 3000  # 파일 요약 시 사용할 파일 앞부분 토큰 수
+REMOTE_HEAD_TIMEOUT_SECONDS = 10  # git ls-remote 최대 대기 시간
+GITHUB_GIT_HOST = "https://github.com/"  # 토큰 인증 헤더를 보낼 git 원격 주소
 
-# ChromaDB 기본 클라이언트 (로컬)
-chroma_client = chromadb.Client()
+# ChromaDB 기본 클라이언트 (로컬) - 벡터 인덱스 모듈과 공유
+from vector_index import chroma_client, IndexLeases
+from context_packer import count_tokens, PROMPT_TOKEN_ENCODING
 
 def analyze_repository(repo_url: str, token: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
     """
@@ -56,7 +65,8 @@ def analyze_repository(repo_url: str, token: Optional[str] = None, session_id: O
     Returns:
         Dict[str, Any]:
             'files': 분석된 파일 목록 (각 파일은 {'path': '...', 'content': '...'} 형식)
-            'directory_structure': 디렉토리 구조 트리 텍스트
+            'directory_structure': 압축한 디렉토리 구조 트리 텍스트
+            'commit_sha': 분석한 커밋 SHA (답변 캐시 범위로 사용)
         
     Raises:
         ValueError: 잘못된 GitHub URL인 경우
@@ -75,12 +85,20 @@ def analyze_repository(repo_url: str, token: Optional[str] = None, session_id: O
         embedder = RepositoryEmbedder(fetcher.session_id)
         embedder.process_and_embed(files)
 
-        # 4. 디렉토리 구조 트리 텍스트 생성
-        directory_structure = fetcher.generate_directory_structure()
+        # 3-1. 파일 요약 인덱스 생성 (넓은 질문의 1단계 검색용, 실패해도 분석은 계속)
+        try:
+            embedder.build_file_summary_index(files)
+        except Exception as e:
+            print(f"[WARNING] 파일 요약 인덱스 생성 실패: {e}")
+
+        # 4. 디렉토리 구조 트리 텍스트 생성 (전체 트리는 커밋별로 캐시)
+        commit_sha = fetcher.get_commit_sha()
+        directory_structure = fetcher.generate_directory_structure(commit_sha)
         
         return {
             'files': files,
-            'directory_structure': directory_structure
+            'directory_structure': directory_structure,
+            'commit_sha': commit_sha
         }
         
     except ValueError as e:
@@ -90,6 +108,43 @@ def analyze_repository(repo_url: str, token: Optional[str] = None, session_id: O
         print(f"[오류] 저장소 분석 실패: {e}")
         raise
 
+def git_auth_env(token: Optional[str] = None) -> Dict[str, str]:
+    """
+    git 명령(clone, ls-remote)에 GitHub 토큰을 전달하는 환경 변수
+
+    토큰을 URL이나 명령줄에 넣지 않고 GIT_CONFIG_* 환경 변수로 http.extraheader를 설정하므로
+    클론된 저장소의 .git/config에 남지 않습니다. 토큰이 없으면 비공개 저장소에서 비밀번호 입력을
+    기다리지 않도록 터미널 프롬프트만 끕니다.
+    """
+    env = {'GIT_TERMINAL_PROMPT': '0'}
+    if token:
+        credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+        env.update({
+            'GIT_CONFIG_COUNT': '1',
+            'GIT_CONFIG_KEY_0': f"http.{GITHUB_GIT_HOST}.extraheader",
+            'GIT_CONFIG_VALUE_0': f"Authorization: Basic {credentials}",
+        })
+    return env
+
+def get_remote_head_sha(repo_url: str, token: Optional[str] = None) -> Optional[str]:
+    """
+    클론하지 않고 원격 저장소의 HEAD 커밋 SHA 확인 (git ls-remote)
+
+    Args:
+        repo_url (str): GitHub 저장소 URL
+        token (Optional[str]): GitHub 개인 액세스 토큰 (비공개 저장소, 클론과 같은 방식으로 전달)
+
+    Returns:
+        Optional[str]: 커밋 SHA 또는 None (확인 실패 시)
+    """
+    try:
+        output = git.cmd.Git().ls_remote(repo_url, 'HEAD', kill_after_timeout=REMOTE_HEAD_TIMEOUT_SECONDS,
+                                         env=git_auth_env(token))
+        return output.split()[0] if output else None
+    except Exception as e:
+        print(f"[WARNING] 원격 HEAD 커밋 확인 실패: {e}")
+        return None
+
 class GitHubRepositoryFetcher:
     """
     GitHub 저장소에서 파일을 가져오는 클래스
@@ -120,12 +175,6 @@ class GitHubRepositoryFetcher:
         # 세션 및 저장소 경로 설정
         self.session_id = session_id or f"{self.owner}_{self.repo}"
         self.repo_path = f"./repos/{self.session_id}"
-        
-        # ChromaDB 컬렉션 초기화
-        self.collection = chroma_client.get_or_create_collection(
-            name=self.session_id,
-            metadata={"description": f"Repository: {self.owner}/{self.repo}"}
-        )
 
     def create_error_response(self, message: str, status_code: int) -> Dict[str, Any]:
         """
@@ -220,11 +269,24 @@ class GitHubRepositoryFetcher:
         """
         if not os.path.exists(self.repo_path):
             try:
-                git.Repo.clone_from(self.repo_url, self.repo_path)
+                git.Repo.clone_from(self.repo_url, self.repo_path, env=git_auth_env(self.token))
             except Exception as e:
                 print("[DEBUG] GitHub 클론 에러:", e)
                 raise
 
+    def get_commit_sha(self) -> Optional[str]:
+        """
+        클론된 저장소의 HEAD 커밋 SHA
+
+        Returns:
+            Optional[str]: 커밋 SHA 또는 None (확인 실패 시)
+        """
+        try:
+            return git.Repo(self.repo_path).head.commit.hexsha
+        except Exception as e:
+            print(f"[WARNING] 커밋 SHA 확인 실패: {e}")
+            return None
+
     def get_repo_directory_contents(self, path: str = "") -> Optional[List[Dict[str, Any]]]:
         """
         GitHub API를 사용하여 저장소의 디렉토리 내용을 가져옴
@@ -292,7 +354,7 @@ class GitHubRepositoryFetcher:
                 return None
             
             # Base64 디코딩
-            content = base64.b64decode(content_data['content']).decode('utf-8')
+            content, _ = decode_source(base64.b64decode(content_data['content']))
             
             # Document 객체 생성
             return Document(
@@ -394,32 +456,19 @@ class GitHubRepositoryFetcher:
                 })
         return file_objs
 
-    def generate_directory_structure(self) -> str:
+    def generate_directory_structure(self, commit_sha: Optional[str] = None) -> str:
         """
-        저장소의 전체 디렉토리/파일 구조를 트리 형태의 텍스트로 반환
+        저장소 디렉토리 구조를 압축한 트리 텍스트로 반환
+
+        전체 트리는 로컬 클론에서 커밋당 한 번만 계산하여 캐시하고,
+        반환값은 관심 없는 디렉토리를 접고 파일 수로 요약한, 토큰 상한 안의 개요입니다.
+
+        Args:
+            commit_sha (Optional[str]): 트리 캐시 키로 사용할 커밋 SHA
         """
-        # 디렉토리 내용 재귀적으로 가져오기
-        def build_tree(path=""):
-            items = self.get_repo_directory_contents(path)
-            tree = {}
-            if not items or isinstance(items, dict) and items.get('error'):
-                return tree
-            for item in items:
-                if item['type'] == 'file':
-                    tree[f"📄 {item['name']}"] = None
-                elif item['type'] == 'dir':
-                    tree[f"📁 {item['name']}"] = build_tree(item['path'])
-            return tree
-        
-        tree = build_tree()
-        lines = []
-        def traverse(node, prefix=""):
-            for key, value in sorted(node.items()):
-                lines.append(f"{prefix}{key}")
-                if value is not None:
-                    traverse(value, prefix + "  ")
-        traverse(tree)
-        return "\n".join(lines)
+        from directory_tree import load_or_build_tree, render_tree
+        tree = load_or_build_tree(self.repo_path, commit_sha)
+        return render_tree(tree)
 
     # ----------------- 토큰 관련 기능 -----------------
     @staticmethod
@@ -510,12 +559,229 @@ class GitHubRepositoryFetcher:
             return False
 
 
+# ----------------- 파일 요약 캐시 -----------------
+_summary_cache_lock = threading.Lock()
+
+def load_summary_cache() -> Dict[str, str]:
+    """파일 SHA -> 요약 캐시 로드"""
+    try:
+        if os.path.exists(SUMMARY_CACHE_FILE):
+            with open(SUMMARY_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[WARNING] 파일 요약 캐시 로드 실패: {e}")
+    return {}
+
+def save_summary_cache(new_entries: Dict[str, str]):
+    """새로 생성한 요약을 캐시 파일에 병합 저장"""
+    if not new_entries:
+        return
+    with _summary_cache_lock:
+        cache = load_summary_cache()
+        cache.update(new_entries)
+        os.makedirs(os.path.dirname(SUMMARY_CACHE_FILE), exist_ok=True)
+        tmp_path = SUMMARY_CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, SUMMARY_CACHE_FILE)
+
+# ----------------- 청크 분할 기능 -----------------
+_encoder = None
+
+def get_encoder():
+    """청크 분할에 사용하는 tiktoken 인코더 (최초 호출 시 1회 로드)"""
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    return _encoder
+
+def split_by_tokens(text, max_tokens=256, overlap=64):
+    enc = get_encoder()
+    tokens = enc.encode(text)
+    chunks = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        chunk = enc.decode(tokens[start:end])
+        chunks.append((chunk, start, end))
+        if end == len(tokens):
+            break
+        start += max_tokens - overlap
+    return chunks
+
+def chunk_python_functions(source_code):
+    enc = get_encoder()
+    try:
+        tree = ast.parse(source_code)
+    except Exception:
+        return [(source_code, 0, len(enc.encode(source_code)), None, None, 1, len(source_code.splitlines()))]
+    lines = source_code.splitlines()
+    chunks = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            start = node.lineno - 1
+            end = getattr(node, 'end_lineno', None)
+            if end is None:
+                continue
+            chunk = '\n'.join(lines[start:end])
+            class_name = node.name if isinstance(node, ast.ClassDef) else None
+            func_name = node.name if isinstance(node, ast.FunctionDef) else None
+            if len(enc.encode(chunk)) > 256:
+                for sub_chunk, t_start, t_end in split_by_tokens(chunk, max_tokens=256, overlap=64):
+                    chunks.append((sub_chunk, t_start, t_end, func_name, class_name, start+1, end))
+            else:
+                chunks.append((chunk, 0, len(enc.encode(chunk)), func_name, class_name, start+1, end))
+    if not chunks:
+        for chunk, t_start, t_end in split_by_tokens(source_code, max_tokens=256, overlap=64):
+            chunks.append((chunk, t_start, t_end, None, None, 1, len(source_code.splitlines())))
+    return chunks
+
+def chunk_markdown(md_text):
+    enc = get_encoder()
+    pattern = r'(\n#+ .+|\n```[\s\S]+?```|\n\s*\n)'
+    parts = re.split(pattern, md_text)
+    chunks = []
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        if len(enc.encode(part)) > 256:
+            for chunk, t_start, t_end in split_by_tokens(part, max_tokens=256, overlap=64):
+                chunks.append((chunk, t_start, t_end, None, None, None, None))
+        else:
+            chunks.append((part, 0, len(enc.encode(part)), None, None, None, None))
+    return chunks
+
+def chunk_js(source_code):
+    return [(*x, None, None, None, None) for x in split_by_tokens(source_code, max_tokens=256, overlap=64)]
+
+def chunk_files(files: List[Dict[str, Any]]) -> List[Tuple]:
+    """
+    파일 목록을 확장자별 규칙으로 청크 분할
+
+    Args:
+        files (List[Dict[str, Any]]): get_file_contents 형식의 파일 목록
+
+    Returns:
+        List[Tuple]: (chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line) 목록
+    """
+    all_chunks = []
+    for file in files:
+        content = file['content']
+        path = file['path']
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.py':
+            chunks = chunk_python_functions(content)
+        elif ext == '.md':
+            chunks = chunk_markdown(content)
+        elif ext == '.js':
+            chunks = chunk_js(content)
+        else:
+            chunks = [(*x, None, None, None, None) for x in split_by_tokens(content, max_tokens=256, overlap=64)]
+        for i, (chunk, t_start, t_end, func_name, class_name, start_line, end_line) in enumerate(chunks):
+            all_chunks.append((chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line))
+    return all_chunks
+
+
+def safe_meta(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """인덱스에 저장할 수 있도록 None 메타데이터 값을 빈 문자열로 바꿈"""
+    return {k: ('' if v is None else v if not isinstance(v, (int, float, bool)) else v) for k, v in meta.items()}
+
+def chunk_metadata(file: Dict[str, Any], i, t_start, t_end, func_name, class_name, start_line, end_line,
+                   chunk: str, role_tag: str) -> Dict[str, Any]:
+    """청크 인덱스에 저장할 청크 메타데이터"""
+    return safe_meta({
+        "path": file['path'] or '',
+        "file_name": file.get('file_name') or '',
+        "file_type": file.get('file_type') or '',
+        "sha": file.get('sha') or '',
+        "source_url": file.get('source_url') or '',
+        "chunk_index": i,
+        "function_name": func_name or '',
+        "class_name": class_name or '',
+        "start_line": start_line if start_line is not None else -1,
+        "end_line": end_line if end_line is not None else -1,
+        "token_start": t_start if t_start is not None else -1,
+        "token_end": t_end if t_end is not None else -1,
+        # 컨텍스트 패킹 시 다시 인코딩하지 않도록 답변 모델 인코딩 기준의 청크 토큰 수 저장
+        # (token_start/token_end는 청크 분할용 cl100k 기준이라 예산 계산에 쓰지 않음)
+        "token_count": count_tokens(chunk),
+        "token_encoding": PROMPT_TOKEN_ENCODING,
+        "role_tag": role_tag
+    })
+
+async def embed_and_tag_chunk(provider, chunk: str) -> Tuple[List[float], str]:
+    """청크 하나를 임베딩하고 역할 태그를 생성 (실패하면 0 벡터 / 빈 태그)"""
+    # 임베딩
+    try:
+        embedding = (await provider.embed_async(chunk, model="text-embedding-3-small"))[0]
+    except Exception as e:
+        print(f"[WARNING] 임베딩 실패: {e}")
+        embedding = [0.0] * 1536
+    # 역할 태깅
+    tag_prompt = f"아래 코드는 어떤 역할(기능/목적)을 하나요? 한글로 간단히 요약해줘.\n\n코드:\n{chunk}"
+    try:
+        tag_resp = await provider.chat_async(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": tag_prompt}],
+            temperature=0.0,
+            max_tokens=32
+        )
+        role_tag = tag_resp.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"[WARNING] 역할 태깅 실패: {e}")
+        role_tag = ''
+    return embedding, role_tag
+
+async def embed_role_tags(provider, tags: List[str], batch: int = 100) -> Dict[str, List[float]]:
+    """역할 태그 일괄 임베딩 (태그 -> 벡터, 실패한 배치는 제외)"""
+    tag_vectors = {}
+    for start in range(0, len(tags), batch):
+        part = tags[start:start + batch]
+        try:
+            vectors = await provider.embed_async(part, model="text-embedding-3-small")
+            tag_vectors.update(zip(part, vectors))
+        except Exception as e:
+            print(f"[WARNING] 역할 태그 임베딩 실패: {e}")
+    return tag_vectors
+
+async def summarize_file(provider, file: Dict[str, Any]) -> str:
+    """파일 역할 요약 (파일 앞부분 SUMMARY_MAX_INPUT_TOKENS 토큰 사용, 실패하면 빈 문자열)"""
+    enc = get_encoder()
+    tokens = enc.encode(file['content'])
+    content = enc.decode(tokens[:SUMMARY_MAX_INPUT_TOKENS])
+    prompt = (
+        "아래 파일이 프로젝트에서 어떤 역할을 하는지 주요 함수/클래스와 함께 한글 2~3문장으로 요약해줘.\n\n"
+        f"파일 경로: {file['path']}\n\n코드:\n{content}"
+    )
+    try:
+        resp = await provider.chat_async(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=160
+        )
+        return resp.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"[WARNING] 파일 요약 실패 ({file['path']}): {e}")
+        return ''
+
+def git_blob_sha(data: bytes) -> str:
+    """git(GitHub API)과 같은 방식의 파일 blob SHA (파일 요약 캐시 키로 사용)"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def summary_metadata(file: Dict[str, Any]) -> Dict[str, Any]:
+    """파일 요약 인덱스에 저장할 메타데이터"""
+    return {'path': file['path'], 'file_name': file.get('file_name') or '', 'sha': file.get('sha') or ''}
+
+
 class RepositoryEmbedder:
     """
     저장소 내용을 임베딩하는 클래스
     
     이 클래스는 GitHub 저장소의 파일 내용을 청크로 나누고,
-    OpenAI API를 사용하여 임베딩한 후 ChromaDB에 저장합니다.
+    OpenAI API를 사용하여 임베딩한 후 벡터 인덱스에 저장합니다.
+    인덱스 백엔드(NumPy/ChromaDB)는 청크 수에 따라 자동으로 선택됩니다.
     """
     
     def __init__(self, session_id: str):
@@ -526,157 +792,214 @@ class RepositoryEmbedder:
             session_id (str): 세션 ID
         """
         self.session_id = session_id
-        self.collection = chroma_client.get_or_create_collection(name=f"repo_{session_id}")
+        self.index = None  # 청크 수가 정해진 뒤 process_and_embed에서 생성
 
     def process_and_embed(self, files: List[Dict[str, Any]]):
         # 내부 비동기 함수 정의
         async def async_process_and_embed(files):
-            import openai
-            api_key = os.environ.get("OPENAI_API_KEY")
-            client = openai.AsyncClient(api_key=api_key)
-            enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
-            def safe_meta(meta):
-                return {k: ('' if v is None else v if not isinstance(v, (int, float, bool)) else v) for k, v in meta.items()}
-            def split_by_tokens(text, max_tokens=256, overlap=64):
-                tokens = enc.encode(text)
-                chunks = []
-                start = 0
-                while start < len(tokens):
-                    end = min(start + max_tokens, len(tokens))
-                    chunk = enc.decode(tokens[start:end])
-                    chunks.append((chunk, start, end))
-                    if end == len(tokens):
-                        break
-                    start += max_tokens - overlap
-                return chunks
-            def chunk_python_functions(source_code):
-                try:
-                    tree = ast.parse(source_code)
-                except Exception:
-                    return [(source_code, 0, len(enc.encode(source_code)), None, None, 1, len(source_code.splitlines()))]
-                lines = source_code.splitlines()
-                chunks = []
-                for node in tree.body:
-                    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                        start = node.lineno - 1
-                        end = getattr(node, 'end_lineno', None)
-                        if end is None:
-                            continue
-                        chunk = '\n'.join(lines[start:end])
-                        name = node.name
-                        class_name = node.name if isinstance(node, ast.ClassDef) else None
-                        func_name = node.name if isinstance(node, ast.FunctionDef) else None
-                        if len(enc.encode(chunk)) > 256:
-                            for sub_chunk, t_start, t_end in split_by_tokens(chunk, max_tokens=256, overlap=64):
-                                chunks.append((sub_chunk, t_start, t_end, func_name, class_name, start+1, end))
-                        else:
-                            chunks.append((chunk, 0, len(enc.encode(chunk)), func_name, class_name, start+1, end))
-                if not chunks:
-                    for chunk, t_start, t_end in split_by_tokens(source_code, max_tokens=256, overlap=64):
-                        chunks.append((chunk, t_start, t_end, None, None, 1, len(source_code.splitlines())))
-                return chunks
-            def chunk_markdown(md_text):
-                pattern = r'(\n#+ .+|\n```[\s\S]+?```|\n\s*\n)'
-                parts = re.split(pattern, md_text)
-                chunks = []
-                for part in parts:
-                    part = part.strip()
-                    if not part:
-                        continue
-                    if len(enc.encode(part)) > 256:
-                        for chunk, t_start, t_end in split_by_tokens(part, max_tokens=256, overlap=64):
-                            chunks.append((chunk, t_start, t_end, None, None, None, None))
-                    else:
-                        chunks.append((part, 0, len(enc.encode(part)), None, None, None, None))
-                return chunks
-            def chunk_js(source_code):
-                return [(*x, None, None, None, None) for x in split_by_tokens(source_code, max_tokens=256, overlap=64)]
+            provider = get_provider()
             # 1. 전체 청크 수집
-            all_chunks = []
-            for file in files:
-                content = file['content']
-                path = file['path']
-                ext = os.path.splitext(path)[1].lower()
-                file_name = file.get('file_name')
-                file_type = file.get('file_type')
-                sha = file.get('sha')
-                source_url = file.get('source_url')
-                if ext == '.py':
-                    chunks = chunk_python_functions(content)
-                elif ext == '.md':
-                    chunks = chunk_markdown(content)
-                elif ext == '.js':
-                    chunks = chunk_js(content)
-                else:
-                    chunks = [(*x, None, None, None, None) for x in split_by_tokens(content, max_tokens=256, overlap=64)]
-                for i, (chunk, t_start, t_end, func_name, class_name, start_line, end_line) in enumerate(chunks):
-                    all_chunks.append((chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line))
+            all_chunks = chunk_files(files)
             # 2. 비동기 임베딩+역할태깅 함수
-            async def embed_and_tag_async(args, client):
-                chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line = args
-                # 임베딩
-                try:
-                    emb_resp = await client.embeddings.create(
-                        input=chunk,
-                        model="text-embedding-3-small"
-                    )
-                    embedding = emb_resp.data[0].embedding
-                except Exception as e:
-                    print(f"[WARNING] 임베딩 실패: {e}")
-                    embedding = [0.0] * 1536
-                # 역할 태깅
-                tag_prompt = f"아래 코드는 어떤 역할(기능/목적)을 하나요? 한글로 간단히 요약해줘.\n\n코드:\n{chunk}"
-                try:
-                    tag_resp = await client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[{"role": "user", "content": tag_prompt}],
-                        temperature=0.0,
-                        max_tokens=32
-                    )
-                    role_tag = tag_resp.choices[0].message.content.strip()
-                except Exception as e:
-                    print(f"[WARNING] 역할 태깅 실패: {e}")
-                    role_tag = ''
-                return (embedding, role_tag, chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line)
+            async def embed_and_tag_async(args):
+                chunk = args[0]
+                embedding, role_tag = await embed_and_tag_chunk(provider, chunk)
+                return (embedding, role_tag, *args)
             # 3. 비동기 병렬 실행 (max_concurrent=20)
             print(f"[DEBUG] 임베딩+역할태깅 asyncio 병렬 처리 시작 (청크 수: {len(all_chunks)})")
             semaphore = asyncio.Semaphore(20)
             async def sem_task(args):
                 async with semaphore:
-                    return await embed_and_tag_async(args, client)
+                    return await embed_and_tag_async(args)
             tasks = [sem_task(args) for args in all_chunks]
             results = await asyncio.gather(*tasks)
             print(f"[DEBUG] 임베딩+역할태깅 asyncio 병렬 처리 완료")
-            # 4. DB 저장 (동기)
+            # 4. 인덱스 저장 (동기, 한 번에 일괄 추가)
+            self.index = leases.create(self.session_id, len(results))
+            ids, embeddings, documents, metadatas = [], [], [], []
             for embedding, role_tag, chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line in results:
-                file_name = file.get('file_name')
-                file_type = file.get('file_type')
-                sha = file.get('sha')
-                source_url = file.get('source_url')
-                path = file['path']
-                metadata = {
-                    "path": path or '',
-                    "file_name": file_name or '',
-                    "file_type": file_type or '',
-                    "sha": sha or '',
-                    "source_url": source_url or '',
-                    "chunk_index": i,
-                    "function_name": func_name or '',
-                    "class_name": class_name or '',
-                    "start_line": start_line if start_line is not None else -1,
-                    "end_line": end_line if end_line is not None else -1,
-                    "token_start": t_start if t_start is not None else -1,
-                    "token_end": t_end if t_end is not None else -1,
-                    "role_tag": role_tag
-                }
-                self.collection.add(
-                    ids=[f"{path}_{i}"],
-                    embeddings=[embedding],
-                    documents=[chunk],
-                    metadatas=[safe_meta(metadata)]
+                ids.append(f"{file['path']}_{i}")
+                embeddings.append(embedding)
+                documents.append(chunk)
+                metadatas.append(chunk_metadata(file, i, t_start, t_end, func_name, class_name, start_line, end_line,
+                                                chunk, role_tag))
+            if ids:
+                self.index.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            self.index.persist()
+            # 5. 역할 태그 임베딩 후 역할 태그 인덱스(roles_{session_id})에 청크 ID로 저장
+            # (같은 태그는 한 번만 임베딩, 질문 임베딩과의 코사인 유사도로 역할 매칭)
+            tagged = [(chunk_id, meta['role_tag'], meta['path']) for chunk_id, meta in zip(ids, metadatas) if meta['role_tag']]
+            unique_tags = list(dict.fromkeys(tag for _, tag, _ in tagged))
+            tag_vectors = await embed_role_tags(provider, unique_tags)
+            tagged = [(chunk_id, tag, path) for chunk_id, tag, path in tagged if tag in tag_vectors]
+            role_index = leases.create(self.session_id, len(tagged), kind='roles')
+            if tagged:
+                role_index.add(
+                    ids=[chunk_id for chunk_id, _, _ in tagged],
+                    embeddings=[tag_vectors[tag] for _, tag, _ in tagged],
+                    documents=[tag for _, tag, _ in tagged],
+                    metadatas=[{'path': path} for _, _, path in tagged]
                 )
+            role_index.persist()
+            print(f"[DEBUG] 역할 태그 인덱스 저장 완료 (청크 수: {len(tagged)}, 고유 태그 수: {len(tag_vectors)})")
         # 동기 함수에서 비동기 실행
         if sys.version_info >= (3, 7):
-            asyncio.run(async_process_and_embed(files))
+            # 구축 중인 인덱스는 대여하여 수명 관리 점검이 내리지 않도록 함
+            with IndexLeases() as leases:
+                asyncio.run(async_process_and_embed(files))
         else:
             raise RuntimeError("Python 3.7 이상에서만 지원됩니다.")
+
+    def update_files(self, files: List[Dict[str, Any]], removed_paths: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        바뀐 파일만 다시 청크 분할/임베딩하여 기존 인덱스에서 그 파일의 청크를 교체
+
+        내용이 같은 청크(이전 인덱스의 문서와 해시가 같은 청크)는 저장된 임베딩과 역할 태그를 재사용하고,
+        새로 생긴 청크만 임베딩/역할 태깅합니다. 청크 인덱스, 역할 태그 인덱스, 파일 요약 인덱스의 해당 파일 항목은
+        각각 replace 한 번으로 교체되므로 검색은 교체 전 또는 후 상태만 봅니다.
+
+        Args:
+            files (List[Dict[str, Any]]): 바뀐 파일 목록 (get_file_contents 형식, 'content' 필수)
+            removed_paths (Optional[List[str]]): 인덱스에서 지울 파일 경로 목록
+
+        Returns:
+            Dict[str, int]: {'chunks': 새 청크 수, 'reused': 재사용한 청크 수, 'embedded': 새로 임베딩한 청크 수}
+        """
+        async def async_update(files):
+            provider = get_provider()
+            paths = [f['path'] for f in files] + list(removed_paths or [])
+            index = leases.open(self.session_id)
+            if index is None:
+                raise RuntimeError(f"세션 인덱스를 찾을 수 없습니다: {self.session_id}")
+            self.index = index
+
+            # 1. 이전 청크의 임베딩/역할 태그를 내용 해시로 모음
+            old = index.get(where={'path': {'$in': paths}}, include=['documents', 'metadatas', 'embeddings'])
+            reusable = {}
+            for document, metadata, embedding in zip(old['documents'], old['metadatas'], old['embeddings']):
+                reusable.setdefault(hashlib.sha256(document.encode('utf-8')).hexdigest(),
+                                    (list(embedding), metadata.get('role_tag') or ''))
+
+            # 2. 새 청크는 재사용하거나 새로 임베딩+역할 태깅 (max_concurrent=20)
+            all_chunks = chunk_files(files)
+            semaphore = asyncio.Semaphore(20)
+            reused = 0
+            async def embed_or_reuse(args):
+                nonlocal reused
+                cached = reusable.get(hashlib.sha256(args[0].encode('utf-8')).hexdigest())
+                if cached is not None:
+                    reused += 1
+                    return (*cached, *args)
+                async with semaphore:
+                    embedding, role_tag = await embed_and_tag_chunk(provider, args[0])
+                return (embedding, role_tag, *args)
+            results = await asyncio.gather(*[embed_or_reuse(args) for args in all_chunks])
+
+            # 3. 청크 인덱스에서 파일의 청크를 한 번에 교체
+            ids, embeddings, documents, metadatas = [], [], [], []
+            for embedding, role_tag, chunk, file, i, t_start, t_end, func_name, class_name, start_line, end_line in results:
+                ids.append(f"{file['path']}_{i}")
+                embeddings.append(embedding)
+                documents.append(chunk)
+                metadatas.append(chunk_metadata(file, i, t_start, t_end, func_name, class_name, start_line, end_line,
+                                                chunk, role_tag))
+            index.replace(old['ids'], ids, embeddings, documents, metadatas)
+            index.persist()
+
+            # 4. 역할 태그 인덱스 교체 (이전 태그 벡터 재사용, 새 태그만 임베딩)
+            role_index = leases.open(self.session_id, kind='roles')
+            if role_index is not None:
+                old_roles = (role_index.get(ids=old['ids'], include=['documents', 'embeddings']) if old['ids']
+                             else {'ids': [], 'documents': [], 'embeddings': []})
+                tag_vectors = {tag: list(vector) for tag, vector in zip(old_roles['documents'], old_roles['embeddings'])}
+                tagged = [(chunk_id, meta['role_tag'], meta['path']) for chunk_id, meta in zip(ids, metadatas) if meta['role_tag']]
+                missing = list(dict.fromkeys(tag for _, tag, _ in tagged if tag not in tag_vectors))
+                tag_vectors.update(await embed_role_tags(provider, missing))
+                tagged = [(chunk_id, tag, path) for chunk_id, tag, path in tagged if tag in tag_vectors]
+                role_index.replace(
+                    old_roles['ids'],
+                    [chunk_id for chunk_id, _, _ in tagged],
+                    [tag_vectors[tag] for _, tag, _ in tagged],
+                    [tag for _, tag, _ in tagged],
+                    [{'path': path} for _, _, path in tagged]
+                )
+                role_index.persist()
+
+            # 5. 파일 요약 인덱스 교체 (요약은 파일 SHA별 캐시 사용)
+            files_index = leases.open(self.session_id, kind='files')
+            if files_index is not None:
+                cache = load_summary_cache()
+                entries = []
+                new_entries = {}
+                for file in files:
+                    summary = cache.get(file.get('sha') or '')
+                    if not summary:
+                        summary = await summarize_file(provider, file)
+                        if summary and file.get('sha'):
+                            new_entries[file['sha']] = summary
+                    if summary:
+                        entries.append((file, summary))
+                save_summary_cache(new_entries)
+                vectors = []
+                if entries:
+                    vectors = await provider.embed_async([f"{f['path']}\n{summary}" for f, summary in entries],
+                                                         model="text-embedding-3-small")
+                files_index.replace(paths, [f['path'] for f, _ in entries], vectors,
+                                    [summary for _, summary in entries], [summary_metadata(f) for f, _ in entries])
+                files_index.persist()
+
+            print(f"[DEBUG] 인덱스 부분 갱신 완료 (파일: {len(paths)}개, 청크: {len(ids)}개, 재사용: {reused}개, "
+                  f"이전 청크: {len(old['ids'])}개)")
+            return {'chunks': len(ids), 'reused': reused, 'embedded': len(ids) - reused}
+
+        with IndexLeases() as leases:
+            return asyncio.run(async_update(files))
+
+    def build_file_summary_index(self, files: List[Dict[str, Any]]):
+        """
+        파일별 요약을 만들어 임베딩한 뒤 파일 요약 인덱스(files_{session_id})에 저장
+
+        요약은 파일 SHA 기준으로 캐시되어, 같은 내용의 파일은 다시 요약하지 않습니다.
+
+        Args:
+            files (List[Dict[str, Any]]): get_file_contents 형식의 파일 목록
+        """
+        async def async_build(files):
+            provider = get_provider()
+            cache = load_summary_cache()
+            new_entries = {}
+
+            # 1. 캐시에 없는 파일만 요약 (max_concurrent=20)
+            semaphore = asyncio.Semaphore(20)
+            async def sem_task(file):
+                async with semaphore:
+                    return await summarize_file(provider, file)
+            missing = [f for f in files if f.get('content') and not cache.get(f.get('sha') or '')]
+            print(f"[DEBUG] 파일 요약 시작 (전체: {len(files)}개, 캐시 미스: {len(missing)}개)")
+            summaries = await asyncio.gather(*[sem_task(f) for f in missing])
+            for file, summary in zip(missing, summaries):
+                if summary and file.get('sha'):
+                    new_entries[file['sha']] = summary
+                cache[file.get('sha') or file['path']] = summary
+            save_summary_cache(new_entries)
+
+            # 2. 요약 일괄 임베딩 후 인덱스 저장
+            entries = [(f, cache.get(f.get('sha') or f['path'])) for f in files]
+            entries = [(f, summary) for f, summary in entries if summary]
+            index = leases.create(self.session_id, len(entries), kind='files')
+            batch = 100
+            for start in range(0, len(entries), batch):
+                part = entries[start:start + batch]
+                texts = [f"{f['path']}\n{summary}" for f, summary in part]
+                vectors = await provider.embed_async(texts, model="text-embedding-3-small")
+                index.add(
+                    ids=[f['path'] for f, _ in part],
+                    embeddings=vectors,
+                    documents=[summary for _, summary in part],
+                    metadatas=[summary_metadata(f) for f, _ in part]
+                )
+            index.persist()
+            print(f"[DEBUG] 파일 요약 인덱스 저장 완료 (파일 수: {len(entries)})")
+
+        with IndexLeases() as leases:
+            asyncio.run(async_build(files))
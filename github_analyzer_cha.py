@@ -16,7 +16,7 @@ import requests
 import chromadb
 import os
 import re
-import openai
+from llm_client import get_provider
 import git
 import base64
 from typing import Optional, List, Dict, Any, Tuple
@@ -490,9 +490,8 @@ class RepositoryEmbedder:
                 각 파일은 {'path': '...', 'content': '...'} 형식
         """
         chunk_id = 0
-        api_key = os.environ.get("OPENAI_API_KEY")
-        print(f"[DEBUG] 임베딩 직전 OPENAI_API_KEY: {api_key[:8]}...{api_key[-4:]}")
-        client = openai.OpenAI(api_key=api_key)
+        provider = get_provider()
+        print(f"[DEBUG] 임베딩 제공자: {provider.name}")
         
         for file in files:
             content = file['content']
@@ -504,11 +503,7 @@ class RepositoryEmbedder:
                 
                 # OpenAI 임베딩 생성
                 try:
-                    response = client.embeddings.create(
-                        input=chunk,
-                        model="text-embedding-3-small"
-                    )
-                    embedding = response.data[0].embedding
+                    embedding = provider.embed(chunk, model="text-embedding-3-small")[0]
                 except Exception as e:
                     print("[DEBUG] OpenAI 임베딩 에러:", e)
                     raise
@@ -0,0 +1,444 @@
+"""
+LLM / 임베딩 클라이언트 모듈
+
+채팅 답변, 코드 수정, 역할 태깅, 파일 요약, 대화 요약, 임베딩 호출을 하나의 제공자 인터페이스로 모읍니다.
+채팅 응답은 OpenAI SDK 응답 객체와 같은 형식(choices[0].message.content, usage, 스트리밍 청크)이므로
+호출하는 쪽은 어떤 제공자를 쓰는지 신경 쓰지 않아도 됩니다.
+
+제공자 선택 (환경 변수):
+    - LLM_PROVIDER=openai (기본): OpenAI API
+      LLM_BASE_URL을 지정하면 그 주소로 요청합니다 (예: fake_llm_server.py로 띄운 로컬 모의 서버)
+    - LLM_PROVIDER=fake: 프로세스 안의 결정적 모의 제공자 (API 키와 네트워크가 필요 없음)
+
+모의 제공자 설정 (환경 변수, FakeLLM 인자로도 지정 가능):
+    - FAKE_LLM_LATENCY_MS: 채팅 응답의 첫 토큰까지 지연 시간
+    - FAKE_LLM_TOKEN_LATENCY_MS: 출력 토큰 하나당 지연 시간
+    - FAKE_LLM_EMBED_LATENCY_MS: 임베딩 요청 하나의 지연 시간
+    - FAKE_LLM_RATE_LIMIT_RPS: 초당 허용 요청 수 (초과 시 429, 0이면 제한 없음)
+    - FAKE_LLM_ERROR_RATE: 요청이 500 오류로 실패할 확률
+    - FAKE_LLM_SEED: 오류 주입 난수 시드
+
+주요 클래스:
+    - LLMProvider: 제공자 인터페이스 (chat, chat_async, embed, embed_async)
+    - OpenAIProvider: OpenAI SDK 클라이언트 래퍼
+    - FakeLLM: 결정적 모의 응답 생성기 (OpenAI 요청/응답 JSON 형식, 모의 서버와 공유)
+    - FakeProvider: FakeLLM을 프로세스 안에서 호출하는 제공자
+
+주요 함수:
+    - get_provider: 환경 변수로 선택한 현재 제공자
+    - set_provider: 현재 제공자 교체 (벤치마크/오프라인 실행용)
+"""
+
+import os
+import re
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import httpx
+import numpy as np
+import openai
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# ----------------- 상수 정의 -----------------
+# LLM_PROVIDER / LLM_BASE_URL / FAKE_LLM_* 환경 변수는 .env 로드 이후인 get_provider 최초 호출 시점에 읽음
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))  # 429/5xx 응답 재시도 횟수
+RETRY_INITIAL_DELAY = 0.5  # 모의 제공자의 첫 재시도 대기 시간(초), 이후 2배씩 (OpenAI SDK와 동일)
+RETRY_MAX_DELAY = 8.0
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536  # text-embedding-3-small 기본 차원
+FAKE_ANSWER_TOKENS = 48  # 모의 답변의 최대 출력 토큰 수 (max_tokens가 더 작으면 그 값)
+FAKE_CACHE_MIN_TOKENS = 1024  # 이 토큰 수 이상인 같은 시스템 메시지가 반복되면 캐시 적중으로 보고 (OpenAI와 동일)
+FAKE_CACHE_MAX_PREFIXES = 1024  # 캐시 적중 판정에 기억할 시스템 메시지 수
+_WORD_PATTERN = re.compile(r'[0-9A-Za-z_]+|[가-힣]+')
+
+
+class LLMProvider:
+    """
+    LLM / 임베딩 제공자 인터페이스
+
+    chat/chat_async는 chat.completions.create와 같은 인자를 받고 같은 형식의 응답을 반환합니다.
+    stream=True이면 청크 이터레이터(비동기 버전은 비동기 이터레이터)를 반환합니다.
+    """
+
+    name = 'base'
+
+    def is_configured(self) -> bool:
+        """호출에 필요한 설정(API 키 등)이 있는지"""
+        raise NotImplementedError
+
+    def chat(self, **kwargs):
+        raise NotImplementedError
+
+    async def chat_async(self, **kwargs):
+        raise NotImplementedError
+
+    def embed(self, texts: Union[str, List[str]], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+        """텍스트(또는 텍스트 목록)의 임베딩 목록"""
+        raise NotImplementedError
+
+    async def embed_async(self, texts: Union[str, List[str]], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI SDK 클라이언트 래퍼
+
+    동기 클라이언트는 프로세스에 하나, 비동기 클라이언트는 이벤트 루프마다 하나씩 만듭니다
+    (비동기 연결 풀은 만든 루프에서만 사용할 수 있음).
+    """
+
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self._api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def api_key(self) -> Optional[str]:
+        # .env는 이 모듈을 import한 뒤에 로드되므로 호출 시점에 읽음
+        key = self._api_key or openai.api_key or os.environ.get("OPENAI_API_KEY")
+        if not key and self.base_url:
+            return 'sk-local'  # 로컬 호환 서버는 키를 확인하지 않음
+        return key
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        return {'api_key': self.api_key, 'base_url': self.base_url, 'max_retries': self.max_retries}
+
+    @property
+    def client(self) -> openai.OpenAI:
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(**self._client_kwargs())
+            return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(**self._client_kwargs())
+            self._async_clients[loop] = client
+        return client
+
+    def chat(self, **kwargs):
+        return self.client.chat.completions.create(**kwargs)
+
+    async def chat_async(self, **kwargs):
+        return await self.async_client.chat.completions.create(**kwargs)
+
+    def embed(self, texts, model=EMBEDDING_MODEL):
+        response = self.client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in response.data]
+
+    async def embed_async(self, texts, model=EMBEDDING_MODEL):
+        response = await self.async_client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in response.data]
+
+
+def _estimate_tokens(text: str) -> int:
+    # 모의 응답의 usage 계산용 근사치 (tiktoken 인코더를 내려받지 않도록 4글자당 1토큰으로 계산)
+    return (len(text) + 3) // 4 if text else 0
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class FakeLLM:
+    """
+    결정적 모의 LLM / 임베딩 응답 생성기
+
+    같은 요청에는 항상 같은 응답을 만듭니다. 요청/응답은 OpenAI REST API의 JSON 형식이라
+    FakeProvider(프로세스 안)와 fake_llm_server.py(HTTP)가 같은 생성기를 공유합니다.
+
+    - 채팅: 마지막 사용자 메시지의 해시로 만든 답변, 메시지 길이로 계산한 usage,
+      반복된 긴 시스템 메시지는 prompt_tokens_details.cached_tokens로 보고
+    - 임베딩: 단어 특징 해싱 벡터 (단어가 겹치는 텍스트끼리 유사도가 높아 오프라인 검색도 의미가 있음)
+    - 지연: 첫 토큰 지연 + 출력 토큰당 지연, 임베딩 요청당 지연
+    - 장애 주입: 초당 요청 수 초과 시 429, error_rate 확률로 500
+    """
+
+    def __init__(self, latency_ms: float = 0.0, token_latency_ms: float = 0.0, embed_latency_ms: float = 0.0,
+                 rate_limit_rps: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 answer_tokens: int = FAKE_ANSWER_TOKENS):
+        self.latency = latency_ms / 1000.0
+        self.token_latency = token_latency_ms / 1000.0
+        self.embed_latency = embed_latency_ms / 1000.0
+        self.rate_limit_rps = rate_limit_rps
+        self.error_rate = error_rate
+        self.answer_tokens = answer_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()  # 최근 1초 동안의 요청 시각
+        self._prefixes: Dict[bytes, None] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> 'FakeLLM':
+        """FAKE_LLM_* 환경 변수로 설정한 생성기"""
+        env = os.environ.get
+        return cls(latency_ms=float(env("FAKE_LLM_LATENCY_MS", "0")),
+                   token_latency_ms=float(env("FAKE_LLM_TOKEN_LATENCY_MS", "0")),
+                   embed_latency_ms=float(env("FAKE_LLM_EMBED_LATENCY_MS", "0")),
+                   rate_limit_rps=float(env("FAKE_LLM_RATE_LIMIT_RPS", "0")),
+                   error_rate=float(env("FAKE_LLM_ERROR_RATE", "0")),
+                   seed=int(env("FAKE_LLM_SEED", "0")))
+
+    def admit(self) -> Optional[Tuple[int, str]]:
+        """
+        요청 허용 여부 판정
+
+        Returns:
+            Optional[Tuple[int, str]]: 거부 시 (HTTP 상태 코드, 오류 메시지), 허용 시 None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit_rps > 0:
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rate_limit_rps:
+                    self.rate_limited += 1
+                    return 429, f"Rate limit reached: {self.rate_limit_rps:g} requests per second"
+                self._recent.append(now)
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.errors += 1
+                return 500, "Injected server error"
+        return None
+
+    def _cached_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        if not messages or messages[0].get('role') != 'system':
+            return 0
+        prefix = messages[0].get('content') or ''
+        tokens = _estimate_tokens(prefix)
+        if tokens < FAKE_CACHE_MIN_TOKENS:
+            return 0
+        key = _digest(prefix)
+        with self._lock:
+            seen = key in self._prefixes
+            self._prefixes[key] = None
+            if len(self._prefixes) > FAKE_CACHE_MAX_PREFIXES:
+                self._prefixes.pop(next(iter(self._prefixes)))
+        return tokens // 128 * 128 if seen else 0  # OpenAI처럼 128토큰 단위로 보고
+
+    def answer_pieces(self, body: Dict[str, Any]) -> List[str]:
+        """요청의 마지막 사용자 메시지로 만든 결정적 답변 (토큰 단위 조각 목록)"""
+        messages = body.get('messages') or []
+        question = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        seed = _digest(f"{body.get('model')}\n{question}").hex()
+        words = [f"모의 응답({seed[:8]}):"] + _WORD_PATTERN.findall(question)[-8:] + \
+                [seed[i:i + 4] for i in range(0, len(seed), 4)]
+        limit = min(self.answer_tokens, body.get('max_tokens') or self.answer_tokens)
+        return [(' ' if i else '') + word for i, word in enumerate(words[:max(1, limit)])]
+
+    def chat_completion(self, body: Dict[str, Any]) -> Tuple[float, Dict[str, Any]]:
+        """
+        chat.completions 요청에 대한 (지연 시간(초), 응답 JSON)
+        """
+        pieces = self.answer_pieces(body)
+        content = ''.join(pieces)
+        messages = body.get('messages') or []
+        prompt_tokens = sum(_estimate_tokens(m.get('content') or '') + 4 for m in messages)
+        response = {
+            'id': f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model') or 'fake',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(pieces),
+                'total_tokens': prompt_tokens + len(pieces),
+                'prompt_tokens_details': {'cached_tokens': self._cached_tokens(messages)}
+            }
+        }
+        return self.latency + self.token_latency * len(pieces), response
+
+    def chat_chunks(self, body: Dict[str, Any]) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        스트리밍 chat.completions 요청에 대한 (청크 전 지연 시간(초), 청크 JSON) 목록
+
+        stream_options.include_usage가 있으면 마지막에 usage만 담은 청크를 추가합니다.
+        """
+        _, response = self.chat_completion(body)
+        base = {'id': response['id'], 'object': 'chat.completion.chunk',
+                'created': response['created'], 'model': response['model']}
+        chunks = [(self.latency, dict(base, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''},
+                                                       'finish_reason': None}]))]
+        for piece in self.answer_pieces(body):
+            chunks.append((self.token_latency, dict(base, choices=[{'index': 0, 'delta': {'content': piece},
+                                                                    'finish_reason': None}])))
+        chunks.append((0.0, dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            chunks.append((0.0, dict(base, choices=[], usage=response['usage'])))
+        return chunks
+
+    def embed_vector(self, text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+        """단어마다 해시로 정한 차원 두 곳에 +-1을 더한 뒤 정규화한 벡터"""
+        vector = np.zeros(dimensions, dtype=np.float32)
+        for word in _WORD_PATTERN.findall(text.lower()):
+            h = _digest(word)
+            for offset in (0, 8):
+                index = int.from_bytes(h[offset:offset + 4], 'little') % dimensions
+                vector[index] += 1.0 if h[offset + 4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            vector[int.from_bytes(_digest(text)[:4], 'little') % dimensions] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embeddings(self, body: Dict[str, Any]) -> Tuple[float, Dict[str, Any]]:
+        """embeddings 요청에 대한 (지연 시간(초), 응답 JSON)"""
+        texts = body.get('input')
+        texts = [texts] if isinstance(texts, str) else list(texts or [])
+        dimensions = body.get('dimensions') or EMBEDDING_DIMENSIONS
+        tokens = sum(_estimate_tokens(t) for t in texts)
+        response = {
+            'object': 'list',
+            'data': [{'object': 'embedding', 'index': i, 'embedding': self.embed_vector(t, dimensions)}
+                     for i, t in enumerate(texts)],
+            'model': body.get('model') or EMBEDDING_MODEL,
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        }
+        return self.embed_latency, response
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'requests': self.requests, 'rate_limited': self.rate_limited, 'errors': self.errors}
+
+
+def _status_error(status: int, message: str) -> openai.APIStatusError:
+    """모의 오류를 OpenAI SDK와 같은 예외(RateLimitError, InternalServerError)로 변환"""
+    request = httpx.Request('POST', 'http://fake-llm.local/v1')
+    response = httpx.Response(status, request=request)
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return error_class(message, response=response, body={'error': {'message': message}})
+
+
+class FakeProvider(LLMProvider):
+    """
+    FakeLLM을 프로세스 안에서 호출하는 모의 제공자
+
+    응답은 OpenAI SDK 응답 객체로 변환해 반환합니다. 거부된 요청은 SDK 클라이언트처럼
+    max_retries번까지 지수 백오프로 재시도하고, 그래도 거부되면 SDK와 같은 예외를 발생시킵니다.
+    """
+
+    name = 'fake'
+
+    def __init__(self, fake: Optional[FakeLLM] = None, max_retries: int = LLM_MAX_RETRIES):
+        self.fake = fake or FakeLLM.from_env()
+        self.max_retries = max_retries
+
+    def is_configured(self) -> bool:
+        return True
+
+    def _admit(self, attempt: int) -> float:
+        """요청이 허용되면 0, 거부되면 재시도 전 대기 시간(초) (재시도 횟수를 다 쓰면 예외)"""
+        rejected = self.fake.admit()
+        if not rejected:
+            return 0.0
+        if attempt >= self.max_retries:
+            raise _status_error(*rejected)
+        return min(RETRY_INITIAL_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+
+    def _wait_admitted(self):
+        for attempt in range(self.max_retries + 1):
+            delay = self._admit(attempt)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    async def _wait_admitted_async(self):
+        for attempt in range(self.max_retries + 1):
+            delay = self._admit(attempt)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def chat(self, **kwargs):
+        self._wait_admitted()
+        if kwargs.get('stream'):
+            return self._stream(self.fake.chat_chunks(kwargs))
+        delay, response = self.fake.chat_completion(kwargs)
+        time.sleep(delay)
+        return ChatCompletion.model_validate(response)
+
+    @staticmethod
+    def _stream(chunks):
+        for delay, chunk in chunks:
+            time.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    async def chat_async(self, **kwargs):
+        await self._wait_admitted_async()
+        if kwargs.get('stream'):
+            return self._stream_async(self.fake.chat_chunks(kwargs))
+        delay, response = self.fake.chat_completion(kwargs)
+        await asyncio.sleep(delay)
+        return ChatCompletion.model_validate(response)
+
+    @staticmethod
+    async def _stream_async(chunks):
+        for delay, chunk in chunks:
+            await asyncio.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    def embed(self, texts, model=EMBEDDING_MODEL):
+        self._wait_admitted()
+        delay, response = self.fake.embeddings({'input': texts, 'model': model})
+        time.sleep(delay)
+        return [item.embedding for item in CreateEmbeddingResponse.model_validate(response).data]
+
+    async def embed_async(self, texts, model=EMBEDDING_MODEL):
+        await self._wait_admitted_async()
+        delay, response = self.fake.embeddings({'input': texts, 'model': model})
+        await asyncio.sleep(delay)
+        return [item.embedding for item in CreateEmbeddingResponse.model_validate(response).data]
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    """환경 변수(LLM_PROVIDER, LLM_BASE_URL)로 선택한 현재 제공자 (최초 호출 시 1회 생성)"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            base_url = os.environ.get("LLM_BASE_URL") or None
+            if os.environ.get("LLM_PROVIDER", "openai") == 'fake':
+                _provider = FakeProvider()
+            else:
+                _provider = OpenAIProvider(base_url=base_url)
+            print(f"[DEBUG] LLM 제공자: {_provider.name}" + (f" ({base_url})" if base_url else ''))
+        return _provider
+
+
+def set_provider(provider: LLMProvider):
+    """현재 제공자 교체 (이후 모든 LLM/임베딩 호출이 이 제공자를 사용)"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,202 @@
+"""
+모델 라우팅 모듈
+
+질문의 복잡도(로컬 휴리스틱)와 검색 신뢰도(distances)로 답변 경로를 고릅니다.
+    - template: "X 함수는 어느 파일에 있어?"처럼 검색된 청크의 메타데이터만으로 답할 수 있는 위치 질문
+                LLM을 호출하지 않고 메타데이터로 답변을 만듭니다.
+    - small: 검색 신뢰도가 높은 단순 질문 (작고 빠른 모델, 짧은 출력)
+    - strong: 이유/비교/설계/흐름 등 추론이 필요한 질문, 넓은 질문, 검색 신뢰도가 낮은 질문 (gpt-4o)
+
+경로별 요청 수, 지연 시간, 토큰 수, 예상 비용은 route_stats에 집계되어 /metrics로 확인할 수 있습니다.
+
+주요 구성:
+    - route_question: 질문과 검색 결과로 경로 결정
+    - template_answer: 메타데이터 기반 위치 답변 생성
+    - retrieval_similarity: distances(제곱 L2)를 코사인 유사도로 변환
+    - RouteStats / route_stats: 경로별 지연/비용 집계
+"""
+
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+# ----------------- 상수 정의 -----------------
+STRONG_MODEL = "gpt-4o"
+SMALL_MODEL = "gpt-4o-mini"
+STRONG_MAX_TOKENS = 2048
+SMALL_MAX_TOKENS = 700
+# 1위 검색 결과의 코사인 유사도가 이 값 이상이면 검색 신뢰도가 높다고 판단
+HIGH_CONFIDENCE_SIMILARITY = 0.5
+# 템플릿 답변은 질문의 심볼이 메타데이터와 정확히 일치하고 유사도가 이 값 이상일 때만 사용
+TEMPLATE_MIN_SIMILARITY = 0.35
+# 이보다 긴 질문은 추론이 필요한 질문으로 간주
+SIMPLE_QUESTION_MAX_CHARS = 80
+# 100만 토큰당 USD (입력, 캐시된 입력, 출력)
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+}
+LOOKUP_PATTERN = re.compile(
+    r'(어디(에|서)? ?(있|정의|선언|구현)|어느 파일|무슨 파일|어떤 파일|정의된 (곳|파일|위치)|위치(가|는|를)?|몇 번째 줄|몇 줄|'
+    r'which file|where is|where are|defined in|located)',
+    re.IGNORECASE
+)
+COMPLEX_PATTERN = re.compile(
+    r'(왜|이유|비교|차이|장단점|설계|아키텍처|리팩터|리팩토링|개선|최적화|성능|버그|문제점|보안|흐름|동작 원리|어떻게 동작|'
+    r'어떻게 작동|분석|예시|단계별|'
+    r'why|compare|difference|trade-?off|design|refactor|improve|optimi[sz]e|performance|bug|security|walk me through)',
+    re.IGNORECASE
+)
+
+
+def retrieval_similarity(distance: Optional[float]) -> Optional[float]:
+    """
+    검색 거리(정규화된 임베딩의 제곱 L2 거리)를 코사인 유사도로 변환
+
+    정규화된 벡터에서 ||a - b||^2 = 2 - 2cos(a, b) 이므로 cos = 1 - distance / 2 입니다.
+    """
+    if distance is None:
+        return None
+    return 1.0 - float(distance) / 2.0
+
+
+def _route(name: str, reason: str, similarity: Optional[float]) -> Dict[str, Any]:
+    model, max_tokens = {
+        'template': (None, 0),
+        'small': (SMALL_MODEL, SMALL_MAX_TOKENS),
+        'strong': (STRONG_MODEL, STRONG_MAX_TOKENS),
+    }[name]
+    return {
+        'route': name,
+        'model': model,
+        'max_tokens': max_tokens,
+        'reason': reason,
+        'similarity': round(similarity, 4) if similarity is not None else None
+    }
+
+
+def route_question(message: str, scope: Dict[str, List[str]], results: Dict[str, Any],
+                   broad: bool = False, follow_up: bool = False, full_file: bool = False) -> Dict[str, Any]:
+    """
+    질문의 답변 경로 결정
+
+    Args:
+        message (str): 질문
+        scope (Dict[str, List[str]]): extract_scope_from_question 결과
+        results (Dict[str, Any]): 재정렬된 검색 결과 (collection.query 형식)
+        broad (bool): 프로젝트 전반을 묻는 넓은 질문인지
+        follow_up (bool): 이전 대화를 이어가는 질문인지
+        full_file (bool): 파일 전체 코드를 요구하는 질문인지
+
+    Returns:
+        Dict[str, Any]: {'route', 'model', 'max_tokens', 'reason', 'similarity'}
+    """
+    distances = (results.get('distances') or [[]])[0]
+    similarity = retrieval_similarity(distances[0]) if distances else None
+
+    if broad or follow_up or full_file:
+        reason = 'broad' if broad else 'follow_up' if follow_up else 'full_file'
+        return _route('strong', reason, similarity)
+    if COMPLEX_PATTERN.search(message) or len(message) > SIMPLE_QUESTION_MAX_CHARS:
+        return _route('strong', 'complex', similarity)
+
+    if LOOKUP_PATTERN.search(message):
+        if similarity is not None and similarity >= TEMPLATE_MIN_SIMILARITY and find_symbol_hits(scope, results):
+            return _route('template', 'symbol_lookup', similarity)
+        return _route('small', 'lookup', similarity)
+    if similarity is not None and similarity >= HIGH_CONFIDENCE_SIMILARITY:
+        return _route('small', 'high_confidence', similarity)
+    return _route('strong', 'low_confidence', similarity)
+
+
+def find_symbol_hits(scope: Dict[str, List[str]], results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """질문에서 찾은 함수/클래스/파일 이름과 메타데이터가 정확히 일치하는 검색 결과 메타데이터"""
+    functions = set(scope.get('function') or [])
+    classes = set(scope.get('class') or [])
+    files = set(scope.get('file') or [])
+    if not (functions or classes or files):
+        return []
+    hits = []
+    for meta in (results.get('metadatas') or [[]])[0]:
+        names = {n.strip() for n in (meta.get('function_name') or '').split(',') if n.strip()}
+        class_names = {n.strip() for n in (meta.get('class_name') or '').split(',') if n.strip()}
+        if names & functions or class_names & classes or meta.get('file_name') in files or meta.get('path') in files:
+            hits.append(meta)
+    return hits
+
+
+def template_answer(scope: Dict[str, List[str]], results: Dict[str, Any]) -> str:
+    """위치 질문에 대한 메타데이터 기반 답변 (파일, 라인, 역할 태그)"""
+    lines = []
+    for meta in find_symbol_hits(scope, results):
+        if meta.get('function_name'):
+            target = f"`{meta['function_name']}` 함수"
+        elif meta.get('class_name'):
+            target = f"`{meta['class_name']}` 클래스"
+        else:
+            target = f"`{meta.get('file_name') or meta.get('path')}` 파일"
+        location = f"`{meta.get('path')}`"
+        if meta.get('start_line') and meta.get('end_line') and meta['start_line'] > 0:
+            location += f" {meta['start_line']}~{meta['end_line']}번째 줄"
+        line = f"- {target}: {location}"
+        if meta.get('class_name') and meta.get('function_name'):
+            line += f" (`{meta['class_name']}` 클래스)"
+        if meta.get('role_tag'):
+            line += f" - 역할: {meta['role_tag']}"
+        if line not in lines:
+            lines.append(line)
+    return "질문하신 코드의 위치입니다 (분석된 코드 메타데이터 기준).\n\n" + "\n".join(lines)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """토큰 수로 계산한 예상 비용(USD)"""
+    if model not in MODEL_PRICES:
+        return 0.0
+    price_in, price_cached, price_out = MODEL_PRICES[model]
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * price_in + cached_tokens * price_cached + completion_tokens * price_out) / 1_000_000
+
+
+class RouteStats:
+    """경로별 요청 수, 평균 지연 시간, 토큰 수, 예상 비용 집계"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, decision: Dict[str, Any], latency_ms: float, usage: Optional[Dict[str, int]] = None) -> float:
+        """요청 하나의 결과를 집계하고 로그로 남긴 뒤 예상 비용을 반환"""
+        usage = usage or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        cost = estimate_cost(decision['model'], prompt_tokens, usage.get('cached_tokens', 0), completion_tokens)
+        with self._lock:
+            stats = self._routes.setdefault(decision['route'], {
+                'requests': 0, 'latency_ms': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0
+            })
+            stats['requests'] += 1
+            stats['latency_ms'] += latency_ms
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['cost_usd'] += cost
+        print(f"[DEBUG] 라우팅: route={decision['route']} model={decision['model'] or '-'} "
+              f"reason={decision['reason']} 유사도={decision['similarity']} "
+              f"지연={latency_ms:.0f}ms 비용=${cost:.5f}")
+        return cost
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                route: {
+                    'requests': int(s['requests']),
+                    'avg_latency_ms': round(s['latency_ms'] / s['requests'], 1),
+                    'prompt_tokens': int(s['prompt_tokens']),
+                    'completion_tokens': int(s['completion_tokens']),
+                    'cost_usd': round(s['cost_usd'], 6),
+                    'avg_cost_usd': round(s['cost_usd'] / s['requests'], 6)
+                }
+                for route, s in self._routes.items()
+            }
+
+
+route_stats = RouteStats()
@@ -0,0 +1,226 @@
+"""
+검색 결과 재정렬 모듈
+
+벡터 검색으로 넉넉히 가져온 후보 청크를 MMR(Maximal Marginal Relevance)로 재정렬하여
+비슷한 청크가 겹치지 않게 고르고, 같은 파일에서 겹치거나 이어지는 청크는 하나의 구간으로 합칩니다.
+split_by_tokens의 overlap으로 생기는 중복 텍스트를 줄여 프롬프트 토큰당 더 많은 코드를 담기 위한 단계입니다.
+
+주요 함수:
+    - mmr_order: 후보를 MMR 점수 순서로 정렬
+    - merge_adjacent_chunks: 같은 파일의 겹치는/인접한 청크를 하나로 병합
+    - rerank_results: 검색 결과(collection.query 형식)에 MMR + 병합을 적용
+    - role_match_scores: 구간별 역할 태그 임베딩과 질문 임베딩의 코사인 유사도 계산
+"""
+
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from github_analyzer import get_encoder
+from context_packer import count_tokens
+
+# ----------------- 상수 정의 -----------------
+MMR_LAMBDA = 0.7  # 1에 가까울수록 질문 유사도, 0에 가까울수록 다양성 우선
+CANDIDATE_MULTIPLIER = 4  # 최종 개수의 몇 배를 후보로 가져올지
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_order(query_embedding: List[float], embeddings: List[List[float]], lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    후보 전체를 MMR 점수 순서로 정렬한 인덱스 목록 반환
+
+    Args:
+        query_embedding (List[float]): 질문 임베딩
+        embeddings (List[List[float]]): 후보 청크 임베딩
+        lambda_mult (float): 유사도/다양성 가중치
+
+    Returns:
+        List[int]: 선택 순서대로 정렬된 후보 인덱스
+    """
+    if not embeddings:
+        return []
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    docs = _normalize(np.asarray(embeddings, dtype=np.float32))
+    relevance = docs @ query
+    pairwise = docs @ docs.T
+    selected = [int(np.argmax(relevance))]
+    remaining = [i for i in range(len(docs)) if i != selected[0]]
+    while remaining:
+        redundancy = pairwise[np.ix_(remaining, selected)].max(axis=1)
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def _segment_key(meta: Dict[str, Any]):
+    # 같은 원본(파일 전체 또는 같은 함수/클래스)을 split_by_tokens로 나눈 창들은 같은 키를 가짐
+    return (meta.get('path'), meta.get('function_name'), meta.get('class_name'), meta.get('start_line'))
+
+
+def _stitch(first: str, second: str, overlap_tokens: int) -> str:
+    """토큰 창 두 개를 겹치는 토큰만큼 잘라 이어붙임"""
+    if overlap_tokens <= 0:
+        return first + second
+    enc = get_encoder()
+    return first + enc.decode(enc.encode(second)[overlap_tokens:])
+
+
+def _merge_pair(a: Dict[str, Any], b: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """두 청크가 겹치거나 인접하면 병합한 청크를, 아니면 None을 반환"""
+    ma, mb = a['metadata'], b['metadata']
+    if ma.get('path') != mb.get('path'):
+        return None
+
+    # 1. 같은 원본의 토큰 창: token_start/token_end로 겹침 판단
+    # (마크다운은 섹션별로 따로 나눠 토큰 위치가 섹션 기준이므로 제외)
+    same_segment = _segment_key(ma) == _segment_key(mb) and ma.get('file_type') != 'md'
+    if same_segment and ma.get('token_start', -1) >= 0 and mb.get('token_start', -1) >= 0:
+        first, second = (a, b) if ma['token_start'] <= mb['token_start'] else (b, a)
+        mf, ms = first['metadata'], second['metadata']
+        if ms['token_start'] > mf['token_end']:
+            return None
+        meta = dict(mf)
+        if ms['token_end'] <= mf['token_end']:
+            document = first['document']  # 앞 창이 뒤 창을 완전히 포함
+        else:
+            overlap = mf['token_end'] - ms['token_start']
+            document = _stitch(first['document'], second['document'], overlap)
+            # overlap은 청크 분할용(cl100k) 토큰 수라 답변 모델 기준 token_count는 병합한 구간으로 다시 계산
+            if 'token_count' in mf:
+                meta['token_count'] = count_tokens(document)
+        meta['token_end'] = max(mf['token_end'], ms['token_end'])
+    else:
+        # 2. 서로 다른 함수/클래스: 라인 범위가 겹치거나 바로 이어지면 병합
+        if ma.get('start_line', -1) <= 0 or mb.get('start_line', -1) <= 0:
+            return None
+        first, second = (a, b) if ma['start_line'] <= mb['start_line'] else (b, a)
+        mf, ms = first['metadata'], second['metadata']
+        if ms['start_line'] > mf['end_line'] + 1:
+            return None
+        meta = dict(mf)
+        if ms['end_line'] <= mf['end_line']:
+            document = first['document']  # 앞 구간이 뒤 구간을 완전히 포함
+        else:
+            document = first['document'] + '\n' + second['document']
+            if 'token_count' in mf and 'token_count' in ms:
+                meta['token_count'] = mf['token_count'] + ms['token_count'] + count_tokens('\n')
+        meta['end_line'] = max(mf['end_line'], ms['end_line'])
+        names = [n for n in (mf.get('function_name'), ms.get('function_name')) if n]
+        meta['function_name'] = ', '.join(dict.fromkeys(names))
+        classes = [n for n in (mf.get('class_name'), ms.get('class_name')) if n]
+        meta['class_name'] = ', '.join(dict.fromkeys(classes))
+        meta['token_start'] = meta['token_end'] = -1
+    roles = [r for r in (mf.get('role_tag'), ms.get('role_tag')) if r]
+    meta['role_tag'] = ' / '.join(dict.fromkeys(roles))
+    distances = [d for d in (first['distance'], second['distance']) if d is not None]
+    return {
+        'ids': first['ids'] + second['ids'],
+        'document': document,
+        'metadata': meta,
+        'distance': min(distances) if distances else None,
+    }
+
+
+def merge_adjacent_chunks(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    같은 파일에서 겹치거나 인접한 청크를 하나의 구간으로 병합 (입력 순서 유지)
+
+    병합된 구간은 병합된 청크 중 가장 앞(관련도가 가장 높은) 청크의 자리에 놓입니다.
+
+    Args:
+        hits (List[Dict[str, Any]]): {'ids', 'document', 'metadata', 'distance'} 형식의 청크 목록
+
+    Returns:
+        List[Dict[str, Any]]: 병합된 청크 목록
+    """
+    merged: List[Dict[str, Any]] = []
+    for hit in hits:
+        merged.append(hit)
+        position = len(merged) - 1
+        changed = True
+        # 병합 결과가 다른 청크와 다시 이어질 수 있으므로 더 이상 합쳐지지 않을 때까지 반복
+        while changed:
+            changed = False
+            for i, existing in enumerate(merged):
+                if i == position:
+                    continue
+                combined = _merge_pair(existing, merged[position])
+                if combined is not None:
+                    keep, drop = min(i, position), max(i, position)
+                    merged[keep] = combined
+                    del merged[drop]
+                    position = keep
+                    changed = True
+                    break
+    return merged
+
+
+def rerank_results(results: Dict[str, Any], query_embedding: List[float], k: int) -> Dict[str, Any]:
+    """
+    검색 결과에 MMR 재정렬과 인접 청크 병합을 적용하여 최대 k개의 구간을 반환
+
+    results에 embeddings가 없으면 재정렬 없이 병합만 적용합니다.
+    반환 형식은 collection.query와 같으며, 병합된 원래 청크 ID는 'chunk_ids'에 담깁니다.
+    """
+    ids = results['ids'][0]
+    if not ids:
+        results['chunk_ids'] = [[]]
+        return results
+    distances = (results.get('distances') or [[]])[0] or [None] * len(ids)
+    hits = [
+        {'ids': [doc_id], 'document': doc, 'metadata': meta, 'distance': dist}
+        for doc_id, doc, meta, dist in zip(ids, results['documents'][0], results['metadatas'][0], distances)
+    ]
+    embeddings = (results.get('embeddings') or [None])[0]
+    if embeddings is not None and len(embeddings) == len(hits):
+        order = mmr_order(query_embedding, [list(e) for e in embeddings])
+    else:
+        order = list(range(len(hits)))
+
+    # MMR 순서대로 후보를 늘려가며 병합 후 k개 구간이 채워질 때까지 선택
+    picked: List[Dict[str, Any]] = []
+    merged: List[Dict[str, Any]] = []
+    for idx in order:
+        picked.append(hits[idx])
+        merged = merge_adjacent_chunks(picked)
+        if len(merged) >= k:
+            break
+    merged = merged[:k]
+    print(f"[DEBUG] 재정렬: 후보 {len(hits)}개 -> 선택 {len(picked)}개 -> 병합 후 {len(merged)}개 구간")
+    return {
+        'ids': [[hit['ids'][0] for hit in merged]],
+        'chunk_ids': [[hit['ids'] for hit in merged]],
+        'documents': [[hit['document'] for hit in merged]],
+        'metadatas': [[hit['metadata'] for hit in merged]],
+        'distances': [[hit['distance'] for hit in merged]],
+    }
+
+
+def role_match_scores(role_index, chunk_ids: List[List[str]], query_embedding: List[float]) -> List[float]:
+    """
+    병합된 구간마다 포함된 청크들의 역할 태그 임베딩과 질문 임베딩의 최대 코사인 유사도를 반환
+
+    Args:
+        role_index (VectorIndex): 역할 태그 인덱스 (청크 ID -> 역할 태그 임베딩), 없으면 None
+        chunk_ids (List[List[str]]): rerank_results의 'chunk_ids'[0]
+        query_embedding (List[float]): 질문 임베딩
+
+    Returns:
+        List[float]: 구간별 유사도 (역할 태그가 없는 구간은 0.0)
+    """
+    flat_ids = list(dict.fromkeys(cid for ids in chunk_ids for cid in ids))
+    if role_index is None or not flat_ids:
+        return [0.0] * len(chunk_ids)
+    data = role_index.get(ids=flat_ids, include=['embeddings'])
+    if not len(data['ids']):
+        return [0.0] * len(chunk_ids)
+    vectors = _normalize(np.asarray(data['embeddings'], dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    similarity = dict(zip(data['ids'], (vectors @ query).tolist()))
+    return [max((similarity.get(cid, 0.0) for cid in ids), default=0.0) for ids in chunk_ids]
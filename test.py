@@ -1,13 +1,8 @@
-import openai
-import os
+from llm_client import get_provider
 
-api_key = os.environ.get("OPENAI_API_KEY")
-client = openai.OpenAI(api_key=api_key)
+provider = get_provider()
 try:
-    response = client.embeddings.create(
-        input="hello world",
-        model="text-embedding-3-small"
-    )
-    print("임베딩 성공:", response.data[0].embedding[:5])
+    embedding = provider.embed("hello world", model="text-embedding-3-small")[0]
+    print("임베딩 성공:", embedding[:5])
 except Exception as e:
-    print("임베딩 에러:", e)
\ No newline at end of file
+    print("임베딩 에러:", e)
@@ -0,0 +1,978 @@
+"""
+벡터 인덱스 백엔드 모듈
+
+세션별 코드 청크 임베딩을 저장하고 유사도 검색하는 인덱스 인터페이스와 구현을 제공합니다.
+검색 결과는 ChromaDB collection.query와 같은 형식(ids/documents/metadatas/distances)으로
+반환되므로, 호출하는 쪽은 어떤 백엔드를 쓰는지 신경 쓰지 않아도 됩니다.
+
+주요 클래스:
+    - VectorIndex: 인덱스 백엔드 인터페이스
+    - NumpyVectorIndex: 메모리 매핑된 NumPy 행렬 기반 완전 탐색 인덱스 (소/중형 저장소)
+    - ChromaVectorIndex: ChromaDB(HNSW) 컬렉션 래퍼 (대형 저장소)
+
+    - IndexLifecycleManager: 세션 인덱스의 TTL/LRU 제거와 재로드를 관리
+
+주요 함수:
+    - create_index: 청크 수에 따라 백엔드를 자동 선택하여 새 인덱스 생성
+    - open_index: 세션의 기존 인덱스 열기 (제거된 인덱스는 디스크에서 다시 로드)
+    - IndexLeases: 사용하는 동안 인덱스가 내려지지 않도록 대여하는 with 블록
+    - delete_index: 세션 인덱스 삭제
+"""
+
+import os
+import re
+import json
+import shutil
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, List, Dict, Any
+
+import numpy as np
+import chromadb
+
+# ----------------- 상수 정의 -----------------
+NUMPY_INDEX_MAX_CHUNKS = 50000  # 이 청크 수 이하이면 NumPy 완전 탐색 인덱스 사용
+INDEX_DIR = "./indexes"  # NumPy 인덱스 저장 경로
+NUMPY_INDEX_DTYPE = os.environ.get("NUMPY_INDEX_DTYPE", "float32")  # 검색 행렬 타입: float32, float16, int8
+NUMPY_INDEX_DIMENSIONS = int(os.environ.get("NUMPY_INDEX_DIMENSIONS", "0")) or None  # 검색 행렬 차원 축소 (None이면 전체)
+RESCORE_FACTOR = 4  # 압축 검색 시 n_results의 몇 배를 후보로 뽑아 정밀 재채점할지
+QUERY_BLOCK_ROWS = 8192  # 검색 시 한 번에 계산할 행 수 (메모리 사용량 제한)
+
+# 인덱스 수명 관리 설정
+INDEX_MEMORY_BUDGET_BYTES = int(os.environ.get("INDEX_MEMORY_BUDGET_MB", "512")) * 1024 * 1024  # 메모리 상주 인덱스 총량
+INDEX_DISK_BUDGET_BYTES = int(os.environ.get("INDEX_DISK_BUDGET_MB", "4096")) * 1024 * 1024  # 디스크 저장 인덱스 총량
+INDEX_IDLE_TTL_SECONDS = int(os.environ.get("INDEX_IDLE_TTL_SECONDS", "3600"))  # 이 시간 동안 안 쓰면 메모리에서 내림
+INDEX_DISK_TTL_SECONDS = int(os.environ.get("INDEX_DISK_TTL_SECONDS", str(7 * 24 * 3600)))  # 이 시간 동안 안 쓰면 디스크에서도 삭제
+INDEX_SWEEP_INTERVAL_SECONDS = int(os.environ.get("INDEX_SWEEP_INTERVAL_SECONDS", "60"))  # 백그라운드 점검 간격
+INDEX_KINDS = ('repo', 'files', 'roles')  # 세션별 인덱스 종류: 청크 인덱스, 파일 요약 인덱스, 역할 태그 인덱스
+# 세션 컬렉션 이름: "{kind}_{세션 UUID}" 또는 예전 GitHubRepositoryFetcher가 만든 "{세션 UUID}"
+SESSION_COLLECTION_PATTERN = re.compile(
+    r'^(?:(?:' + '|'.join(INDEX_KINDS) + r')_)?'
+    r'(?P<session_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$'
+)
+
+# ChromaDB 기본 클라이언트 (로컬)
+chroma_client = chromadb.Client()
+
+
+def index_name(session_id: str, kind: str = 'repo') -> str:
+    """세션 인덱스 이름 (kind: 'repo' 청크 인덱스, 'files' 파일 요약 인덱스, 'roles' 역할 태그 인덱스)"""
+    return f"{kind}_{session_id}"
+
+
+def _match_where(meta: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """
+    ChromaDB where 필터 문법($and, $or, $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte)을 메타데이터에 적용
+    """
+    for key, cond in where.items():
+        if key == '$and':
+            if not all(_match_where(meta, sub) for sub in cond):
+                return False
+        elif key == '$or':
+            if not any(_match_where(meta, sub) for sub in cond):
+                return False
+        else:
+            value = meta.get(key)
+            if not isinstance(cond, dict):
+                cond = {'$eq': cond}
+            for op, target in cond.items():
+                if op == '$eq' and value != target:
+                    return False
+                if op == '$ne' and value == target:
+                    return False
+                if op == '$in' and value not in target:
+                    return False
+                if op == '$nin' and value in target:
+                    return False
+                if op in ('$gt', '$gte', '$lt', '$lte'):
+                    if value is None:
+                        return False
+                    if op == '$gt' and not value > target:
+                        return False
+                    if op == '$gte' and not value >= target:
+                        return False
+                    if op == '$lt' and not value < target:
+                        return False
+                    if op == '$lte' and not value <= target:
+                        return False
+    return True
+
+
+class VectorIndex:
+    """
+    벡터 인덱스 백엔드 인터페이스
+
+    ChromaDB Collection과 같은 이름/형식의 메서드를 제공합니다.
+    """
+
+    name: str = ''
+    backend: str = ''
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 5,
+              where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def replace(self, delete_ids: List[str], ids: List[str], embeddings: List[List[float]], documents: List[str],
+                metadatas: List[Dict[str, Any]]):
+        """delete_ids 항목을 지우고 새 항목을 추가 (바뀐 파일의 청크 교체용, 같은 ID를 다시 써도 됨)"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def persist(self):
+        """디스크에 저장 (필요한 백엔드만 구현)"""
+        pass
+
+    def resident_bytes(self) -> int:
+        """메모리에 상주하는 대략적인 크기 (제거 예산 계산용)"""
+        raise NotImplementedError
+
+    def drop(self):
+        """인덱스 데이터를 완전히 삭제"""
+        raise NotImplementedError
+
+
+class ChromaVectorIndex(VectorIndex):
+    """
+    ChromaDB(HNSW) 컬렉션 래퍼
+
+    청크 수가 많은 대형 저장소용 백엔드입니다.
+    """
+
+    backend = 'chroma'
+
+    def __init__(self, name: str, create: bool = True):
+        self.name = name
+        if create:
+            self.collection = chroma_client.get_or_create_collection(name=name)
+        else:
+            self.collection = chroma_client.get_collection(name=name)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def query(self, query_embeddings, n_results=5, where=None, include=None):
+        kwargs = {'query_embeddings': query_embeddings, 'n_results': n_results}
+        if where:
+            kwargs['where'] = where
+        if include:
+            kwargs['include'] = include
+        return self.collection.query(**kwargs)
+
+    def get(self, ids=None, where=None, include=None):
+        kwargs = {}
+        if ids is not None:
+            kwargs['ids'] = ids
+        if where:
+            kwargs['where'] = where
+        if include:
+            kwargs['include'] = include
+        return self.collection.get(**kwargs)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def replace(self, delete_ids, ids, embeddings, documents, metadatas):
+        # 새 항목을 먼저 upsert한 뒤 남은 이전 항목만 지워, 교체 중에도 파일의 청크가 비지 않도록 함
+        if ids:
+            self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        new_ids = set(ids)
+        self.delete([doc_id for doc_id in delete_ids if doc_id not in new_ids])
+
+    def count(self):
+        return self.collection.count()
+
+    def resident_bytes(self):
+        # HNSW 그래프와 문서를 포함한 추정치 (ChromaDB는 크기 API를 제공하지 않음)
+        count = self.count()
+        if count == 0:
+            return 0
+        sample = self.collection.get(limit=1, include=['embeddings', 'documents'])
+        dim = len(sample['embeddings'][0])
+        doc_size = len(sample['documents'][0].encode('utf-8')) if sample['documents'] else 0
+        return count * (dim * 4 + doc_size + 256)
+
+    def drop(self):
+        try:
+            chroma_client.delete_collection(name=self.name)
+        except Exception as e:
+            print(f"[WARNING] ChromaDB 컬렉션 삭제 실패 ({self.name}): {e}")
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    메모리 매핑된 NumPy 행렬 기반 완전 탐색(brute-force) 인덱스
+
+    임베딩은 연속된 float32/float16 행렬(vectors.npy)로, 메타데이터는 같은 순서의
+    병렬 테이블(meta.json)로 저장합니다. 검색은 블록 단위 내적과 argpartition으로
+    정확한 top-k를 구하며, 인덱스 구축 비용이 없습니다.
+    거리는 ChromaDB 기본값과 같은 제곱 L2 거리입니다.
+
+    int8 스칼라 양자화(행별 스케일) 또는 차원 축소(dimensions)를 지정하면 검색은
+    압축된 행렬(search.npy)로 후보를 뽑고, 디스크의 원본 float32 행렬(vectors.npy)에서
+    후보 행만 읽어 정확한 거리로 재채점합니다.
+    """
+
+    backend = 'numpy'
+
+    def __init__(self, name: str, dtype: str = NUMPY_INDEX_DTYPE, dimensions: Optional[int] = NUMPY_INDEX_DIMENSIONS,
+                 base_dir: str = INDEX_DIR):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.dimensions = dimensions
+        # 압축 검색이면 원본은 float32로 따로 보관하고 재채점
+        self.rescore = self.dtype == np.int8 or dimensions is not None
+        self.path = os.path.join(base_dir, name)
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self._id_pos: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None  # (N, D) 원본 메모리 매핑 행렬
+        self._search: Optional[np.ndarray] = None  # (N, d) 검색용 행렬 (압축하지 않으면 _vectors와 동일)
+        self._scales: Optional[np.ndarray] = None  # (N,) int8 양자화 행별 스케일
+        self._norms: Optional[np.ndarray] = None  # (N,) 검색 행렬의 제곱 노름
+        self._pending: List[np.ndarray] = []  # 아직 행렬에 합쳐지지 않은 임베딩
+        self._lock = threading.RLock()
+
+    @classmethod
+    def exists(cls, name: str, base_dir: str = INDEX_DIR) -> bool:
+        return os.path.exists(os.path.join(base_dir, name, 'meta.json'))
+
+    @classmethod
+    def load(cls, name: str, base_dir: str = INDEX_DIR) -> "NumpyVectorIndex":
+        """디스크에 저장된 인덱스를 메모리 매핑으로 열기"""
+        path = os.path.join(base_dir, name)
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        index = cls(name, dtype=table.get('dtype', NUMPY_INDEX_DTYPE), dimensions=table.get('dimensions'),
+                    base_dir=base_dir)
+        index.ids = table['ids']
+        index.documents = table['documents']
+        index.metadatas = table['metadatas']
+        index._id_pos = {doc_id: i for i, doc_id in enumerate(index.ids)}
+        if index.ids:
+            index._open_matrices()
+        return index
+
+    def _open_matrices(self):
+        self._vectors = np.load(os.path.join(self.path, 'vectors.npy'), mmap_mode='r')
+        self._norms = np.load(os.path.join(self.path, 'norms.npy'))
+        if self.rescore:
+            self._search = np.load(os.path.join(self.path, 'search.npy'), mmap_mode='r')
+            if self.dtype == np.int8:
+                self._scales = np.load(os.path.join(self.path, 'scales.npy'))
+        else:
+            self._search = self._vectors
+
+    def _transform_queries(self, queries: np.ndarray) -> np.ndarray:
+        """질의 벡터를 검색 행렬과 같은 공간(차원 축소 + 재정규화)으로 변환"""
+        if self.dimensions is None:
+            return queries
+        queries = queries[:, :self.dimensions]
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        return queries / np.maximum(norms, 1e-12)
+
+    def _compress(self, matrix: np.ndarray):
+        """
+        원본 행렬을 검색 행렬로 압축
+
+        Returns:
+            Tuple[np.ndarray, Optional[np.ndarray]]: (검색 행렬, int8 행별 스케일)
+        """
+        search = self._transform_queries(matrix.astype(np.float32))
+        if self.dtype != np.int8:
+            return np.ascontiguousarray(search, dtype=self.dtype), None
+        scales = np.abs(search).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(search / scales[:, None]), -127, 127).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+    def _search_block(self, start: int, stop: int) -> np.ndarray:
+        """검색 행렬의 일부를 float32로 복원"""
+        block = np.asarray(self._search[start:stop], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:stop, None]
+        return block
+
+    def memory_bytes(self) -> int:
+        """검색할 때마다 읽는 상주 데이터 크기 (검색 행렬 + 노름 + 스케일)"""
+        total = 0
+        for arr in (self._search, self._norms, self._scales):
+            if arr is not None:
+                total += arr.nbytes
+        return total
+
+    def resident_bytes(self):
+        # 검색 행렬 + 메타데이터 테이블 (문서/메타데이터 문자열의 대략적 크기)
+        with self._lock:
+            table = sum(len(doc) for doc in self.documents) + 256 * len(self.metadatas)
+            pending = sum(arr.nbytes for arr in self._pending)
+        return self.memory_bytes() + table + pending
+
+    def disk_bytes(self) -> int:
+        """디스크에 저장된 인덱스 파일 크기"""
+        if not os.path.isdir(self.path):
+            return 0
+        return sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path))
+
+    def add(self, ids, embeddings, documents, metadatas):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._id_pos:
+                    raise ValueError(f"이미 존재하는 청크 ID입니다: {doc_id}")
+                self._id_pos[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self._pending.append(np.asarray(embeddings, dtype=np.float32 if self.rescore else self.dtype))
+
+    def _materialize(self):
+        """대기 중인 임베딩을 행렬에 합치고 디스크에 기록한 뒤 메모리 매핑으로 다시 연다"""
+        with self._lock:
+            if not self._pending:
+                return
+            parts = ([np.asarray(self._vectors)] if self._vectors is not None else []) + self._pending
+            matrix = np.ascontiguousarray(np.concatenate(parts, axis=0), dtype=np.float32 if self.rescore else self.dtype)
+            self._pending = []
+            self._write(matrix)
+
+    def _write(self, matrix: np.ndarray):
+        os.makedirs(self.path, exist_ok=True)
+        # 열려 있는 메모리 매핑을 닫은 뒤 덮어쓰기
+        self._vectors = self._search = self._scales = None
+        self._save_array('vectors.npy', matrix)
+        if self.rescore:
+            search, scales = self._compress(matrix)
+            self._save_array('search.npy', search)
+            if scales is not None:
+                self._save_array('scales.npy', scales)
+            restored = search.astype(np.float32) * (scales[:, None] if scales is not None else 1.0)
+        else:
+            restored = matrix.astype(np.float32)
+        self._save_array('norms.npy', np.einsum('ij,ij->i', restored, restored))
+        self._open_matrices()
+        self._write_table()
+
+    def _save_array(self, file_name: str, array: np.ndarray):
+        tmp_path = os.path.join(self.path, f"{file_name}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+
+    def _write_table(self):
+        tmp_path = os.path.join(self.path, 'meta.tmp.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'dtype': self.dtype.name,
+                'dimensions': self.dimensions,
+                'ids': self.ids,
+                'documents': self.documents,
+                'metadatas': self.metadatas
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def persist(self):
+        with self._lock:
+            self._materialize()
+            if not self.ids:
+                os.makedirs(self.path, exist_ok=True)
+                self._write_table()
+
+    def _filter_mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        return np.fromiter((_match_where(meta, where) for meta in self.metadatas), dtype=bool, count=len(self.metadatas))
+
+    def _top_k(self, queries: np.ndarray, k: int, mask: Optional[np.ndarray]):
+        """
+        검색 행렬에서 질의별 거리 상위 k개를 블록 단위로 계산
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (k, Q) 형태의 거리와 행 번호 (거리 오름차순)
+        """
+        total = self._search.shape[0]
+        n_queries = queries.shape[0]
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        best_dist = np.empty((0, n_queries), dtype=np.float32)
+        best_idx = np.empty((0, n_queries), dtype=np.int64)
+        # 블록 단위로 거리 계산 후 블록별 top-k만 후보로 유지
+        for start in range(0, total, QUERY_BLOCK_ROWS):
+            block = self._search_block(start, start + QUERY_BLOCK_ROWS)
+            stop = start + block.shape[0]
+            dist = self._norms[start:stop, None] + q_norms[None, :] - 2.0 * (block @ queries.T)
+            if mask is not None:
+                dist[~mask[start:stop]] = np.inf
+            idx = np.broadcast_to(np.arange(start, stop)[:, None], dist.shape)
+            if dist.shape[0] > k:
+                top = np.argpartition(dist, k - 1, axis=0)[:k]
+                dist = np.take_along_axis(dist, top, axis=0)
+                idx = np.take_along_axis(idx, top, axis=0)
+            best_dist = np.concatenate([best_dist, dist], axis=0)
+            best_idx = np.concatenate([best_idx, idx], axis=0)
+            if best_dist.shape[0] > k:
+                top = np.argpartition(best_dist, k - 1, axis=0)[:k]
+                best_dist = np.take_along_axis(best_dist, top, axis=0)
+                best_idx = np.take_along_axis(best_idx, top, axis=0)
+        order = np.argsort(best_dist, axis=0)
+        return np.take_along_axis(best_dist, order, axis=0), np.take_along_axis(best_idx, order, axis=0)
+
+    def _rescore(self, query: np.ndarray, positions: np.ndarray, k: int):
+        """후보 행만 원본 float32 행렬에서 읽어 정확한 거리로 다시 정렬"""
+        positions = np.sort(positions)
+        rows = np.asarray(self._vectors[positions], dtype=np.float32)
+        diff = rows - query[None, :]
+        dist = np.einsum('ij,ij->i', diff, diff)
+        order = np.argsort(dist)[:k]
+        return dist[order], positions[order]
+
+    def query(self, query_embeddings, n_results=5, where=None, include=None):
+        include = include or ['documents', 'metadatas', 'distances']
+        with self._lock:
+            self._materialize()
+            mask = self._filter_mask(where)
+            queries = np.asarray(query_embeddings, dtype=np.float32)
+            n_queries = queries.shape[0]
+            total = 0 if self._search is None else self._search.shape[0]
+            candidates = int(total if mask is None else mask.sum())
+            k = min(n_results, candidates)
+            result = {'ids': [[] for _ in range(n_queries)]}
+            for key in ('documents', 'metadatas', 'distances', 'embeddings'):
+                if key in include:
+                    result[key] = [[] for _ in range(n_queries)]
+            if k == 0:
+                return result
+
+            if self.rescore:
+                # 압축 행렬로 후보를 넉넉히 뽑은 뒤 원본 벡터로 재채점
+                k_candidates = min(k * RESCORE_FACTOR, candidates)
+                cand_dist, cand_idx = self._top_k(self._transform_queries(queries), k_candidates, mask)
+                hits = []
+                for q in range(n_queries):
+                    valid = np.isfinite(cand_dist[:, q])
+                    hits.append(self._rescore(queries[q], cand_idx[valid, q], k))
+            else:
+                best_dist, best_idx = self._top_k(queries, k, mask)
+                hits = [(best_dist[:, q], best_idx[:, q]) for q in range(n_queries)]
+
+            for q, (dists, positions) in enumerate(hits):
+                for pos, dist in zip(positions, dists):
+                    if not np.isfinite(dist):
+                        continue
+                    pos = int(pos)
+                    result['ids'][q].append(self.ids[pos])
+                    if 'documents' in result:
+                        result['documents'][q].append(self.documents[pos])
+                    if 'metadatas' in result:
+                        result['metadatas'][q].append(self.metadatas[pos])
+                    if 'distances' in result:
+                        result['distances'][q].append(max(float(dist), 0.0))
+                    if 'embeddings' in result:
+                        result['embeddings'][q].append(np.asarray(self._vectors[pos], dtype=np.float32).tolist())
+            return result
+
+    def get(self, ids=None, where=None, include=None):
+        include = include or ['documents', 'metadatas']
+        with self._lock:
+            self._materialize()
+            if ids is not None:
+                positions = [self._id_pos[doc_id] for doc_id in ids if doc_id in self._id_pos]
+            else:
+                positions = list(range(len(self.ids)))
+            if where:
+                positions = [pos for pos in positions if _match_where(self.metadatas[pos], where)]
+            result = {'ids': [self.ids[pos] for pos in positions]}
+            if 'documents' in include:
+                result['documents'] = [self.documents[pos] for pos in positions]
+            if 'metadatas' in include:
+                result['metadatas'] = [self.metadatas[pos] for pos in positions]
+            if 'embeddings' in include:
+                result['embeddings'] = [np.asarray(self._vectors[pos], dtype=np.float32).tolist() for pos in positions]
+            return result
+
+    def delete(self, ids):
+        with self._lock:
+            self._materialize()
+            remove = {self._id_pos[doc_id] for doc_id in ids if doc_id in self._id_pos}
+            if not remove:
+                return
+            keep = [pos for pos in range(len(self.ids)) if pos not in remove]
+            matrix = np.asarray(self._vectors)[keep] if keep else np.empty((0, self._vectors.shape[1]), dtype=self._vectors.dtype)
+            self.ids = [self.ids[pos] for pos in keep]
+            self.documents = [self.documents[pos] for pos in keep]
+            self.metadatas = [self.metadatas[pos] for pos in keep]
+            self._id_pos = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self._write(np.ascontiguousarray(matrix))
+
+    def replace(self, delete_ids, ids, embeddings, documents, metadatas):
+        # 삭제와 추가를 잠금 안에서 한 번의 행렬 쓰기로 처리 - 검색은 교체 전 또는 후 상태만 봄
+        with self._lock:
+            self._materialize()
+            remove = {self._id_pos[doc_id] for doc_id in delete_ids if doc_id in self._id_pos}
+            keep = [pos for pos in range(len(self.ids)) if pos not in remove]
+            kept_ids = [self.ids[pos] for pos in keep]
+            duplicates = set(kept_ids) & set(ids)
+            if duplicates:
+                raise ValueError(f"이미 존재하는 청크 ID입니다: {sorted(duplicates)[:3]}")
+            parts = []
+            if keep:
+                parts.append(np.asarray(self._vectors)[keep])
+            if ids:
+                parts.append(np.asarray(embeddings, dtype=np.float32 if self.rescore else self.dtype))
+            self.ids = kept_ids + list(ids)
+            self.documents = [self.documents[pos] for pos in keep] + list(documents)
+            self.metadatas = [self.metadatas[pos] for pos in keep] + list(metadatas)
+            self._id_pos = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            if parts:
+                matrix = np.concatenate(parts, axis=0).astype(np.float32 if self.rescore else self.dtype, copy=False)
+                self._write(np.ascontiguousarray(matrix))
+            else:
+                self._vectors = self._search = self._scales = self._norms = None
+                os.makedirs(self.path, exist_ok=True)
+                self._write_table()
+
+    def count(self):
+        return len(self.ids)
+
+    def drop(self):
+        with self._lock:
+            self._vectors = self._search = self._scales = None
+            self._pending = []
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _chroma_collection_exists(name: str) -> bool:
+    try:
+        return name in [col.name for col in chroma_client.list_collections()]
+    except Exception as e:
+        print(f"[WARNING] ChromaDB 컬렉션 목록 조회 실패: {e}")
+        return False
+
+
+class IndexLifecycleManager:
+    """
+    세션 인덱스 수명 관리자
+
+    메모리에 올라온 인덱스를 LRU 순서로 추적하고, 다음 규칙으로 제거합니다.
+        - 마지막 사용 후 INDEX_IDLE_TTL_SECONDS가 지나면 메모리에서 내림
+        - 메모리 상주 총량이 예산을 넘으면 가장 오래 안 쓴 인덱스부터 내림
+        - 디스크 저장본은 INDEX_DISK_TTL_SECONDS가 지나거나 디스크 예산을 넘으면 삭제
+    메모리에서 내린 인덱스는 디스크 저장본(NumPy 형식)이 남아 있어 다음 open 때 다시 로드됩니다.
+    ChromaDB 인덱스는 내리기 전에 NumPy 형식으로 저장합니다.
+
+    점검(sweep)은 start()로 시작한 백그라운드 타이머에서 실행되며 요청 경로에서는 실행하지 않습니다.
+    acquire로 대여 중인 인덱스(검색/갱신 중)는 반납될 때까지 내리지 않습니다.
+    """
+
+    def __init__(self, memory_budget: int = INDEX_MEMORY_BUDGET_BYTES, disk_budget: int = INDEX_DISK_BUDGET_BYTES,
+                 idle_ttl: int = INDEX_IDLE_TTL_SECONDS, disk_ttl: int = INDEX_DISK_TTL_SECONDS,
+                 base_dir: str = INDEX_DIR):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.idle_ttl = idle_ttl
+        self.disk_ttl = disk_ttl
+        self.base_dir = base_dir
+        self._resident: "OrderedDict[str, VectorIndex]" = OrderedDict()  # 이름 -> 인덱스 (오래된 순)
+        self._last_access: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {}  # 이름 -> 대여 수 (0보다 크면 내리지 않음)
+        self._unloading: Dict[str, threading.Event] = {}  # 내리는 중인 인덱스 (끝나면 set)
+        self._lock = threading.RLock()
+        self._sweep_lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.session_exists: Optional[Callable[[str], bool]] = None  # 고아 컬렉션 판별용 (start에서 설정)
+        self.evictions = 0
+        self.reclaimed_bytes = 0
+
+    # ----------------- 등록/조회 -----------------
+    def register(self, name: str, index: VectorIndex):
+        with self._lock:
+            self._resident[name] = index
+            self._resident.move_to_end(name)
+            self._last_access[name] = time.time()
+
+    def _wait_unloading(self, name: str):
+        """내리는 중인 인덱스면 끝날 때까지 대기 (잠금 밖에서 호출)"""
+        while True:
+            with self._lock:
+                event = self._unloading.get(name)
+            if event is None:
+                return
+            event.wait()
+
+    def get(self, name: str, lease: bool = False) -> Optional[VectorIndex]:
+        """
+        메모리의 인덱스를 반환하거나, 제거된 인덱스를 디스크에서 다시 로드
+
+        lease가 True이면 인덱스를 대여(사용 중 표시)하며, 사용이 끝나면 release로 반납해야 합니다.
+        """
+        while True:
+            self._wait_unloading(name)
+            with self._lock:
+                if name in self._unloading:
+                    continue
+                index = self._resident.get(name)
+                if index is None:
+                    index = self._load(name)
+                    if index is None:
+                        return None
+                    self._resident[name] = index
+                self._resident.move_to_end(name)
+                self._last_access[name] = time.time()
+                if lease:
+                    self._in_use[name] = self._in_use.get(name, 0) + 1
+                return index
+
+    def acquire(self, name: str) -> Optional[VectorIndex]:
+        """인덱스를 대여 (반납 전까지 메모리에서 내리지 않음, 없으면 None)"""
+        return self.get(name, lease=True)
+
+    def release(self, name: str):
+        """acquire로 대여한 인덱스 반납"""
+        with self._lock:
+            count = self._in_use.get(name, 0) - 1
+            if count > 0:
+                self._in_use[name] = count
+            else:
+                self._in_use.pop(name, None)
+            self._last_access[name] = time.time()
+
+    def forget(self, name: str) -> Optional[VectorIndex]:
+        with self._lock:
+            self._last_access.pop(name, None)
+            return self._resident.pop(name, None)
+
+    def _load(self, name: str) -> Optional[VectorIndex]:
+        if NumpyVectorIndex.exists(name, self.base_dir):
+            index = NumpyVectorIndex.load(name, self.base_dir)
+            if index.count() > NUMPY_INDEX_MAX_CHUNKS:
+                index = self._import_to_chroma(index)
+            print(f"[DEBUG] 디스크에서 인덱스 재로드: {name} (백엔드: {index.backend}, 청크 수: {index.count()})")
+            return index
+        if _chroma_collection_exists(name):
+            return ChromaVectorIndex(name, create=False)
+        return None
+
+    @staticmethod
+    def _import_to_chroma(index: "NumpyVectorIndex") -> "ChromaVectorIndex":
+        """대형 인덱스는 디스크 저장본을 ChromaDB 컬렉션으로 다시 구축 (저장본은 유지)"""
+        chroma_index = ChromaVectorIndex(index.name)
+        data = index.get(include=['documents', 'metadatas', 'embeddings'])
+        batch = 5000
+        for start in range(0, len(data['ids']), batch):
+            chroma_index.add(
+                ids=data['ids'][start:start + batch],
+                embeddings=data['embeddings'][start:start + batch],
+                documents=data['documents'][start:start + batch],
+                metadatas=data['metadatas'][start:start + batch]
+            )
+        return chroma_index
+
+    # ----------------- 제거 -----------------
+    def unload(self, name: str, reason: str) -> bool:
+        """
+        인덱스를 메모리에서 내림 (디스크 저장본은 유지)
+
+        대여 중인 인덱스는 내리지 않고 False를 반환합니다.
+        내리는 동안(ChromaDB 내보내기 등) 같은 인덱스를 여는 요청은 끝날 때까지 기다렸다가 저장본에서 다시 로드합니다.
+        """
+        with self._lock:
+            index = self._resident.get(name)
+            if index is None or name in self._unloading:
+                return False
+            if self._in_use.get(name):
+                print(f"[DEBUG] 사용 중인 인덱스는 내리지 않음: {name} (사유: {reason})")
+                return False
+            self._unloading[name] = threading.Event()
+            last = self._last_access.get(name, time.time())
+        try:
+            reclaimed = index.resident_bytes()
+            if isinstance(index, ChromaVectorIndex):
+                if not NumpyVectorIndex.exists(name, self.base_dir):
+                    self._export_to_numpy(index)
+                index.drop()
+            else:
+                index.persist()
+            self._touch_disk(name, last)
+        finally:
+            with self._lock:
+                self._resident.pop(name, None)
+                self._unloading.pop(name).set()
+        with self._lock:
+            self.evictions += 1
+            self.reclaimed_bytes += reclaimed
+        print(f"[DEBUG] 인덱스 메모리 제거: {name} (사유: {reason}, 회수: {reclaimed:,} bytes)")
+        return True
+
+    def _export_to_numpy(self, index: "ChromaVectorIndex"):
+        data = index.get(include=['documents', 'metadatas', 'embeddings'])
+        numpy_index = NumpyVectorIndex(index.name, base_dir=self.base_dir)
+        if data['ids']:
+            numpy_index.add(ids=list(data['ids']), embeddings=data['embeddings'],
+                            documents=data['documents'], metadatas=data['metadatas'])
+        numpy_index.persist()
+
+    def _touch_disk(self, name: str, last: float):
+        # 마지막 사용 시각을 저장본 수정 시각으로 남겨 서버 재시작 후에도 LRU 순서 유지
+        meta_path = os.path.join(self.base_dir, name, 'meta.json')
+        if os.path.exists(meta_path):
+            os.utime(meta_path, (last, last))
+
+    def remove_from_disk(self, name: str, reason: str):
+        path = os.path.join(self.base_dir, name)
+        if not os.path.isdir(path):
+            return
+        reclaimed = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._last_access.pop(name, None)
+            self.evictions += 1
+            self.reclaimed_bytes += reclaimed
+        print(f"[DEBUG] 인덱스 디스크 삭제: {name} (사유: {reason}, 회수: {reclaimed:,} bytes)")
+
+    def cleanup_orphans(self):
+        """
+        세션이 없어진 세션 컬렉션 삭제
+
+        세션 인덱스 이름(repo_/files_/roles_ + 세션 ID) 또는 예전 GitHubRepositoryFetcher가 만든 세션 ID 이름의
+        컬렉션 중, 세션이 더 이상 존재하지 않고 메모리에 올라와 있지 않은 것만 삭제합니다.
+        세션 존재 여부를 알 수 없으면(session_exists 미설정) 아무것도 삭제하지 않습니다.
+        """
+        session_exists = self.session_exists
+        if session_exists is None:
+            return
+        try:
+            collections = chroma_client.list_collections()
+        except Exception as e:
+            print(f"[WARNING] ChromaDB 컬렉션 목록 조회 실패: {e}")
+            return
+        for col in collections:
+            match = SESSION_COLLECTION_PATTERN.match(col.name)
+            if not match or session_exists(match.group('session_id')):
+                continue
+            with self._lock:
+                if col.name in self._resident or col.name in self._unloading:
+                    continue
+            try:
+                reclaimed = ChromaVectorIndex(col.name, create=False).resident_bytes()
+                chroma_client.delete_collection(name=col.name)
+                with self._lock:
+                    self.evictions += 1
+                    self.reclaimed_bytes += reclaimed
+                print(f"[DEBUG] 고아 컬렉션 삭제: {col.name} (회수: {reclaimed:,} bytes)")
+            except Exception as e:
+                print(f"[WARNING] 고아 컬렉션 삭제 실패 ({col.name}): {e}")
+
+    def start(self, session_exists: Optional[Callable[[str], bool]] = None,
+              interval: int = INDEX_SWEEP_INTERVAL_SECONDS):
+        """
+        백그라운드 점검 타이머 시작 (시작 직후 한 번 점검, 이미 시작했으면 session_exists만 갱신)
+
+        Args:
+            session_exists (Optional[Callable[[str], bool]]): 세션 ID가 아직 존재하는지 (고아 컬렉션 판별용)
+            interval (int): 점검 간격(초)
+        """
+        if session_exists is not None:
+            self.session_exists = session_exists
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval,),
+                                             name="index-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sweep_loop(self, interval: int):
+        # 시작하자마자 한 번 점검(오래된 저장본/고아 컬렉션 정리)한 뒤 interval마다 반복
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[WARNING] 인덱스 점검 실패: {e}")
+            if self._stop.wait(interval):
+                return
+
+    def sweep(self):
+        """TTL/메모리 예산/디스크 예산을 점검하여 인덱스를 제거 (동시에 하나만 실행)"""
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def _sweep(self):
+        # 잠금 안에서는 대상만 고르고, 내보내기/삭제는 잠금 밖에서 실행하여 다른 인덱스 조회를 막지 않음
+        now = time.time()
+        with self._lock:
+            idle = [name for name in self._resident if now - self._last_access.get(name, now) > self.idle_ttl]
+        # 1. 유휴 TTL 초과 인덱스 메모리에서 내림
+        for name in idle:
+            self.unload(name, 'ttl')
+        # 2. 메모리 예산 초과 시 LRU 순서로 내림 (가장 최근 인덱스는 유지)
+        with self._lock:
+            candidates = list(self._resident.items())
+        sizes = {name: index.resident_bytes() for name, index in candidates}
+        total = sum(sizes.values())
+        for name, _ in candidates[:-1]:
+            if total <= self.memory_budget:
+                break
+            if self.unload(name, 'memory_budget'):
+                total -= sizes[name]
+        with self._lock:
+            resident = set(self._resident) | set(self._unloading)
+            last_access = dict(self._last_access)
+
+        # 3. 디스크 저장본 TTL/예산 점검 (메모리에 올라온 인덱스는 제외)
+        if os.path.isdir(self.base_dir):
+            stored = []
+            for name in os.listdir(self.base_dir):
+                meta_path = os.path.join(self.base_dir, name, 'meta.json')
+                if not os.path.exists(meta_path):
+                    continue
+                last = last_access.get(name, os.path.getmtime(meta_path))
+                path = os.path.join(self.base_dir, name)
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                stored.append((last, name, size))
+            stored.sort()
+            total = sum(size for _, _, size in stored)
+            for last, name, size in stored:
+                if name in resident:
+                    continue
+                if now - last > self.disk_ttl:
+                    self.remove_from_disk(name, 'disk_ttl')
+                    total -= size
+                elif total > self.disk_budget:
+                    self.remove_from_disk(name, 'disk_budget')
+                    total -= size
+
+        # 4. 세션이 없어진 ChromaDB 컬렉션 정리
+        self.cleanup_orphans()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'resident_indexes': len(self._resident),
+                'resident_bytes': sum(index.resident_bytes() for index in self._resident.values()),
+                'leased_indexes': len(self._in_use),
+                'memory_budget_bytes': self.memory_budget,
+                'disk_budget_bytes': self.disk_budget,
+                'evictions': self.evictions,
+                'reclaimed_bytes': self.reclaimed_bytes
+            }
+
+
+index_manager = IndexLifecycleManager()
+
+
+def create_index(session_id: str, n_chunks: int, kind: str = 'repo') -> VectorIndex:
+    """
+    세션의 새 인덱스를 생성 (기존 인덱스는 삭제)
+
+    청크 수가 NUMPY_INDEX_MAX_CHUNKS 이하이면 NumPy 완전 탐색 인덱스를,
+    그보다 크면 ChromaDB(HNSW) 컬렉션을 사용합니다.
+
+    Args:
+        session_id (str): 세션 ID
+        n_chunks (int): 저장할 청크 수
+        kind (str): 인덱스 종류 ('repo', 'files' 또는 'roles')
+
+    Returns:
+        VectorIndex: 새로 생성된 인덱스
+    """
+    delete_index(session_id, kind)
+    name = index_name(session_id, kind)
+    if n_chunks <= NUMPY_INDEX_MAX_CHUNKS:
+        index = NumpyVectorIndex(name)
+    else:
+        index = ChromaVectorIndex(name)
+    print(f"[DEBUG] 벡터 인덱스 생성: {name} (백엔드: {index.backend}, 청크 수: {n_chunks})")
+    index_manager.register(name, index)
+    return index
+
+
+def open_index(session_id: str, kind: str = 'repo') -> Optional[VectorIndex]:
+    """
+    세션의 기존 인덱스를 열기
+
+    메모리에서 제거된 인덱스는 디스크 저장본에서 다시 로드됩니다.
+
+    Returns:
+        Optional[VectorIndex]: 인덱스 또는 None (분석되지 않았거나 디스크에서도 삭제된 세션)
+    """
+    return index_manager.get(index_name(session_id, kind))
+
+
+class IndexLeases:
+    """
+    인덱스 대여 묶음
+
+    with 블록 안에서 open/create로 연 인덱스는 블록이 끝날 때까지 대여 상태로 남아,
+    다른 스레드의 수명 관리 점검이 사용 중인 인덱스를 내리지(ChromaDB 컬렉션 삭제 등) 않습니다.
+    여러 스레드에서 같은 묶음으로 인덱스를 열어도 됩니다.
+    """
+
+    def __init__(self):
+        self._names: List[str] = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _keep(self, name: str):
+        with self._lock:
+            if not self._closed:
+                self._names.append(name)
+                return
+        # 블록이 끝난 뒤에 끝난 open(블록에서 기다리지 않은 백그라운드 작업)은 바로 반납
+        index_manager.release(name)
+
+    def open(self, session_id: str, kind: str = 'repo') -> Optional[VectorIndex]:
+        """open_index와 같지만 블록이 끝날 때까지 대여"""
+        name = index_name(session_id, kind)
+        index = index_manager.acquire(name)
+        if index is not None:
+            self._keep(name)
+        return index
+
+    def create(self, session_id: str, n_chunks: int, kind: str = 'repo') -> VectorIndex:
+        """create_index와 같지만 블록이 끝날 때까지 대여 (구축 중에 내려지지 않도록)"""
+        index = create_index(session_id, n_chunks, kind)
+        name = index_name(session_id, kind)
+        index_manager.acquire(name)
+        self._keep(name)
+        return index
+
+    def __enter__(self) -> "IndexLeases":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            names, self._names = self._names, []
+            self._closed = True
+        for name in names:
+            index_manager.release(name)
+
+
+def delete_index(session_id: str, kind: str = 'repo'):
+    """세션 인덱스를 모든 백엔드에서 삭제"""
+    name = index_name(session_id, kind)
+    index = index_manager.forget(name)
+    if index is not None:
+        index.drop()
+    if NumpyVectorIndex.exists(name):
+        NumpyVectorIndex(name).drop()
+    if _chroma_collection_exists(name):
+        ChromaVectorIndex(name, create=False).drop()